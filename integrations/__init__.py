@@ -6,8 +6,16 @@ to external services and tools.
 
 Available Integrations:
 - comfyui_integration: ComfyUI image/video generation
+- comfyui_async: asyncio variant of the ComfyUI integration (needs httpx)
 """
 
 from .comfyui_integration import ComfyUIMeshAgent, run_mesh_integration
 
 __all__ = ['ComfyUIMeshAgent', 'run_mesh_integration']
+
+try:
+    from .comfyui_async import AsyncComfyUIMeshAgent, run_async_mesh_integration
+except ImportError:  # httpx not installed
+    pass
+else:
+    __all__ += ['AsyncComfyUIMeshAgent', 'run_async_mesh_integration']
@@ -0,0 +1,150 @@
+"""
+Admission control from ComfyUI's own load
+
+Samples ComfyUI's ``GET /queue`` and ``GET /system_stats`` every few
+seconds and admits a job only while ComfyUI's queue (running plus pending,
+including prompts submitted since the last sample) is below
+``target_depth`` and free VRAM is above ``min_free_vram``. Everything else
+waits in the local scheduler, where it can still be reprioritized,
+coalesced or cancelled, and the requester is told when it should start.
+
+The controller only holds state; the agents run the sampling loop and
+feed it with ``update``. If samples go stale (ComfyUI unreachable) the
+locally tracked in-flight count is used instead.
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Seconds between ComfyUI samples
+SAMPLE_INTERVAL = 2.0
+
+# Samples older than this are ignored
+STALE_AFTER = 10.0
+
+# Prompts allowed in ComfyUI (running + pending) before jobs are held
+TARGET_DEPTH = 2
+
+# Lowest free VRAM fraction at which more work is admitted (an idle GPU is always fed)
+MIN_FREE_VRAM = 0.05
+
+# Assumed seconds per job until completions have been observed
+DEFAULT_RUN_SECONDS = 15.0
+
+# Weight of the newest observation in the run-time average
+RUN_SECONDS_ALPHA = 0.2
+
+MB = 1024 * 1024
+
+
+def queue_depth(queue: Dict[str, Any]) -> int:
+    """Running plus pending prompts in a ComfyUI ``/queue`` response."""
+    return len(queue.get("queue_running") or []) + len(queue.get("queue_pending") or [])
+
+
+def free_vram_fraction(system_stats: Dict[str, Any]) -> Optional[float]:
+    """Lowest ``vram_free / vram_total`` across GPUs in ``/system_stats``, or None."""
+    fractions = [
+        device["vram_free"] / device["vram_total"]
+        for device in system_stats.get("devices") or []
+        if device.get("vram_total") and device.get("vram_free") is not None
+    ]
+    return min(fractions) if fractions else None
+
+
+def gpu_summary(system_stats: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Name and VRAM (MB) of each GPU in ``/system_stats``."""
+    return [
+        {
+            "name": device.get("name"),
+            "vram_total_mb": round(device["vram_total"] / MB),
+            "vram_free_mb": round((device.get("vram_free") or 0) / MB),
+        }
+        for device in system_stats.get("devices") or []
+        if device.get("vram_total")
+    ]
+
+
+class AdmissionController:
+    """Decides whether another prompt may go to ComfyUI right now."""
+
+    def __init__(self, target_depth: int = TARGET_DEPTH, min_free_vram: float = MIN_FREE_VRAM,
+                 stale_after: float = STALE_AFTER, sample_interval: float = SAMPLE_INTERVAL):
+        self.target_depth = target_depth
+        self.min_free_vram = min_free_vram
+        self.stale_after = stale_after
+        self.sample_interval = sample_interval
+        self.queue_depth: Optional[int] = None
+        self.free_vram: Optional[float] = None
+        self.gpus: List[Dict[str, Any]] = []
+        self.sampled_at: Optional[float] = None
+        self.run_seconds = DEFAULT_RUN_SECONDS
+        self.samples = 0
+        self.sample_errors = 0
+        self._lock = threading.Lock()
+
+    def update(self, queue: Optional[Dict[str, Any]], system_stats: Optional[Dict[str, Any]],
+               sampled_at: Optional[float] = None):
+        """Record a sample; ``sampled_at`` is the monotonic time the requests started."""
+        with self._lock:
+            if queue is None:
+                self.sample_errors += 1
+                return
+            self.queue_depth = queue_depth(queue)
+            self.free_vram = free_vram_fraction(system_stats or {})
+            self.gpus = gpu_summary(system_stats or {})
+            self.sampled_at = time.monotonic() if sampled_at is None else sampled_at
+            self.samples += 1
+
+    def observe(self, run_seconds: Optional[float]):
+        """Fold a finished job's GPU time into the start-time estimate."""
+        if not run_seconds or run_seconds <= 0:
+            return
+        with self._lock:
+            self.run_seconds += RUN_SECONDS_ALPHA * (run_seconds - self.run_seconds)
+
+    def _fresh(self) -> bool:
+        return self.sampled_at is not None and time.monotonic() - self.sampled_at <= self.stale_after
+
+    def depth(self, in_flight) -> int:
+        """ComfyUI queue depth as of now, given the caller's ``InFlight`` prompts."""
+        with self._lock:
+            if not self._fresh():
+                return len(in_flight)
+            return self.queue_depth + in_flight.submitted_since(self.sampled_at)
+
+    def free_slots(self, in_flight, starting: int = 0) -> int:
+        """Prompts that may still be submitted; ``starting`` are already on their way."""
+        depth = self.depth(in_flight) + starting
+        with self._lock:
+            low_vram = self._fresh() and self.free_vram is not None and self.free_vram < self.min_free_vram
+        free = max(0, self.target_depth - depth)
+        if low_vram:
+            # Only an idle GPU is fed while VRAM is short
+            return min(free, 1) if depth == 0 else 0
+        return free
+
+    def admit(self, in_flight, ahead: int = 0) -> bool:
+        """True if another prompt may be submitted (after ``ahead`` already waiting)."""
+        return ahead < self.free_slots(in_flight)
+
+    def estimate_start(self, ahead: int, in_flight) -> float:
+        """Seconds until a job with ``ahead`` local jobs before it starts running."""
+        with self._lock:
+            run_seconds = self.run_seconds
+        return round((self.depth(in_flight) + ahead) * run_seconds, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        """Last sample and estimate inputs."""
+        with self._lock:
+            return {
+                "comfyui_queue_depth": self.queue_depth,
+                "free_vram": round(self.free_vram, 3) if self.free_vram is not None else None,
+                "gpus": self.gpus,
+                "sample_age_seconds": round(time.monotonic() - self.sampled_at, 1) if self.sampled_at else None,
+                "target_depth": self.target_depth,
+                "run_seconds_estimate": round(self.run_seconds, 2),
+                "samples": self.samples,
+                "sample_errors": self.sample_errors,
+            }
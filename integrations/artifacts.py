@@ -0,0 +1,394 @@
+"""
+Content-addressed artifact store
+
+Generated images and videos are kept once per distinct content, under the
+SHA-256 of their bytes, in sharded directories
+(``objects/ab/cd/abcd...``). Adding a file that is already stored costs a
+hash and nothing else. Adding a file from a local ComfyUI output
+directory hard-links it when both are on one filesystem, so the bytes are
+never copied; streamed outputs are hashed while they are written to a
+temporary file. ``link(digest, path)`` gives an artifact another name the
+same way. Objects are never modified in place.
+
+A SQLite index (``index.db``) records size, content type and last use.
+Past ``max_bytes`` the least recently used objects are deleted.
+
+``ArtifactServer`` serves ``GET``/``HEAD /artifacts/<sha256>`` from a
+daemon thread on loopback. Files are read through ``mmap``, so concurrent
+readers share the page cache instead of each copying the file into its
+own buffers. Single byte ranges (``Range: bytes=a-b``, ``a-``, ``-n``)
+are answered with ``206``, so co-located agents can seek in videos or
+resume downloads without going through the mesh database.
+
+Usage:
+    from integrations.artifacts import ArtifactServer, ArtifactStore
+
+    store = ArtifactStore("/var/lib/mesh/artifacts", max_bytes=50 * 1024 ** 3)
+    digest = store.add_file("/opt/ComfyUI/output/mesh_generated_00001_.png")
+    server = ArtifactServer(store, port=8490)
+    server.start()
+    print(server.url_for(digest))
+"""
+
+import hashlib
+import mimetypes
+import mmap
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+# Disk quota for stored objects
+MAX_BYTES = 20 * 1024 ** 3
+# Bytes per read when hashing or copying
+CHUNK_SIZE = 1024 * 1024
+
+# Server binds to loopback unless told otherwise
+ARTIFACT_HOST = "127.0.0.1"
+# Bytes of the mapped file written per socket send
+SEND_CHUNK = 1024 * 1024
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file, read in ``CHUNK_SIZE`` pieces."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive ``(start, end)`` of a ``Range`` header; None for the whole file.
+
+    Raises ``ValueError`` if the range cannot be satisfied. Multi-range
+    requests are answered with the whole file, which RFC 9110 allows.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length or not size:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("range outside the file")
+    return start, end
+
+
+class ArtifactWriter:
+    """Hashes bytes while writing them to a temporary file in the store."""
+
+    def __init__(self, store: "ArtifactStore", content_type: Optional[str] = None):
+        self.store = store
+        self.content_type = content_type
+        self.size = 0
+        self._digest = hashlib.sha256()
+        fd, self._tmp = tempfile.mkstemp(dir=store.tmp_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        self._digest.update(data)
+        self.size += len(data)
+
+    def commit(self) -> str:
+        """Move the bytes into the store; returns their SHA-256."""
+        self._file.close()
+        digest = self._digest.hexdigest()
+        self.store._adopt(self._tmp, digest, self.size, self.content_type)
+        return digest
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.unlink(self._tmp)
+        except FileNotFoundError:
+            pass
+
+
+class ArtifactStore:
+    """SHA-256 keyed files on local disk with an LRU quota."""
+
+    def __init__(self, root: str, max_bytes: int = MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, "objects")
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS artifacts (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                content_type TEXT,
+                created_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+        """)
+        self._lock = threading.Lock()
+        self.added = 0
+        self.deduplicated = 0
+        self.linked = 0
+        self.evictions = 0
+
+    def path(self, digest: str) -> str:
+        """Where an object lives (whether or not it is stored)."""
+        return os.path.join(self.objects_dir, digest[:2], digest[2:4], digest)
+
+    def __contains__(self, digest: str) -> bool:
+        return self.get(digest, touch=False) is not None
+
+    def get(self, digest: str, touch: bool = True) -> Optional[Dict[str, Any]]:
+        """Index entry of a stored object, or None; ``touch`` marks it used."""
+        if not DIGEST_RE.match(digest or ""):
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, content_type, created_at FROM artifacts WHERE sha256 = ?", (digest,)
+            ).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(self.path(digest)):
+                # Removed behind the index's back
+                self._db.execute("DELETE FROM artifacts WHERE sha256 = ?", (digest,))
+                return None
+            if touch:
+                self._db.execute("UPDATE artifacts SET used_at = ? WHERE sha256 = ?", (time.time(), digest))
+        return {"sha256": digest, "size": row[0], "content_type": row[1], "created_at": row[2],
+                "path": self.path(digest)}
+
+    def add_file(self, path: str, content_type: Optional[str] = None) -> str:
+        """Store a local file, hard-linking it when possible; returns its SHA-256."""
+        digest = file_digest(path)
+        content_type = content_type or mimetypes.guess_type(path)[0]
+        if self.get(digest) is not None:
+            with self._lock:
+                self.deduplicated += 1
+            return digest
+        fd, tmp = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        os.unlink(tmp)
+        try:
+            os.link(path, tmp)
+            linked = True
+        except OSError:
+            # Another filesystem, or links not supported
+            shutil.copyfile(path, tmp)
+            linked = False
+        self._adopt(tmp, digest, os.path.getsize(tmp), content_type)
+        if linked:
+            with self._lock:
+                self.linked += 1
+        return digest
+
+    def add_stream(self, chunks: Iterable[bytes], content_type: Optional[str] = None) -> str:
+        """Store bytes from an iterable; returns their SHA-256."""
+        writer = self.writer(content_type)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def writer(self, content_type: Optional[str] = None) -> ArtifactWriter:
+        """Incremental ``add_stream`` for callers that push bytes (the asyncio agent)."""
+        return ArtifactWriter(self, content_type)
+
+    def _adopt(self, tmp: str, digest: str, size: int, content_type: Optional[str]):
+        target = self.path(digest)
+        now = time.time()
+        with self._lock:
+            if os.path.exists(target):
+                os.unlink(tmp)
+                self.deduplicated += 1
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp, target)
+                self.added += 1
+            self._db.execute(
+                "INSERT INTO artifacts (sha256, size, content_type, created_at, used_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(sha256) DO UPDATE SET used_at = excluded.used_at",
+                (digest, size, content_type, now, now)
+            )
+            self._evict(keep=digest)
+
+    def link(self, digest: str, dest: str) -> bool:
+        """Give a stored artifact another name (hard link, else copy); False if unknown."""
+        if self.get(digest) is None:
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        try:
+            os.link(self.path(digest), dest)
+        except FileExistsError:
+            return os.path.samefile(self.path(digest), dest) or file_digest(dest) == digest
+        except OSError:
+            shutil.copyfile(self.path(digest), dest)
+        return True
+
+    def chunks(self, digest: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Read a stored artifact in pieces."""
+        with open(self.path(digest), "rb") as f:
+            yield from iter(lambda: f.read(chunk_size), b"")
+
+    def remove(self, digest: str) -> bool:
+        with self._lock:
+            return self._delete(digest)
+
+    def _delete(self, digest: str) -> bool:
+        deleted = self._db.execute("DELETE FROM artifacts WHERE sha256 = ?", (digest,)).rowcount
+        try:
+            # Open readers (mmaps, downloads) keep the inode until they finish
+            os.unlink(self.path(digest))
+        except FileNotFoundError:
+            pass
+        return bool(deleted)
+
+    def _evict(self, keep: Optional[str] = None):
+        (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+        if total <= self.max_bytes:
+            return
+        for digest, size in self._db.execute("SELECT sha256, size FROM artifacts ORDER BY used_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            self._delete(digest)
+            self.evictions += 1
+            total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts"
+            ).fetchone()
+            return {
+                "artifacts": count,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "added": self.added,
+                "deduplicated": self.deduplicated,
+                "linked": self.linked,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class _ArtifactHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store: ArtifactStore = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _error(self, status: int, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _serve(self, body: bool):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        entry = self.store.get(parts[1]) if len(parts) == 2 and parts[0] == "artifacts" else None
+        if entry is None:
+            return self._error(404)
+        digest = entry["sha256"]
+        if self.headers.get("If-None-Match", "").strip('"') == digest:
+            return self._error(304, {"ETag": f'"{digest}"'})
+        try:
+            f = open(entry["path"], "rb")
+        except FileNotFoundError:
+            return self._error(404)
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            try:
+                requested = byte_range(self.headers.get("Range"), size)
+            except ValueError:
+                return self._error(416, {"Content-Range": f"bytes */{size}"})
+            start, end = requested or (0, size - 1)
+            self.send_response(206 if requested else 200)
+            self.send_header("Content-Type", entry["content_type"] or "application/octet-stream")
+            self.send_header("Content-Length", str(end - start + 1 if size else 0))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", f'"{digest}"')
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+            if requested:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+            if not body or not size:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(start, end + 1, SEND_CHUNK):
+                        self.wfile.write(view[offset:min(offset + SEND_CHUNK, end + 1)])
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading (seeking video players do this)
+                    self.close_connection = True
+                finally:
+                    view.release()
+
+
+class ArtifactServer:
+    """Serves an ``ArtifactStore`` over HTTP with Range support."""
+
+    def __init__(self, store: ArtifactStore, port: int = 0, host: str = ARTIFACT_HOST):
+        self.store = store
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def url_for(self, digest: str) -> str:
+        return f"{self.url}/artifacts/{digest}"
+
+    def start(self) -> str:
+        """Serve from a daemon thread; ``port=0`` picks a free port. Returns the base URL."""
+        handler = type("ArtifactHandler", (_ArtifactHandler,), {"store": self.store})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_port
+        threading.Thread(target=self._server.serve_forever, name="artifact-http", daemon=True).start()
+        print(f"Artifacts on {self.url}/artifacts/<sha256>")
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
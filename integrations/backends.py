@@ -0,0 +1,313 @@
+"""
+ComfyUI backend pool
+
+One agent can front several ComfyUI instances. Each ``Backend`` carries
+its capability tags (the model files it has, the largest width or height
+it renders) and its own load: prompts in flight, an
+``AdmissionController`` fed from its ``/queue`` and ``/system_stats``,
+and, with completion tracking, a ``CompletionTracker`` on its event
+stream.
+
+Backends whose circuit breaker is open are skipped until a probe closes
+it again.
+
+``BackendPool.choose`` sends a workflow to a capable backend with the
+least outstanding work (``least_outstanding``) or the earliest estimated
+completion (``earliest_completion``, which also weighs each backend's
+observed run time). Backends can be added and removed while the agent
+runs; a removed backend takes no new prompts and leaves the pool once its
+in-flight prompts have finished.
+
+For the dispatcher the pool stands in for a single ``AdmissionController``:
+a job is admitted while any available backend has room for it. With
+every breaker open, jobs are not held: they are released and fail fast.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Collection, Dict, FrozenSet, List, Optional, Tuple
+
+from .admission import AdmissionController
+from .breaker import CircuitBreaker, CircuitOpenError
+from .scheduler import DEFAULT_PRIORITY, InFlight, workflow_models
+
+ROUTING = ("earliest_completion", "least_outstanding")
+
+# Submitted prompts whose backend is remembered until they finish
+PROMPTS_LIMIT = 10000
+
+
+def workflow_requirements(workflow: Dict[str, Any]) -> Tuple[FrozenSet[str], int]:
+    """Model files a workflow loads and the largest width/height it renders."""
+    size = 0
+    for node in workflow.values():
+        if not isinstance(node, dict):
+            continue
+        inputs = node.get("inputs", {})
+        for key in ("width", "height"):
+            if isinstance(inputs.get(key), (int, float)):
+                size = max(size, int(inputs[key]))
+    return workflow_models(workflow), size
+
+
+class Backend:
+    """One ComfyUI instance, its capabilities and its load."""
+
+    def __init__(self, url: str, name: Optional[str] = None,
+                 models: Optional[Collection[str]] = None, max_resolution: Optional[int] = None,
+                 admission: Optional[AdmissionController] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 output_dir: Optional[str] = None):
+        self.url = url.rstrip("/")
+        self.name = name or self.url
+        # ComfyUI's output directory when it is on this machine (lets outputs be hard-linked)
+        self.output_dir = output_dir
+        # None means unknown: any model is assumed present
+        self.models = frozenset(models) if models is not None else None
+        self.max_resolution = max_resolution
+        self.admission = admission or AdmissionController()
+        self.breaker = breaker or CircuitBreaker(self.name)
+        self.in_flight = InFlight()
+        # Chosen for a prompt whose submission has not returned yet
+        self.starting = 0
+        self.submitted = 0
+        self.draining = False
+        self.tracker = None
+
+    @property
+    def distributed_url(self) -> str:
+        return f"{self.url}/distributed"
+
+    def output_path(self, output: Dict[str, Any]) -> Optional[str]:
+        """Local path of a ``type: output`` file, if ``output_dir`` is set and it exists."""
+        if not self.output_dir or output.get("type", "output") != "output":
+            return None
+        root = os.path.realpath(self.output_dir)
+        path = os.path.realpath(os.path.join(root, output.get("subfolder") or "", output["filename"]))
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            return None
+        return path
+
+    def supports(self, models: Collection[str], resolution: int = 0) -> bool:
+        """True if every model is present and the resolution is within limits."""
+        if self.models is not None and not self.models.issuperset(models):
+            return False
+        return not self.max_resolution or resolution <= self.max_resolution
+
+    def outstanding(self) -> int:
+        """Prompts queued or running here, including ones being submitted."""
+        return self.admission.depth(self.in_flight) + self.starting
+
+    def free_slots(self) -> int:
+        return self.admission.free_slots(self.in_flight, self.starting)
+
+    def estimated_completion(self) -> float:
+        """Seconds until a prompt submitted now would finish."""
+        return (self.outstanding() + 1) * self.admission.run_seconds
+
+    def describe(self) -> Dict[str, Any]:
+        """Capabilities as announced to the mesh."""
+        return {
+            "name": self.name,
+            "url": self.url,
+            "models": sorted(self.models) if self.models is not None else None,
+            "max_resolution": self.max_resolution,
+            "status": "available" if self.breaker.available else "unavailable",
+        }
+
+
+class BackendPool:
+    """Thread-safe set of backends with capability-aware, least-loaded routing.
+
+    ``on_added(backend)`` and ``on_removed(backend)`` are called outside the
+    lock when a backend joins or, after draining, leaves the pool.
+    """
+
+    def __init__(self, backends: Collection[Backend] = (), routing: str = ROUTING[0]):
+        if routing not in ROUTING:
+            raise ValueError(f"Unknown routing {routing!r}, expected one of {ROUTING}")
+        self.routing = routing
+        self._backends: "OrderedDict[str, Backend]" = OrderedDict()
+        # prompt_id -> backend it was submitted to
+        self._prompts: "OrderedDict[str, Backend]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.on_added: Optional[Callable[[Backend], None]] = None
+        self.on_removed: Optional[Callable[[Backend], None]] = None
+        self.unroutable = 0
+        for backend in backends:
+            self._backends[backend.name] = backend
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._backends)
+
+    def backends(self) -> List[Backend]:
+        """Snapshot of every backend, draining ones included."""
+        with self._lock:
+            return list(self._backends.values())
+
+    def get(self, name: Optional[str]) -> Optional[Backend]:
+        with self._lock:
+            return self._backends.get(name)
+
+    def add(self, backend: Backend) -> Backend:
+        """Start routing to a backend."""
+        with self._lock:
+            if backend.name in self._backends:
+                raise ValueError(f"Backend {backend.name!r} is already in the pool")
+            self._backends[backend.name] = backend
+        if self.on_added:
+            self.on_added(backend)
+        return backend
+
+    def remove(self, name: str) -> bool:
+        """Stop routing to a backend; it leaves once its prompts have finished."""
+        with self._lock:
+            backend = self._backends.get(name)
+            if backend is None:
+                return False
+            backend.draining = True
+            drained = self._drop_if_drained(backend)
+        if drained and self.on_removed:
+            self.on_removed(backend)
+        return True
+
+    def _drop_if_drained(self, backend: Backend) -> bool:
+        if not backend.draining or backend.starting or len(backend.in_flight):
+            return False
+        if self._backends.get(backend.name) is backend:
+            del self._backends[backend.name]
+        return True
+
+    def _cost(self, backend: Backend) -> float:
+        if self.routing == "least_outstanding":
+            return backend.outstanding()
+        return backend.estimated_completion()
+
+    def choose(self, workflow: Dict[str, Any]) -> Optional[Backend]:
+        """Reserve the best backend for a workflow; None if no backend can run it.
+
+        Raises ``CircuitOpenError`` if capable backends exist but all are
+        unavailable. Every successful ``choose`` must be followed by
+        ``assign`` or ``abandon``.
+        """
+        models, resolution = workflow_requirements(workflow)
+        with self._lock:
+            capable = [b for b in self._backends.values() if not b.draining and b.supports(models, resolution)]
+            if not capable:
+                self.unroutable += 1
+                return None
+            available = [b for b in capable if b.breaker.available]
+            if not available:
+                raise CircuitOpenError("ComfyUI", min(b.breaker.retry_after() for b in capable))
+            # Prefer backends with room; otherwise queue on the least loaded one
+            ready = [b for b in available if b.free_slots() > 0] or available
+            backend = min(ready, key=self._cost)
+            backend.starting += 1
+            return backend
+
+    def assign(self, prompt_id: str, backend: Backend, priority: str = DEFAULT_PRIORITY):
+        """Record a submitted prompt on the backend ``choose`` reserved."""
+        with self._lock:
+            backend.starting -= 1
+            backend.submitted += 1
+            backend.in_flight.add(prompt_id, priority)
+            drained = self._remember(prompt_id, backend)
+        if drained and self.on_removed:
+            self.on_removed(drained)
+
+    def adopt(self, prompt_id: str, backend: Backend, priority: str = DEFAULT_PRIORITY):
+        """Record a prompt submitted by an earlier run, without a reservation."""
+        with self._lock:
+            backend.in_flight.add(prompt_id, priority)
+            drained = self._remember(prompt_id, backend)
+        if drained and self.on_removed:
+            self.on_removed(drained)
+
+    def _remember(self, prompt_id: str, backend: Backend) -> Optional[Backend]:
+        # Caller holds the lock. A prompt evicted past PROMPTS_LIMIT is never
+        # finished, so its slot is released here; returns a backend it drained
+        self._prompts[prompt_id] = backend
+        if len(self._prompts) <= PROMPTS_LIMIT:
+            return None
+        evicted_id, evicted = self._prompts.popitem(last=False)
+        evicted.in_flight.discard(evicted_id)
+        return evicted if self._drop_if_drained(evicted) else None
+
+    def abandon(self, backend: Backend):
+        """Release a reservation whose submission failed."""
+        with self._lock:
+            backend.starting -= 1
+            drained = self._drop_if_drained(backend)
+        if drained and self.on_removed:
+            self.on_removed(backend)
+
+    def backend_for(self, prompt_id: str) -> Optional[Backend]:
+        """Backend a prompt was submitted to, while it is remembered."""
+        with self._lock:
+            return self._prompts.get(prompt_id)
+
+    def finish(self, prompt_id: str) -> Optional[Backend]:
+        """Forget a finished prompt; returns the backend that ran it."""
+        with self._lock:
+            backend = self._prompts.pop(prompt_id, None)
+            if backend is None:
+                return None
+            backend.in_flight.discard(prompt_id)
+            drained = self._drop_if_drained(backend)
+        if drained and self.on_removed:
+            self.on_removed(backend)
+        return backend
+
+    def _routable(self) -> List[Backend]:
+        return [b for b in self._backends.values() if not b.draining and b.breaker.available]
+
+    # The dispatcher's admission interface; in_flight is unused because
+    # every backend counts its own prompts.
+
+    def admit(self, in_flight=None, ahead: int = 0) -> bool:
+        """True while the backends together have room beyond ``ahead`` waiting jobs."""
+        with self._lock:
+            backends = self._routable()
+            # Nothing reachable: release jobs so they fail fast instead of waiting
+            return not backends or ahead < sum(b.free_slots() for b in backends)
+
+    def estimate_start(self, ahead: int, in_flight=None) -> float:
+        """Seconds until a job with ``ahead`` jobs before it starts, across all backends."""
+        with self._lock:
+            backends = self._routable()
+            if not backends:
+                return 0.0
+            work = sum(b.outstanding() for b in backends) + ahead
+            rate = sum(1.0 / b.admission.run_seconds for b in backends)
+        return round(work / rate, 1)
+
+    def availability(self) -> str:
+        """``available``, ``degraded`` (some backends down) or ``unavailable``."""
+        with self._lock:
+            backends = [b for b in self._backends.values() if not b.draining]
+            up = sum(1 for b in backends if b.breaker.available)
+        if not up:
+            return "unavailable"
+        return "available" if up == len(backends) else "degraded"
+
+    def stats(self) -> Dict[str, Any]:
+        """Routing policy and load, capabilities, admission and breaker state per backend."""
+        with self._lock:
+            backends = list(self._backends.values())
+            return {
+                "routing": self.routing,
+                "unroutable": self.unroutable,
+                "backends": {
+                    b.name: {
+                        **b.describe(),
+                        "draining": b.draining,
+                        "outstanding": b.outstanding(),
+                        "submitted": b.submitted,
+                        "admission": b.admission.stats(),
+                        "breaker": b.breaker.stats(),
+                    }
+                    for b in backends
+                },
+            }
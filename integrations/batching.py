@@ -0,0 +1,187 @@
+"""
+Latent micro-batching of image requests
+
+Compatible ``image_generation`` requests arriving within a short window
+are submitted to ComfyUI as one workflow whose ``EmptyLatentImage`` has
+``batch_size`` N, so the checkpoint, text encoders and sampler run once
+for N images instead of N times. Each requester gets the shared
+``prompt_id`` plus its ``batch`` index, and its own image from the outputs.
+
+A latent batch shares one seed and one conditioning, so requests are
+compatible only when they render the same workflow apart from
+``batch_size`` (same checkpoint, resolution, steps, sampler, cfg and
+prompt text) and do not pin a ``seed``. Pinned seeds are submitted alone
+so they stay reproducible.
+
+Requests reach the batcher only once the dispatcher runs them, so a batch
+can never be larger than the ``image_generation`` type limit. The agents
+size ``max_batch`` to that limit (``batch_limit``).
+"""
+
+import asyncio
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .coalescing import workflow_key
+from .workflows import WorkflowTemplate
+
+# Seconds the first request of a batch waits for compatible ones
+BATCH_WINDOW = 0.05
+
+# Largest latent batch submitted at once (the default image_generation limit)
+MAX_BATCH = 4
+
+
+def batch_limit(max_batch: Optional[int], image_limit: int) -> int:
+    """``max_batch`` capped by how many image requests may run at once (the cap if None)."""
+    return image_limit if max_batch is None else min(max_batch, image_limit)
+
+
+def batchable(template: WorkflowTemplate, options: Optional[dict]) -> bool:
+    """True if a request may share a latent batch with others."""
+    return "batch_size" in template.slots and "seed" not in (options or {})
+
+
+def batch_key(template: WorkflowTemplate, prompt: Optional[dict], options: Optional[dict]) -> str:
+    """Compatibility key: the workflow as rendered for a single image."""
+    return template.name + ":" + workflow_key(template.render(prompt, {**(options or {}), "batch_size": 1}))
+
+
+def split_batch_result(result: Dict[str, Any], batch: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Narrow a batched completion result to one requester's outputs."""
+    if not batch:
+        return result
+    outputs = result.get("outputs", [])
+    size, index = batch["size"], batch["index"]
+    if len(outputs) % size == 0 and outputs:
+        # SaveImage writes one file per batch item, in batch order
+        per_item = len(outputs) // size
+        outputs = outputs[index * per_item:(index + 1) * per_item]
+    return {**result, "outputs": outputs, "batch": batch}
+
+
+class Batch:
+    """Requests collected for one latent batch."""
+
+    def __init__(self, key: str, prompt: Optional[dict], options: Optional[dict], full, done):
+        self.key = key
+        self.prompt = prompt
+        self.options = dict(options or {})
+        self.size = 0
+        self.full = full
+        self.done = done
+        self.response: Optional[Dict[str, Any]] = None
+
+
+class LatentBatcher:
+    """Groups compatible requests and submits each group once.
+
+    ``queue(name, prompt, options)`` submits a workflow and returns the
+    ComfyUI response; for batches of one it is called with the request's
+    own options, otherwise with ``batch_size`` set.
+    """
+
+    def __init__(self, queue: Callable[[str, dict, dict], Any],
+                 window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH):
+        self.queue = queue
+        self.window = window
+        self.max_batch = max_batch
+        self._open: Dict[str, Batch] = {}
+        self._lock = threading.Lock()
+        self.sizes: Counter = Counter()
+        # on_batch(size) for every batch submitted
+        self.on_batch: Optional[Callable[[int], None]] = None
+
+    def _events(self):
+        return threading.Event(), threading.Event()
+
+    def _join(self, template: WorkflowTemplate, prompt: Optional[dict],
+              options: Optional[dict]) -> Tuple[Batch, int, bool]:
+        key = batch_key(template, prompt, options)
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = Batch(key, prompt, options, *self._events())
+            index = batch.size
+            batch.size += 1
+            if batch.size >= self.max_batch:
+                del self._open[key]
+                batch.full.set()
+            return batch, index, leader
+
+    def _close(self, batch: Batch) -> int:
+        with self._lock:
+            if self._open.get(batch.key) is batch:
+                del self._open[batch.key]
+            self.sizes[batch.size] += 1
+        if self.on_batch:
+            self.on_batch(batch.size)
+        return batch.size
+
+    def _batch_options(self, batch: Batch) -> Dict[str, Any]:
+        return {**batch.options, "batch_size": batch.size} if batch.size > 1 else batch.options
+
+    @staticmethod
+    def _member_response(batch: Batch, index: int) -> Dict[str, Any]:
+        response = batch.response or {"error": "batch was not submitted"}
+        if batch.size == 1 or "error" in response:
+            return response
+        member = {"size": batch.size, "index": index}
+        if response.get("status") == "completed":
+            # Answered from the result cache: outputs are already known
+            return split_batch_result(response, member)
+        return {**response, "batch": member}
+
+    def submit(self, template: WorkflowTemplate, prompt: Optional[dict],
+               options: Optional[dict]) -> Dict[str, Any]:
+        """Add a request to a batch; blocks until the batch is submitted."""
+        batch, index, leader = self._join(template, prompt, options)
+        if leader:
+            batch.full.wait(self.window)
+            self._close(batch)
+            try:
+                batch.response = self.queue(template.name, batch.prompt, self._batch_options(batch))
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+        return self._member_response(batch, index)
+
+    def stats(self) -> Dict[str, Any]:
+        """Achieved batch sizes: count per size, requests and mean size."""
+        with self._lock:
+            sizes = dict(sorted(self.sizes.items()))
+        batches = sum(sizes.values())
+        requests = sum(size * count for size, count in sizes.items())
+        return {
+            "batches": batches,
+            "requests": requests,
+            "mean_batch_size": round(requests / batches, 3) if batches else 0.0,
+            "batch_sizes": sizes,
+        }
+
+
+class AsyncLatentBatcher(LatentBatcher):
+    """LatentBatcher for one event loop; ``queue`` is a coroutine function."""
+
+    def _events(self):
+        return asyncio.Event(), asyncio.Event()
+
+    async def submit(self, template: WorkflowTemplate, prompt: Optional[dict],
+                     options: Optional[dict]) -> Dict[str, Any]:
+        batch, index, leader = self._join(template, prompt, options)
+        if leader:
+            try:
+                await asyncio.wait_for(batch.full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._close(batch)
+            try:
+                batch.response = await self.queue(template.name, batch.prompt, self._batch_options(batch))
+            finally:
+                batch.done.set()
+        else:
+            await batch.done.wait()
+        return self._member_response(batch, index)
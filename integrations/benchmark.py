@@ -0,0 +1,267 @@
+"""
+Throughput and latency benchmark against in-process stubs
+
+Starts a ``StubMesh`` and a ``StubComfyUI`` (``stubs.py``), points a
+``ComfyUIMeshAgent`` at them and feeds it a synthetic stream of
+``inference_request`` messages from fake requesters. Each request is
+timed from the moment the mesh stored it to the agent's final
+``inference_response`` (``completed``/``failed`` with completion
+tracking, otherwise ``queued``).
+
+The report has requests/sec, p50/p95/p99 end-to-end latency and the CPU
+the agent used per request (process CPU minus the stubs' own threads)::
+
+    python -m integrations.benchmark --requests 500 --rate 100 --job-seconds 0.02 --gpus 4
+
+Agent state (inbox cursor, ledger, result cache, job journal) lives in a temporary
+directory, so runs do not touch ``~/.agent-mesh``.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .backends import Backend, BackendPool
+from .comfyui_integration import ComfyUIMeshAgent
+from .inbox import InboxCursor
+from .journal import JobJournal
+from .ledger import MessageLedger
+from .mesh_push import push_available
+from .result_cache import ResultCache
+from .stubs import JOB_SECONDS, StubComfyUI, StubMesh
+from .tracing import reply_is_final
+
+# request_type -> share of the synthetic stream
+DEFAULT_MIX = {"image_generation": 1.0}
+
+# Inbox poll interval while benchmarking; the stub mesh has no /ws push
+POLL_INTERVAL = 0.02
+
+REQUESTERS = 16
+
+# Longest a run waits for outstanding replies once everything is sent
+DRAIN_TIMEOUT = 60.0
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def request_content(request_type: str, index: int, distinct: bool = True) -> str:
+    """Synthetic ``inference_request`` body; ``index`` comes back in ``bench_id``.
+
+    ``distinct`` pins a different seed per request so nothing is answered
+    from the result cache, coalesced or latent-batched.
+    """
+    options: Dict[str, Any] = {"steps": 20, "width": 512, "height": 512}
+    if distinct:
+        options["seed"] = index
+    prompt: Any = {"positive": f"benchmark scene {index if distinct else 0}", "negative": "blurry"}
+    if request_type == "distributed_inference":
+        prompt = {"3": {"class_type": "KSampler", "inputs": {"seed": index}}}
+    return json.dumps({
+        "type": "inference_request",
+        "request_type": request_type,
+        "bench_id": index,
+        "prompt": prompt,
+        "options": options,
+    })
+
+
+class _Requesters:
+    """Collects the agent's replies to the synthetic requesters."""
+
+    def __init__(self, tracked: bool):
+        self.tracked = tracked
+        self.sent_at: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.replies = 0
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+
+    def sent(self, index: int, at: float):
+        with self._lock:
+            self.sent_at[index] = at
+
+    def on_message(self, message: Dict[str, Any]):
+        try:
+            content = json.loads(message["content"])
+        except (KeyError, ValueError):
+            return
+        if content.get("type") != "inference_response":
+            return
+        response = content.get("response") or {}
+        index = (content.get("original_request") or {}).get("bench_id")
+        with self._lock:
+            self.replies += 1
+            if not reply_is_final(response, self.tracked) or index not in self.sent_at:
+                return
+            status = response.get("status") or ("error" if "error" in response else "unknown")
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.latencies.append(message["received_at"] - self.sent_at.pop(index))
+            self._done.notify_all()
+
+    def wait(self, total: int, timeout: float) -> bool:
+        """Block until ``total`` requests were answered; False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while len(self.latencies) < total:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._done.wait(remaining)
+            return True
+
+
+def _pick(mix: Dict[str, float], rng: random.Random) -> str:
+    types, weights = zip(*mix.items())
+    return rng.choices(types, weights)[0]
+
+
+def run_benchmark(requests: int = 200, rate: Optional[float] = None,
+                  mix: Optional[Dict[str, float]] = None,
+                  job_seconds: float = JOB_SECONDS, jitter: float = 0.0, gpus: int = 1,
+                  failure_rate: float = 0.0, distinct: bool = True,
+                  poll_interval: float = POLL_INTERVAL, requesters: int = REQUESTERS,
+                  drain_timeout: float = DRAIN_TIMEOUT, seed: Optional[int] = None,
+                  quiet: bool = True, **agent_options) -> Dict[str, Any]:
+    """Drive a ``ComfyUIMeshAgent`` with ``requests`` synthetic requests.
+
+    ``rate`` is the arrival rate in requests/sec (all at once if None).
+    Extra keyword arguments go to the agent (``type_limits``,
+    ``max_batch``, ``admission``, ...). Returns the report as a dict.
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    tracked = agent_options.get("track_completions", True) and push_available()
+    collector = _Requesters(tracked)
+    mesh = StubMesh(on_message=collector.on_message)
+    comfyui = StubComfyUI(job_seconds=job_seconds, jitter=jitter, gpus=gpus, failure_rate=failure_rate)
+
+    with tempfile.TemporaryDirectory(prefix="mesh-bench-") as state, \
+            open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext(), \
+            mesh, comfyui:
+        agent = ComfyUIMeshAgent(
+            agent_name="ComfyUI-Benchmark",
+            use_websocket=False,
+            backends=BackendPool([Backend(comfyui.url, name="stub")]),
+            inbox=InboxCursor(os.path.join(state, "inbox.json")),
+            ledger=MessageLedger(os.path.join(state, "ledger.db")),
+            results=ResultCache(os.path.join(state, "results.db")),
+            journal=JobJournal(os.path.join(state, "journal.log")),
+            poll_interval=poll_interval,
+            **agent_options
+        )
+        agent.mesh_url = mesh.url
+        if not agent.register_with_mesh():
+            raise RuntimeError("Agent could not register with the stub mesh")
+        listener = threading.Thread(target=agent.listen_for_requests, name="bench-agent", daemon=True)
+
+        cpu_started = time.process_time()
+        stub_cpu_started = mesh.cpu.seconds + comfyui.cpu.seconds
+        started = time.monotonic()
+        listener.start()
+        for index in range(requests):
+            if rate:
+                delay = started + index / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            at = time.time()
+            collector.sent(index, at)
+            mesh.deliver(agent.mesh_agent_id, request_content(_pick(mix, rng), index, distinct),
+                         sender=f"bench-requester-{index % requesters}")
+        drained = collector.wait(requests, drain_timeout)
+        elapsed = time.monotonic() - started
+        cpu = time.process_time() - cpu_started
+        stub_cpu = mesh.cpu.seconds + comfyui.cpu.seconds - stub_cpu_started
+
+        agent.stop()
+        listener.join(timeout=10)
+        mesh_stats, comfyui_stats = mesh.stats(), comfyui.stats()
+
+    answered = len(collector.latencies)
+    latencies = sorted(collector.latencies)
+    agent_cpu = max(0.0, cpu - stub_cpu)
+    return {
+        "requests": requests,
+        "answered": answered,
+        "timed_out": not drained,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(answered / elapsed, 2) if elapsed else 0.0,
+        "latency_seconds": {
+            "mean": round(sum(latencies) / answered, 4) if answered else 0.0,
+            "p50": round(_percentile(latencies, 0.50), 4),
+            "p95": round(_percentile(latencies, 0.95), 4),
+            "p99": round(_percentile(latencies, 0.99), 4),
+            "max": round(latencies[-1], 4) if latencies else 0.0,
+        },
+        "cpu_seconds": {"process": round(cpu, 3), "stubs": round(stub_cpu, 3), "agent": round(agent_cpu, 3)},
+        "agent_cpu_ms_per_request": round(agent_cpu * 1000 / answered, 3) if answered else 0.0,
+        "statuses": collector.statuses,
+        "replies": collector.replies,
+        "completion_tracking": tracked,
+        "mesh": mesh_stats,
+        "comfyui": comfyui_stats,
+    }
+
+
+def _parse_mix(text: str) -> Dict[str, float]:
+    # "image_generation=3,video_generation=1"
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark ComfyUIMeshAgent against in-process stubs")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=None, help="arrivals per second (default: all at once)")
+    parser.add_argument("--mix", type=_parse_mix, default=None,
+                        help="request_type=weight,... (default: image_generation)")
+    parser.add_argument("--job-seconds", type=float, default=JOB_SECONDS)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--gpus", type=int, default=1)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--identical", action="store_true",
+                        help="send identical unseeded requests (exercises cache, coalescing, batching)")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    parser.add_argument("--no-completions", action="store_true", help="reply on queue instead of completion")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true", help="keep the agent's own output")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(
+        requests=args.requests, rate=args.rate, mix=args.mix, job_seconds=args.job_seconds,
+        jitter=args.jitter, gpus=args.gpus, failure_rate=args.failure_rate, distinct=not args.identical,
+        poll_interval=args.poll_interval, seed=args.seed, quiet=not args.verbose,
+        track_completions=not args.no_completions,
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    latency = report["latency_seconds"]
+    print(f"answered        {report['answered']}/{report['requests']} in {report['seconds']}s"
+          + (" (timed out)" if report["timed_out"] else ""))
+    print(f"throughput      {report['requests_per_second']} req/s")
+    print(f"latency (ms)    p50 {latency['p50'] * 1000:.1f}  p95 {latency['p95'] * 1000:.1f}  "
+          f"p99 {latency['p99'] * 1000:.1f}  max {latency['max'] * 1000:.1f}")
+    print(f"agent CPU       {report['agent_cpu_ms_per_request']} ms/request "
+          f"({report['cpu_seconds']['agent']}s of {report['cpu_seconds']['process']}s)")
+    print(f"statuses        {report['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Circuit breakers for ComfyUI backends and the mesh API
+
+A breaker opens after ``failure_threshold`` consecutive failures
+(connection errors, timeouts, 5xx responses). While it is open, calls
+fail at once with ``CircuitOpenError`` instead of each waiting out its
+timeout. Once ``reset_timeout`` seconds have passed the breaker is
+half-open. A single probe of a cheap endpoint then decides the outcome:
+on success the breaker closes; on failure it stays open for twice as
+long, up to ``max_reset_timeout``. Successes reported while the breaker
+is open come from calls sent before it tripped and are ignored.
+
+Real requests are never used as the probe. The agents' sampling loops
+send the probes: ComfyUI ``/system_stats`` and the mesh ``/health``.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Consecutive failures that open a breaker
+FAILURE_THRESHOLD = 5
+
+# Seconds an open breaker waits before its first probe, and the backoff cap
+RESET_TIMEOUT = 10.0
+MAX_RESET_TIMEOUT = 120.0
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} unavailable (circuit open), retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker for one upstream.
+
+    ``on_change(breaker, old_state, new_state)`` is called outside the lock
+    on every transition.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_timeout: float = RESET_TIMEOUT, max_reset_timeout: float = MAX_RESET_TIMEOUT,
+                 on_change: Optional[Callable[["CircuitBreaker", str, str], None]] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.on_change = on_change
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._timeout = reset_timeout
+        self.trips = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """True while calls may go through."""
+        return self.state == CLOSED
+
+    def _transition(self, state: str) -> Optional[str]:
+        # Returns the old state if it changed; caller holds the lock
+        old, self.state = self.state, state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        return old if old != state else None
+
+    def _notify(self, old: Optional[str]):
+        if old is not None and self.on_change:
+            self.on_change(self, old, self.state)
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe may close the breaker (0 when closed)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0
+            return max(0.0, self.opened_at + self._timeout - time.monotonic())
+
+    def check(self):
+        """Raise ``CircuitOpenError`` unless a real call may go through."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            self.rejected += 1
+        raise CircuitOpenError(self.name, self.retry_after())
+
+    def probe_due(self) -> bool:
+        """True if a probe should be sent now (moves an expired open breaker to half-open)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self._timeout:
+                    return False
+                old = self._transition(HALF_OPEN)
+            else:
+                old = None
+        self._notify(old)
+        return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state == OPEN:
+                # A call that started before the trip; only a probe may close it
+                return
+            self.failures = 0
+            self._timeout = self.reset_timeout
+            old = self._transition(CLOSED)
+        self._notify(old)
+
+    def record_failure(self):
+        with self._lock:
+            old = None
+            if self.state == HALF_OPEN:
+                # Failed probe: stay open, back off
+                self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+                old = self._transition(OPEN)
+            elif self.state == CLOSED:
+                self.failures += 1
+                if self.failures >= self.failure_threshold:
+                    self.trips += 1
+                    old = self._transition(OPEN)
+        self._notify(old)
+
+    def record_status(self, status_code: int):
+        """Count a response: 5xx is a failure, anything else a success."""
+        if status_code >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "open_seconds": round(time.monotonic() - self.opened_at, 1) if self.state != CLOSED else 0.0,
+            }
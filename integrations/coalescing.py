@@ -0,0 +1,163 @@
+"""
+Single-flight coalescing of identical inference requests
+
+Requests are keyed by a hash of the fully instantiated workflow. The first
+request for a key (the leader) is submitted to ComfyUI; identical requests
+arriving while it is in flight wait for the leader's submission and then
+attach to the same ``prompt_id``, so the GPU runs the job once and every
+requester receives the same completion result.
+
+A flight ends when its prompt completes (``complete``), when the leader's
+submission fails, or after ``ttl`` seconds if no completion is ever seen.
+Several flights may share a prompt: a latent batch (``batching.py``) also
+stands in for its first image rendered alone (``publish``).
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+# Seconds a submitted flight stays joinable when no completion event arrives
+FLIGHT_TTL = 900.0
+
+# Seconds a follower waits for the leader's ComfyUI submission
+LEADER_WAIT = 15.0
+
+
+def workflow_key(workflow: Union[str, Dict[str, Any]]) -> str:
+    """Canonical SHA-256 of a workflow (rendered JSON text or dict)."""
+    if not isinstance(workflow, str):
+        workflow = json.dumps(workflow, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(workflow.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """One in-flight submission shared by identical requests."""
+
+    def __init__(self, key: str, event):
+        self.key = key
+        self.created_at = time.monotonic()
+        self.response: Optional[Dict[str, Any]] = None
+        self.followers = 0
+        self.event = event
+
+    @property
+    def prompt_id(self) -> Optional[str]:
+        return (self.response or {}).get("prompt_id")
+
+
+class SingleFlight:
+    """Thread-safe single-flight table with hit/miss accounting."""
+
+    def __init__(self, ttl: float = FLIGHT_TTL):
+        self.ttl = ttl
+        self._flights: Dict[str, Flight] = {}
+        self._by_prompt: Dict[str, List[Flight]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.gpu_seconds_saved = 0.0
+
+    def _new_event(self):
+        return threading.Event()
+
+    def _expire(self, now: float):
+        stale = [f for f in self._flights.values() if now - f.created_at > self.ttl]
+        for flight in stale:
+            self._drop(flight)
+
+    def _drop(self, flight: Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        flights = self._by_prompt.get(flight.prompt_id) if flight.prompt_id else None
+        if flights and flight in flights:
+            flights.remove(flight)
+            if not flights:
+                del self._by_prompt[flight.prompt_id]
+
+    def in_flight(self, key: str) -> bool:
+        """True if a request for ``key`` would join a flight (counts nothing)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            return flight is not None and time.monotonic() - flight.created_at <= self.ttl
+
+    def begin(self, key: str) -> Tuple[Flight, bool]:
+        """Join or start the flight for ``key``; returns (flight, is_leader)."""
+        with self._lock:
+            self._expire(time.monotonic())
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.hits += 1
+                return flight, False
+            flight = self._flights[key] = Flight(key, self._new_event())
+            self.misses += 1
+            return flight, True
+
+    def resolve(self, flight: Flight, response: Optional[Dict[str, Any]]):
+        """Publish the leader's submission response to its followers."""
+        with self._lock:
+            flight.response = response
+            if not response or "error" in response or not flight.prompt_id:
+                # Followers will submit on their own
+                self._drop(flight)
+            else:
+                self._by_prompt.setdefault(flight.prompt_id, []).append(flight)
+        flight.event.set()
+
+    def publish(self, key: str, response: Dict[str, Any]) -> bool:
+        """Make an already submitted prompt joinable under ``key``; False if ``key`` is taken."""
+        with self._lock:
+            if key in self._flights or not response.get("prompt_id") or "error" in response:
+                return False
+            flight = self._flights[key] = Flight(key, self._new_event())
+            flight.response = response
+            self._by_prompt.setdefault(flight.prompt_id, []).append(flight)
+        flight.event.set()
+        return True
+
+    def wait(self, flight: Flight, timeout: float = LEADER_WAIT) -> Optional[Dict[str, Any]]:
+        """Block until the leader has submitted; None if it failed or timed out."""
+        if not flight.event.wait(timeout):
+            return None
+        return self._follower_response(flight)
+
+    @staticmethod
+    def _follower_response(flight: Flight) -> Optional[Dict[str, Any]]:
+        if not flight.prompt_id or "error" in (flight.response or {}):
+            return None
+        return {**flight.response, "coalesced": True}
+
+    def complete(self, prompt_id: str, run_seconds: float = 0.0):
+        """End the flight for a finished prompt and account the GPU time saved."""
+        with self._lock:
+            for flight in list(self._by_prompt.get(prompt_id, ())):
+                self._drop(flight)
+                self.gpu_seconds_saved += run_seconds * flight.followers
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and estimated GPU seconds saved."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "in_flight": len(self._flights),
+                "gpu_seconds_saved": round(self.gpu_seconds_saved, 3),
+            }
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight whose followers wait without blocking the event loop."""
+
+    def _new_event(self):
+        return asyncio.Event()
+
+    async def wait(self, flight: Flight, timeout: float = LEADER_WAIT) -> Optional[Dict[str, Any]]:
+        try:
+            await asyncio.wait_for(flight.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self._follower_response(flight)
@@ -0,0 +1,1285 @@
+"""
+Agent Mesh + ComfyUI Integration (asyncio)
+
+Non-blocking counterpart of ``ComfyUIMeshAgent``. Inbox intake, ComfyUI
+submission, completion tracking and mesh replies run as independent tasks
+on one event loop, so a slow ComfyUI call never stalls inbox reads or
+replies and a single process can keep hundreds of jobs outstanding. Each
+request runs as its own task, capped per ``request_type`` like the
+threaded dispatcher. Ledger, result cache and artifact store reads and
+writes (SQLite and local files) go through ``asyncio.to_thread`` so disk
+latency never blocks the loop either.
+
+Usage:
+    import asyncio
+    from integrations.comfyui_async import AsyncComfyUIMeshAgent
+
+    asyncio.run(AsyncComfyUIMeshAgent().run())
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import mimetypes
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .comfyui_integration import (
+    AGENT_NAME,
+    ARTIFACT_CHUNK,
+    COMFYUI_URL,
+    ERROR_BACKOFF,
+    MESH_API_KEY,
+    MESH_API_URL,
+    POLL_INTERVAL,
+)
+from .admission import SAMPLE_INTERVAL
+from .artifacts import ArtifactServer, ArtifactStore
+from .backends import Backend, BackendPool
+from .batching import BATCH_WINDOW, AsyncLatentBatcher, batch_limit, batchable, split_batch_result
+from .breaker import CircuitBreaker, CircuitOpenError
+from .coalescing import AsyncSingleFlight, workflow_key
+from .completion import CompletionTracker, extract_outputs
+from .delivery import UPLOAD_TIMEOUT, OutputPublisher, async_upload_body, upload_fields
+from .dispatcher import (
+    DEFAULT_LIMIT,
+    QUEUE_SIZE,
+    TYPE_LIMITS,
+    cancel_target_of,
+    cancelled_response,
+    held_response,
+    preemption_response,
+    rejection_response,
+    request_type_of,
+)
+from .health_report import HealthReporter
+from .inbox import InboxCursor, state_path
+from .journal import COMPLETED, RECEIVED, JobJournal, JournalWriteError, history_result, journal_message
+from .ledger import IGNORED, REPLIED, SUBMITTED, MessageLedger
+from .metrics import IntegrationMetrics
+from .polling import MIN_INTERVAL, AdaptivePoller
+from .mesh_push import normalize_message, push_available
+from .result_cache import ResultCache
+from .scheduler import (
+    MAX_IN_FLIGHT,
+    PREEMPTING,
+    InFlight,
+    Job,
+    JobScheduler,
+    comfyui_queue_ids,
+    message_model_group,
+    message_priority,
+)
+from .tracing import Tracer, reply_is_final
+from .workflows import WorkflowRegistry, WorkflowTemplate, default_registry
+
+REPLY_WORKERS = 4
+
+# Seconds between /history sweeps over outstanding prompts (only used
+# when websocket-client is missing and CompletionTracker is unavailable)
+TRACK_INTERVAL = 2.0
+TRACK_CONCURRENCY = 16
+
+
+class AsyncComfyUIMeshAgent:
+    """asyncio ComfyUI mesh agent built on httpx.AsyncClient."""
+
+    def __init__(
+        self,
+        agent_name: str = None,
+        type_limits: Optional[Dict[str, int]] = None,
+        queue_size: int = QUEUE_SIZE,
+        reply_workers: int = REPLY_WORKERS,
+        poll_interval: float = POLL_INTERVAL,
+        track_interval: float = TRACK_INTERVAL,
+        inbox: Optional[InboxCursor] = None,
+        ledger: Optional[MessageLedger] = None,
+        workflows: Optional[WorkflowRegistry] = None,
+        track_completions: bool = True,
+        results: Optional[ResultCache] = None,
+        cache_files: bool = False,
+        batch_window: float = BATCH_WINDOW,
+        max_batch: Optional[int] = None,
+        max_in_flight: Optional[int] = MAX_IN_FLIGHT,
+        preempt: bool = False,
+        admission: bool = True,
+        backends: Optional[BackendPool] = None,
+        health: Optional[HealthReporter] = None,
+        metrics: Optional[IntegrationMetrics] = None,
+        metrics_port: Optional[int] = None,
+        tracer: Optional[Tracer] = None,
+        journal: Optional[JobJournal] = None,
+        poller: Optional[AdaptivePoller] = None,
+        publish_outputs: bool = True,
+        publisher: Optional[OutputPublisher] = None,
+        artifacts: Optional[ArtifactStore] = None,
+        artifacts_port: Optional[int] = None,
+    ):
+        self.mesh_url = MESH_API_URL
+        self.mesh_key = MESH_API_KEY
+        # ComfyUI instances this agent fronts; add_backend/remove_backend change it live
+        self.backends = backends or BackendPool([Backend(COMFYUI_URL, name="default")])
+        self.agent_name = agent_name or AGENT_NAME
+        self.mesh_agent_id = None
+        self.running = False
+        self.type_limits = dict(TYPE_LIMITS if type_limits is None else type_limits)
+        self.queue_size = queue_size
+        self.reply_workers = reply_workers
+        # Inbox poll timing: short after traffic, backing off to poll_interval
+        self.poller = poller or AdaptivePoller(
+            min_interval=min(MIN_INTERVAL, poll_interval), max_interval=poll_interval,
+            max_error_interval=ERROR_BACKOFF,
+        )
+        self.track_interval = track_interval
+        self._mesh: Optional[httpx.AsyncClient] = None
+        self._comfyui: Optional[httpx.AsyncClient] = None
+        # ComfyUI backends carry their own breakers; this one guards the mesh API
+        self.mesh_breaker = CircuitBreaker("mesh")
+        self._announced: Optional[str] = None
+        # Load published to the mesh health dashboard
+        self.health = health or HealthReporter()
+        # Stage latencies and counters; served on metrics_port while running
+        self.metrics = metrics or IntegrationMetrics()
+        self.metrics_port = metrics_port
+        # Per-request stage spans; trace ids go back in every response
+        self.tracer = tracer or Tracer()
+        self._replies: Optional[asyncio.Queue] = None
+        self._stopped: Optional[asyncio.Event] = None
+        # Requests wait here, ordered by model affinity, until ComfyUI has room
+        self.scheduler = JobScheduler()
+        self.max_in_flight = max_in_flight
+        # Sampled queue depth and VRAM of every backend replace max_in_flight when enabled
+        self.admission = admission
+        # Held responses sent; the number waiting now is scheduler.held
+        self.held_total = 0
+        self.cancelled = 0
+        # Urgent/high arrivals may take back not-yet-started lower-priority prompts
+        self.preempt = preempt
+        self.preempted = 0
+        self._preempting = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._pending: Dict[str, int] = {}
+        self._running: Dict[str, int] = {}
+        self._in_flight = InFlight()
+        self._request_tasks: set = set()
+        # prompt_id -> ([(original message, batch slot)], submitted_at, backend)
+        self._outstanding: Dict[str, Any] = {}
+        self.inbox = inbox or InboxCursor(state_path(self.agent_name, "inbox.json"))
+        self.ledger = ledger or MessageLedger(state_path(self.agent_name, "ledger.db"))
+        # Every job still owed a reply, so a crash never loses a prompt_id
+        self.journal = journal or JobJournal(state_path(self.agent_name, "journal.log"))
+        self.workflows = workflows or default_registry()
+        self.coalescer = AsyncSingleFlight()
+        self.batcher: Optional[AsyncLatentBatcher] = None
+        max_batch = batch_limit(max_batch, self.type_limits.get("image_generation", DEFAULT_LIMIT))
+        if max_batch > 1:
+            self.batcher = AsyncLatentBatcher(self._submit_batch, window=batch_window, max_batch=max_batch)
+        # Finished outputs go to the mesh file store; replies carry their file ids
+        self.publisher = (publisher or OutputPublisher()) if publish_outputs else None
+        # Local content-addressed copies of outputs, served on artifacts_port while running
+        self.artifacts = artifacts
+        self.artifact_server: Optional[ArtifactServer] = None
+        if artifacts is not None and artifacts_port is not None:
+            self.artifact_server = ArtifactServer(artifacts, artifacts_port)
+        self.results = results or ResultCache(
+            state_path(self.agent_name, "results.db"),
+            files_dir=state_path(self.agent_name, "results") if cache_files else None,
+        )
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.track_completions = track_completions and push_available()
+        for backend in self.backends.backends():
+            self._attach_backend(backend)
+        self.backends.on_added = self._attach_backend
+        self.backends.on_removed = self._detach_backend
+        self.metrics.watch(self, lambda: len(self.scheduler))
+        self.scheduler.on_release = self.metrics.record_release
+        if self.batcher:
+            self.batcher.on_batch = self.metrics.batch_size.observe
+
+    def add_backend(self, url: str, name: Optional[str] = None,
+                    models: Optional[List[str]] = None, max_resolution: Optional[int] = None,
+                    output_dir: Optional[str] = None) -> Backend:
+        """Start sending work to another ComfyUI instance."""
+        return self.backends.add(Backend(url, name, models, max_resolution, output_dir=output_dir))
+
+    def remove_backend(self, name: str) -> bool:
+        """Stop sending work to a ComfyUI instance; its queued prompts still finish."""
+        return self.backends.remove(name)
+
+    def _attach_backend(self, backend: Backend):
+        if self.track_completions and backend.tracker is None:
+            backend.tracker = CompletionTracker(
+                backend.url,
+                on_complete=lambda context, result: self._on_job_complete(context, result, backend),
+                fetch_history=lambda prompt_id: self._fetch_history(prompt_id, backend),
+                on_start=self.journal.running,
+            )
+            if self.running:
+                backend.tracker.start()
+        print(f"ComfyUI backend {backend.name} added ({backend.url})")
+
+    def _fetch_history(self, prompt_id: str, backend: Backend) -> Optional[Dict[str, Any]]:
+        """/history lookup for a tracker thread, sent on the event loop through the backend's breaker."""
+        if self._loop is None or self._comfyui is None:
+            raise RuntimeError("agent is not running")
+        future = asyncio.run_coroutine_threadsafe(
+            self._request(self._comfyui, backend.breaker, "GET", f"{backend.url}/history/{prompt_id}", timeout=5),
+            self._loop,
+        )
+        try:
+            resp = future.result(timeout=10)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+        if resp.status_code != 200:
+            return None
+        return resp.json().get(prompt_id)
+
+    def _detach_backend(self, backend: Backend):
+        if backend.tracker is not None:
+            backend.tracker.stop()
+        print(f"ComfyUI backend {backend.name} removed")
+
+    async def open(self):
+        """Create the pooled HTTP clients."""
+        limits = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+        self._mesh = httpx.AsyncClient(headers={"X-API-Key": self.mesh_key}, limits=limits, timeout=10)
+        self._comfyui = httpx.AsyncClient(limits=limits, timeout=10)
+
+    async def close(self):
+        """Close the HTTP clients."""
+        for client in (self._mesh, self._comfyui):
+            if client is not None:
+                await client.aclose()
+        self._mesh = self._comfyui = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _request(self, client: httpx.AsyncClient, breaker: CircuitBreaker, method: str, url: str,
+                       probe: bool = False, **kwargs) -> httpx.Response:
+        """Send a request through ``breaker``: fail fast while it is open, count the outcome."""
+        if not probe:
+            breaker.check()
+        try:
+            resp = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            breaker.record_failure()
+            raise
+        breaker.record_status(resp.status_code)
+        return resp
+
+    async def _mesh_call(self, method: str, url: str, **kwargs) -> httpx.Response:
+        return await self._request(self._mesh, self.mesh_breaker, method, url, **kwargs)
+
+    async def register_with_mesh(self) -> bool:
+        """Register this agent with the Agent Mesh."""
+        print(f"Registering {self.agent_name} with Agent Mesh...")
+
+        payload = {
+            "name": self.agent_name,
+            "endpoint": "http://localhost:18789",
+            "capabilities": [
+                "comfyui_inference",
+                "image_generation",
+                "video_generation",
+                "distributed_inference"
+            ]
+        }
+
+        try:
+            resp = await self._mesh_call("POST", f"{self.mesh_url}/api/agents/register", json=payload)
+            if resp.status_code == 200:
+                self.mesh_agent_id = resp.json().get("agentId")
+                print(f"Registered with mesh! Agent ID: {self.mesh_agent_id}")
+                return True
+            print(f"Registration failed: {resp.status_code}")
+            return False
+        except Exception as e:
+            print(f"Error registering with mesh: {e}")
+            return False
+
+    async def broadcast_availability(self):
+        """Broadcast that ComfyUI is available for inference."""
+        backends = [b for b in self.backends.backends() if not b.draining]
+        primary = backends[0] if backends else None
+        status = self.backends.availability()
+        payload = {
+            "content": json.dumps({
+                "type": "service_announcement",
+                "service": "comfyui_distributed",
+                "capabilities": [
+                    "image_generation",
+                    "video_generation",
+                    "distributed_inference",
+                    "multi_gpu_processing"
+                ],
+                "endpoint": primary.distributed_url if primary else None,
+                "api_endpoint": f"{primary.url}/api" if primary else None,
+                "distributed_endpoint": primary.distributed_url if primary else None,
+                "backends": [b.describe() for b in backends],
+                "status": status,
+                "gpu": "NVIDIA GeForce RTX 5060 Ti (16GB)"
+            }),
+            "sender": self.agent_name,
+            "priority": "normal"
+        }
+
+        try:
+            resp = await self._mesh_call("POST", f"{self.mesh_url}/api/broadcast", json=payload)
+            if resp.status_code == 200:
+                self._announced = status
+                print(f"Broadcast availability to mesh ({status})")
+            else:
+                print(f"Broadcast failed: {resp.status_code}")
+        except Exception as e:
+            print(f"Broadcast error: {e}")
+
+    async def check_mesh_messages(self, long_poll: bool = False) -> list:
+        """Check for new messages from other agents (advances the inbox cursor).
+
+        With ``long_poll`` a mesh that supports it holds an empty read open
+        until a message arrives.
+        """
+        if not self.mesh_agent_id:
+            return []
+
+        params = self.inbox.query_params()
+        wait = self.poller.wait_seconds() if long_poll else 0
+        if wait:
+            params.update(self.poller.query_params())
+        started = time.perf_counter()
+        try:
+            resp = await self._mesh_call(
+                "GET",
+                f"{self.mesh_url}/api/messages/{self.mesh_agent_id}",
+                params=params,
+                timeout=5 + wait
+            )
+            if resp.status_code == 200:
+                data = resp.json()
+                if isinstance(data, dict):
+                    data = data.get("messages", [])
+                messages = self.inbox.accept([normalize_message(m) for m in data])
+                self.metrics.messages.inc(len(messages))
+                self.poller.record(len(messages), resp.headers, long_polled=bool(wait))
+                return messages
+            self.metrics.errors["inbox_fetch"].inc()
+            self.poller.record_error()
+            return []
+        except Exception:
+            self.metrics.errors["inbox_fetch"].inc()
+            self.poller.record_error()
+            return []
+        finally:
+            self.metrics.stage["inbox_fetch"].since(started)
+
+    async def _ack_one(self, message_id: str) -> bool:
+        try:
+            resp = await self._mesh_call("POST", f"{self.mesh_url}/api/messages/{message_id}/read", timeout=5)
+            return resp.status_code == 200
+        except Exception:
+            return False
+
+    async def flush_acks(self) -> int:
+        """Mark handled messages read on the mesh. Returns how many succeeded."""
+        batch = self.inbox.take_acks()
+        if not batch:
+            return 0
+        results = await asyncio.gather(*(self._ack_one(m) for m in batch))
+        done = [m for m, ok in zip(batch, results) if ok]
+        failed = [m for m, ok in zip(batch, results) if not ok]
+        await asyncio.to_thread(self.inbox.acked, done, failed)
+        return len(done)
+
+    async def process_inference_request(self, message: dict) -> Optional[Dict[str, Any]]:
+        """Process an inference request from another agent."""
+        try:
+            started = time.perf_counter()
+            try:
+                content = json.loads(message.get("content", "{}"))
+            except ValueError:
+                self.metrics.errors["json_parse"].inc()
+                raise
+            self.metrics.stage["json_parse"].since(started)
+
+            if content.get("type") != "inference_request":
+                return None
+
+            request_type = content.get("request_type")
+            prompt = content.get("prompt")
+            options = content.get("options", {})
+
+            print(f"Received {request_type} request from {message.get('sender')}")
+
+            if request_type == "image_generation":
+                return await self.generate_image(prompt, options)
+            elif request_type == "video_generation":
+                return await self.generate_video(prompt, options)
+            elif request_type == "distributed_inference":
+                return await self.queue_distributed_workflow(prompt, options)
+            else:
+                return {"error": f"Unknown request type: {request_type}"}
+
+        except Exception as e:
+            return {"error": str(e)}
+
+    async def submit_template(self, name: str, prompt: dict, options: dict) -> Dict[str, Any]:
+        """Instantiate a workflow template and queue it on ComfyUI.
+
+        Already generated workflows are answered from the result cache, and
+        identical requests in flight share one prompt (see ``coalescing``).
+        """
+        started = time.perf_counter()
+        try:
+            with self.tracer.span("workflow_build", workflow=name):
+                template = self.workflows.get(name)
+                workflow_json = template.render(prompt, options)
+        except Exception as e:
+            self.metrics.errors["workflow_build"].inc()
+            return {"error": str(e)}
+        self.metrics.stage["workflow_build"].since(started)
+
+        key = workflow_key(workflow_json)
+        cached = await asyncio.to_thread(self.results.lookup, key)
+        if cached:
+            return cached
+
+        flight, leader = self.coalescer.begin(key)
+        if not leader:
+            response = await self.coalescer.wait(flight)
+            if response:
+                return response
+
+        response = None
+        try:
+            response = await self._queue_prompt(template, workflow_json)
+            if response.get("prompt_id") and "error" not in response:
+                self.results.expect(response["prompt_id"], key)
+            return response
+        finally:
+            if leader:
+                self.coalescer.resolve(flight, response)
+
+    async def _queue_prompt(self, template: WorkflowTemplate, workflow_json: str) -> Dict[str, Any]:
+        """Submit a rendered workflow to the backend the pool picks for it."""
+        try:
+            backend = self.backends.choose(json.loads(workflow_json))
+        except CircuitOpenError as e:
+            return {"error": str(e), "retry_after": round(e.retry_after, 1)}
+        if backend is None:
+            return {"error": "No ComfyUI backend has the models and resolution this workflow needs"}
+        prompt_id = None
+        started = time.perf_counter()
+        try:
+            with self.tracer.span("comfyui_submit", backend=backend.name):
+                resp = await self._request(
+                    self._comfyui, backend.breaker, "POST",
+                    f"{backend.url}/api/prompt",
+                    content=template.body_for(workflow_json, backend.tracker.client_id if backend.tracker else None),
+                    headers={"Content-Type": "application/json"}
+                )
+            if resp.status_code == 200:
+                prompt_id = resp.json().get("prompt_id")
+                return {"status": "queued", "prompt_id": prompt_id, "backend": backend.name}
+            return {"error": f"ComfyUI error: {resp.status_code}"}
+        except Exception as e:
+            return {"error": str(e)}
+        finally:
+            self.metrics.stage["comfyui_submit"].since(started)
+            if prompt_id:
+                self.backends.assign(prompt_id, backend)
+            else:
+                self.metrics.errors["comfyui_submit"].inc()
+                self.backends.abandon(backend)
+
+    async def generate_image(self, prompt: dict, options: dict) -> Dict[str, Any]:
+        """Generate an image via ComfyUI, batched with compatible requests."""
+        name = options.get("workflow", "image_generation")
+        if self.batcher:
+            template = self.workflows.get(name)
+            if batchable(template, options) and not await self._reusable(template, prompt, options):
+                return await self.batcher.submit(template, prompt, options)
+        return await self.submit_template(name, prompt, options)
+
+    async def _reusable(self, template: WorkflowTemplate, prompt: dict, options: dict) -> bool:
+        """True if this exact request is cached or in flight, so it should not start a batch."""
+        try:
+            key = workflow_key(template.render(prompt, options))
+        except Exception:
+            return False
+        return self.coalescer.in_flight(key) or await asyncio.to_thread(self.results.__contains__, key)
+
+    async def _submit_batch(self, name: str, prompt: dict, options: dict) -> Dict[str, Any]:
+        """Submit for the batcher; a latent batch also stands in for its first image alone."""
+        response = await self.submit_template(name, prompt, options)
+        size = options.get("batch_size", 1)
+        if size > 1 and response.get("status") == "queued" and not response.get("coalesced"):
+            # Later identical requests join slot 0 instead of starting another batch
+            slot = {"size": size, "index": 0}
+            key = workflow_key(self.workflows.get(name).render(prompt, {**options, "batch_size": 1}))
+            if self.coalescer.publish(key, {**response, "batch": slot}):
+                self.results.expect(response["prompt_id"], key, slot)
+        return response
+
+    async def generate_video(self, prompt: dict, options: dict) -> Dict[str, Any]:
+        """Generate a video via ComfyUI (WAN2.2)."""
+        return await self.submit_template(options.get("workflow", "video_generation"), prompt, options)
+
+    async def queue_distributed_workflow(self, workflow: dict, options: dict) -> Dict[str, Any]:
+        """Queue a distributed workflow via ComfyUI-Distributed API."""
+        try:
+            backend = self.backends.choose(workflow) if isinstance(workflow, dict) else None
+        except CircuitOpenError as e:
+            return {"error": str(e), "retry_after": round(e.retry_after, 1)}
+        if backend is None:
+            return {"error": "No ComfyUI backend can run this workflow"}
+        prompt_id = None
+        started = time.perf_counter()
+        try:
+            payload = {
+                "prompt": workflow,
+                "client_id": backend.tracker.client_id if backend.tracker else "mesh-distributed",
+                "delegate_master": options.get("delegate_master", False),
+                "enabled_worker_ids": options.get("worker_ids", [])
+            }
+            with self.tracer.span("comfyui_submit", backend=backend.name, distributed=True):
+                resp = await self._request(
+                    self._comfyui, backend.breaker, "POST", f"{backend.distributed_url}/queue", json=payload
+                )
+            if resp.status_code == 200:
+                data = resp.json()
+                prompt_id = data.get("prompt_id")
+                return {
+                    "status": "distributed_queued",
+                    "prompt_id": prompt_id,
+                    "worker_count": data.get("worker_count", 1),
+                    "backend": backend.name,
+                }
+            return {"error": f"Distributed API error: {resp.status_code}"}
+        except Exception as e:
+            return {"error": str(e)}
+        finally:
+            self.metrics.stage["comfyui_submit"].since(started)
+            if prompt_id:
+                self.backends.assign(prompt_id, backend)
+            else:
+                self.metrics.errors["comfyui_submit"].inc()
+                self.backends.abandon(backend)
+
+    async def send_response(self, original_message: dict, response: Dict[str, Any]) -> bool:
+        """Send response back to the requesting agent, tagged with its trace id."""
+        trace = self.tracer.get(original_message)
+        if trace:
+            response = {**response, "trace_id": trace.trace_id}
+        payload = {
+            "content": json.dumps({
+                "type": "inference_response",
+                "original_request": json.loads(original_message.get("content", "{}")),
+                "response": response
+            }),
+            "from": self.mesh_agent_id or self.agent_name,
+            "to": original_message.get("sender"),
+            "messageType": "direct"
+        }
+
+        started = time.perf_counter()
+        sent_at = time.time()
+        try:
+            resp = await self._mesh_call("POST", f"{self.mesh_url}/api/messages", json=payload)
+            if not 200 <= resp.status_code < 300:
+                self.metrics.errors["response_send"].inc()
+                print(f"Failed to send response: mesh returned {resp.status_code}")
+                return False
+            print(f"Sent response to {original_message.get('sender')}")
+            return True
+        except Exception as e:
+            self.metrics.errors["response_send"].inc()
+            print(f"Failed to send response: {e}")
+            return False
+        finally:
+            self.metrics.stage["response_send"].since(started)
+            if trace:
+                status = response.get("status") or ("error" if "error" in response else None)
+                trace.add("response_send", sent_at, time.time(), status=status)
+                # Queued prompts are always followed up, by the tracker or /history polling
+                if reply_is_final(response, tracked=True):
+                    self.tracer.finish(original_message, status=status)
+
+    def _claim_message(self, message: dict) -> bool:
+        # Blocking (ledger I/O): runs on a worker thread, see _claim
+        message_id = message.get("id")
+        if not message_id or self.ledger.begin(message_id) is not None:
+            return True
+        if self.ledger.finished(message_id):
+            # Handled before (e.g. by an earlier run); mark it read so the cursor moves on
+            self.inbox.ack(message)
+            if self.journal.tracks(message_id):
+                # A journal entry left open would be replayed on every start
+                self.journal.drop(message_id)
+        return False
+
+    async def _claim(self, messages: List[dict]) -> List[dict]:
+        """The messages this process should handle, claimed in the ledger."""
+        if not messages:
+            return []
+        return await asyncio.to_thread(lambda: [m for m in messages if self._claim_message(m)])
+
+    async def _finish(self, msg: dict, status: str):
+        if msg.get("id"):
+            await asyncio.to_thread(self.ledger.finish, msg["id"], status)
+
+    async def _dispatch(self, msg: dict):
+        """Schedule an inference request, or reject it if its type is backed up."""
+        self.tracer.begin(msg)
+        cancel_target = cancel_target_of(msg)
+        if cancel_target:
+            self._cancel_request(msg, cancel_target)
+            await self._finish(msg, IGNORED)
+            self.inbox.ack(msg)
+            return
+        request_type = request_type_of(msg)
+        if request_type is None:
+            await self._finish(msg, IGNORED)
+            self.inbox.ack(msg)
+            return
+        limit = self.type_limits.get(request_type, DEFAULT_LIMIT)
+        pending = self._pending.get(request_type, 0)
+        if pending >= limit + self.queue_size:
+            print(f"Rejected {request_type} request from {msg.get('sender')}: queue full")
+            self._replies.put_nowait((msg, rejection_response(request_type, pending), True, None))
+            self.inbox.ack(msg)
+            return
+        priority = message_priority(msg)
+        job = self._enqueue(msg, request_type, priority)
+        ahead = len(self.scheduler) - 1
+        if self.admission and not self.backends.admit(self._in_flight, ahead):
+            self.scheduler.hold(job)
+            self.held_total += 1
+            held = held_response(request_type, ahead, self.backends.estimate_start(ahead, self._in_flight))
+            self._replies.put_nowait((msg, held, False, None))
+        self._maybe_preempt(priority)
+
+    def _enqueue(self, msg: dict, request_type: str, priority: str) -> Job:
+        self._pending[request_type] = self._pending.get(request_type, 0) + 1
+        job = self.scheduler.put(msg, request_type, message_model_group(msg, self.workflows), priority)
+        self._wake.set()
+        return job
+
+    def _cancel_request(self, msg: dict, request_id: str):
+        """Withdraw a held request at its sender's asking."""
+        removed = self.scheduler.remove(
+            lambda item: item.get("id") == request_id and item.get("sender") == msg.get("sender")
+        )
+        if not removed:
+            print(f"Cancel for {request_id} ignored: not waiting here")
+            return
+        for job in removed:
+            self._pending[job.request_type] -= 1
+            self.cancelled += 1
+            self._replies.put_nowait((job.item, cancelled_response(request_id), True, None))
+            self.inbox.ack(job.item)
+
+    def _admitting(self) -> bool:
+        if self.admission:
+            return self.backends.admit(self._in_flight)
+        return self.max_in_flight is None or len(self._in_flight) < self.max_in_flight
+
+    async def _sample_backend(self, backend: Backend):
+        # While the breaker is open only the half-open probe goes out
+        probe = not backend.breaker.available
+        if probe and not backend.breaker.probe_due():
+            return
+        sampled_at = time.monotonic()
+        try:
+            stats = await self._request(
+                self._comfyui, backend.breaker, "GET", f"{backend.url}/system_stats", probe=probe, timeout=5
+            )
+            queue = await self._request(self._comfyui, backend.breaker, "GET", f"{backend.url}/queue", timeout=5)
+            backend.admission.update(queue.json(), stats.json(), sampled_at=sampled_at)
+        except Exception:
+            backend.admission.update(None, None)
+
+    async def _probe_mesh(self):
+        if self.mesh_breaker.probe_due():
+            try:
+                await self._mesh_call("GET", f"{self.mesh_url}/health", probe=True, timeout=5)
+            except Exception:
+                pass
+
+    async def _sample_loop(self):
+        # Probes the mesh, feeds each backend's admission controller from its
+        # /system_stats and /queue, and re-announces when availability changes
+        while self.running:
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            await self._probe_mesh()
+            await asyncio.gather(*(self._sample_backend(b) for b in self.backends.backends()))
+            if self.backends.availability() != self._announced and self.mesh_breaker.available:
+                await self.broadcast_availability()
+            self._wake.set()
+
+    async def report_health(self):
+        """Post the load report if it changed, and the heartbeat when due."""
+        if not self.mesh_agent_id:
+            return
+        agent_url = f"{self.mesh_url}/api/agents/{self.mesh_agent_id}"
+        report = self.health.build(self.backends, len(self.scheduler), held=self.scheduler.held)
+        if self.health.report_due(report):
+            try:
+                resp = await self._mesh_call("POST", f"{agent_url}/health", json=report, timeout=5)
+                if resp.status_code == 200:
+                    self.health.reported(report)
+            except Exception as e:
+                print(f"Health report failed: {e}")
+        if self.health.heartbeat_due():
+            try:
+                resp = await self._mesh_call("POST", f"{agent_url}/heartbeat", timeout=5)
+                if resp.status_code == 200:
+                    self.health.heartbeat_sent()
+            except Exception as e:
+                print(f"Heartbeat failed: {e}")
+
+    async def _report_loop(self):
+        while self.running:
+            await asyncio.sleep(self.health.interval)
+            await self.report_health()
+
+    def _maybe_preempt(self, priority: str):
+        if not (self.preempt and self.track_completions) or priority not in PREEMPTING or self._admitting():
+            return
+        victim = self._in_flight.victim(priority, exclude=self._preempting)
+        if victim is None:
+            return
+        self._preempting.add(victim)
+        task = asyncio.create_task(self._preempt(victim))
+        self._request_tasks.add(task)
+        task.add_done_callback(self._request_tasks.discard)
+
+    async def _cancel_queued_prompt(self, prompt_id: str, backend: Backend) -> bool:
+        try:
+            resp = await self._request(
+                self._comfyui, backend.breaker, "POST", f"{backend.url}/queue", json={"delete": [prompt_id]}
+            )
+            if resp.status_code != 200:
+                return False
+            queue = (await self._request(self._comfyui, backend.breaker, "GET", f"{backend.url}/queue")).json()
+            history = await self._request(self._comfyui, backend.breaker, "GET", f"{backend.url}/history/{prompt_id}")
+            if history.status_code == 200 and history.json().get(prompt_id):
+                return False
+        except Exception:
+            return False
+        return prompt_id not in comfyui_queue_ids(queue)
+
+    async def _preempt(self, prompt_id: str):
+        """Take a not-yet-started prompt back from ComfyUI and re-queue its request."""
+        try:
+            backend = self.backends.backend_for(prompt_id)
+            if backend is None or backend.tracker is None:
+                return
+            context = backend.tracker.detach(prompt_id)
+            if context is None:
+                return
+            msg, batch = context
+            if batch or not await self._cancel_queued_prompt(prompt_id, backend):
+                # Shared with other requesters, or already running: leave it
+                backend.tracker.watch(prompt_id, context)
+                return
+            self.backends.finish(prompt_id)
+            self.coalescer.complete(prompt_id)
+            self.results.take(prompt_id)
+            if msg.get("id"):
+                await asyncio.to_thread(self.ledger.reopen, msg["id"])
+                self.journal.received(msg)
+            self._in_flight.discard(prompt_id)
+            self.preempted += 1
+            print(f"Preempted {prompt_id}; re-queued request {msg.get('id')} locally")
+            await self._replies.put((msg, preemption_response(prompt_id), False, None))
+            self._enqueue(msg, request_type_of(msg) or "unknown", message_priority(msg))
+        finally:
+            self._preempting.discard(prompt_id)
+
+    async def _schedule_loop(self):
+        # Releases waiting requests while ComfyUI has room and their type is under its cap
+        while self.running:
+            self._wake.clear()
+            while self._admitting():
+                blocked = [t for t, n in self._running.items() if n >= self.type_limits.get(t, DEFAULT_LIMIT)]
+                job = self.scheduler.pick(blocked)
+                if job is None:
+                    break
+                self._running[job.request_type] = self._running.get(job.request_type, 0) + 1
+                task = asyncio.create_task(self._run_request(job.request_type, job.item))
+                self._request_tasks.add(task)
+                task.add_done_callback(self._request_tasks.discard)
+            await self._wake.wait()
+
+    def _prompt_finished(self, prompt_id: str):
+        if self._in_flight.discard(prompt_id):
+            self._wake.set()
+
+    async def _run_request(self, request_type: str, msg: dict):
+        trace = self.tracer.get(msg)
+        if trace:
+            trace.add("local_queue", trace.received_at, time.time())
+        with self.tracer.activate(trace):
+            await self._handle_request(request_type, msg)
+
+    async def _handle_request(self, request_type: str, msg: dict):
+        message_id = msg.get("id")
+        # Acknowledged here only when ignored; a queued reply is acknowledged
+        # by the reply worker once it is sent
+        outcome = None
+        try:
+            entry = await asyncio.to_thread(self.ledger.get, message_id) if message_id else None
+            if entry and entry["status"] == SUBMITTED:
+                # Submitted before a restart but never answered: reply, don't resubmit
+                response = entry["response"]
+            else:
+                if message_id:
+                    self.journal.received(msg)
+                response = await self.process_inference_request(msg)
+                if response and message_id:
+                    await asyncio.to_thread(self.ledger.record_response, message_id, response)
+            if not response:
+                await self._finish(msg, IGNORED)
+                outcome = IGNORED
+                if message_id:
+                    self.journal.drop(message_id)
+                return
+            if message_id:
+                # On disk before the requester hears about the prompt
+                seq = self.journal.submitted(message_id, response)
+                try:
+                    await asyncio.to_thread(self.journal.wait, seq)
+                except JournalWriteError as e:
+                    # Still answered; only a crash before completion would lose it
+                    print(f"Job {message_id} is not recoverable after a crash: {e}")
+            await self._replies.put((msg, response, True, None))
+            outcome = SUBMITTED
+            prompt_id = response.get("prompt_id")
+            backend = self.backends.get(response.get("backend")) or self.backends.backend_for(prompt_id)
+            if backend and prompt_id and "error" not in response and not response.get("cached"):
+                if self._watching(msg, prompt_id, backend):
+                    # A retried reply; the first attempt is already watching
+                    return
+                self._in_flight.add(prompt_id, message_priority(msg))
+                if backend.tracker:
+                    backend.tracker.watch(prompt_id, (msg, response.get("batch")))
+                else:
+                    outstanding = self._outstanding.setdefault(prompt_id, ([], time.monotonic(), backend))
+                    outstanding[0].append((msg, response.get("batch")))
+        finally:
+            self._pending[request_type] -= 1
+            self._running[request_type] -= 1
+            self._wake.set()
+            if outcome == IGNORED:
+                self.inbox.ack(msg)
+            elif outcome is None:
+                if message_id:
+                    await asyncio.to_thread(self.ledger.release, message_id)
+                self.inbox.retry(msg)
+
+    def _watching(self, msg: dict, prompt_id: str, backend: Backend) -> bool:
+        """True if this message already waits for the prompt's completion."""
+        if not msg.get("id"):
+            return False
+        if backend.tracker:
+            contexts = backend.tracker.watchers(prompt_id)
+        else:
+            contexts = self._outstanding.get(prompt_id, ([],))[0]
+        return any(context[0].get("id") == msg["id"] for context in contexts)
+
+    async def _intake_loop(self):
+        while self.running:
+            for msg in await self._claim(await self.check_mesh_messages(long_poll=True)):
+                await self._dispatch(msg)
+            if self.inbox.ack_due():
+                await self.flush_acks()
+            await asyncio.sleep(self.poller.next_delay())
+
+    async def _reply_worker(self):
+        while True:
+            # Completion results arrive whole; each requester gets its batch slot
+            msg, response, first, batch = await self._replies.get()
+            try:
+                reply = split_batch_result(response, batch)
+                if not first and self.artifacts is not None:
+                    reply = await self.store_outputs(reply)
+                if not first and self.publisher:
+                    reply = await self.publish_outputs(reply)
+                final = msg.get("id") and reply_is_final(reply, tracked=True)
+                if final and not first:
+                    self.journal.completed(msg["id"], reply)
+                sent = await self.send_response(msg, reply)
+                if final and sent:
+                    self.journal.replied(msg["id"])
+                if first:
+                    if sent:
+                        await self._finish(msg, REPLIED)
+                        self.inbox.ack(msg)
+                    else:
+                        # Unread on the mesh: fetched again and answered from the ledger
+                        if msg.get("id"):
+                            await asyncio.to_thread(self.ledger.release, msg["id"])
+                        self.inbox.retry(msg)
+                elif sent and msg.get("id") and not await asyncio.to_thread(self.ledger.finished, msg["id"]):
+                    # Its first reply never went out; nothing is left to retry
+                    await self._finish(msg, REPLIED)
+                if not first and response.get("prompt_id"):
+                    await self._cache_result(response)
+            finally:
+                self._replies.task_done()
+
+    async def store_outputs(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Add a completed result's outputs to the artifact store; returns it with their digests."""
+        backend = self.backends.get(result.get("backend"))
+        if result.get("status") != "completed" or backend is None:
+            return result
+        outputs = []
+        for output in result.get("outputs") or ():
+            try:
+                digest = await self._store_output(output, backend)
+            except Exception as e:
+                print(f"Could not store {output['filename']} as an artifact: {e}")
+                outputs.append(output)
+                continue
+            stored = {**output, "sha256": digest}
+            if self.artifact_server:
+                stored["artifact_url"] = self.artifact_server.url_for(digest)
+            outputs.append(stored)
+        return {**result, "outputs": outputs}
+
+    async def _store_output(self, output: Dict[str, Any], backend: Backend) -> str:
+        if output.get("sha256") and await asyncio.to_thread(lambda: output["sha256"] in self.artifacts):
+            return output["sha256"]
+        local = backend.output_path(output)
+        if local:
+            # Same machine as ComfyUI: hard-linked, never copied
+            return await asyncio.to_thread(self.artifacts.add_file, local)
+        view = await self._open_view(output, backend)
+        writer = None
+        try:
+            view.raise_for_status()
+            writer = await asyncio.to_thread(self.artifacts.writer, mimetypes.guess_type(output["filename"])[0])
+            async for chunk in view.aiter_bytes(ARTIFACT_CHUNK):
+                await asyncio.to_thread(writer.write, chunk)
+        except BaseException:
+            if writer is not None:
+                await asyncio.to_thread(writer.abort)
+            raise
+        finally:
+            await view.aclose()
+        return await asyncio.to_thread(writer.commit)
+
+    async def _open_view(self, output: Dict[str, Any], backend: Backend) -> httpx.Response:
+        """Streamed ComfyUI /view response for an output (the caller closes it)."""
+        backend.breaker.check()
+        try:
+            view = await self._comfyui.send(
+                self._comfyui.build_request("GET", f"{backend.url}/view", params=output, timeout=30),
+                stream=True,
+            )
+        except httpx.TransportError:
+            backend.breaker.record_failure()
+            raise
+        backend.breaker.record_status(view.status_code)
+        return view
+
+    async def publish_outputs(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Upload a completed result's outputs to the mesh; returns it with their file ids."""
+        backend = self.backends.get(result.get("backend"))
+        if backend is None:
+            return result
+        return await self.publisher.publish_async(
+            result, lambda output: self._upload_output(output, backend, result.get("prompt_id"))
+        )
+
+    async def _upload_output(self, output: Dict[str, Any], backend: Backend,
+                             prompt_id: Optional[str]) -> Dict[str, Any]:
+        """Stream one output into POST /api/files/upload, from the artifact store or ComfyUI's /view."""
+        publisher = self.publisher
+        size = 0
+
+        async def counted(chunks):
+            nonlocal size
+            async for chunk in chunks:
+                size += len(chunk)
+                publisher.check_size(size)
+                yield chunk
+
+        async def stored_chunks(digest: str):
+            chunks = self.artifacts.chunks(digest, publisher.chunk_size)
+            try:
+                while True:
+                    chunk = await asyncio.to_thread(next, chunks, None)
+                    if chunk is None:
+                        return
+                    yield chunk
+            finally:
+                chunks.close()
+
+        async def upload(chunks):
+            return await self._mesh_call(
+                "POST", f"{self.mesh_url}/api/files/upload",
+                content=async_upload_body(upload_fields(self.mesh_agent_id, prompt_id, output), counted(chunks)),
+                headers={"Content-Type": "application/json"},
+                timeout=UPLOAD_TIMEOUT,
+            )
+
+        started = time.perf_counter()
+        stored = None
+        try:
+            if self.artifacts is not None and output.get("sha256"):
+                stored = await asyncio.to_thread(self.artifacts.get, output["sha256"])
+            if stored:
+                # Already on local disk: no second /view fetch
+                publisher.check_size(stored["size"])
+                resp = await upload(stored_chunks(stored["sha256"]))
+            else:
+                view = await self._open_view(output, backend)
+                try:
+                    view.raise_for_status()
+                    publisher.check_size(int(view.headers.get("Content-Length") or 0))
+                    resp = await upload(view.aiter_bytes(publisher.chunk_size))
+                finally:
+                    await view.aclose()
+            resp.raise_for_status()
+            uploaded = resp.json()
+        except Exception:
+            self.metrics.errors["output_publish"].inc()
+            raise
+        finally:
+            self.metrics.stage["output_publish"].since(started)
+        return {"file_id": uploaded["fileId"], "url": uploaded["url"], "size": size}
+
+    async def _cache_result(self, result: Dict[str, Any]):
+        entries = self.results.take(result["prompt_id"])
+        if not entries or result["status"] != "completed":
+            return
+        # Copied once, into the entry of the workflow that ran; a batch's
+        # single-image entry shares those copies
+        key = entries[0][0]
+        files = {}
+        backend = self.backends.get(result.get("backend"))
+        if self.results.files_dir and backend:
+            for output in result["outputs"]:
+                try:
+                    files[output["filename"]] = await self._save_view(key, output, backend)
+                except Exception as e:
+                    print(f"Could not fetch {output['filename']} for the result cache: {e}")
+        for key, batch in entries:
+            await asyncio.to_thread(self.results.store, key, split_batch_result(result, batch), files)
+
+    async def _save_view(self, key: str, output: Dict[str, Any], backend: Backend) -> str:
+        """Stream an output from /view into the result cache; returns the copy's path."""
+        path = await asyncio.to_thread(self.results.file_path, key, output["filename"])
+        partial = path + ".part"
+        view = await self._open_view(output, backend)
+        try:
+            view.raise_for_status()
+            f = await asyncio.to_thread(open, partial, "wb")
+            try:
+                async for chunk in view.aiter_bytes(ARTIFACT_CHUNK):
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.replace, partial, path)
+        except BaseException:
+            await asyncio.to_thread(self.results.discard_file, partial)
+            raise
+        finally:
+            await view.aclose()
+        return path
+
+    def _on_job_complete(self, context: tuple, result: Dict[str, Any], backend: Backend):
+        # Called on the backend's tracker thread (or inline from watch())
+        msg, batch = context
+        self.coalescer.complete(result["prompt_id"], result["timings"]["run_seconds"])
+        if self.backends.finish(result["prompt_id"]):
+            # First watcher of the prompt: count its GPU time and latency once
+            backend.admission.observe(result["timings"]["run_seconds"])
+            self.health.record_latency(result["timings"]["total_seconds"])
+            self.metrics.stage["completion"].observe(result["timings"]["total_seconds"])
+            (self.metrics.failed if result["status"] == "failed" else self.metrics.completed).inc()
+        result = {**result, "backend": backend.name}
+        self.tracer.record_completion(msg, result)
+        self._loop.call_soon_threadsafe(self._prompt_finished, result["prompt_id"])
+        self._loop.call_soon_threadsafe(self._replies.put_nowait, (msg, result, False, batch))
+
+    async def _check_prompt(self, prompt_id: str, limit: asyncio.Semaphore):
+        backend = self._outstanding[prompt_id][2]
+        async with limit:
+            try:
+                resp = await self._request(self._comfyui, backend.breaker, "GET", f"{backend.url}/history/{prompt_id}")
+                entry = resp.json().get(prompt_id) if resp.status_code == 200 else None
+            except Exception:
+                return
+        if not entry:
+            return
+        status = entry.get("status", {})
+        if not status.get("completed") and status.get("status_str") != "error":
+            return
+
+        self._prompt_finished(prompt_id)
+        self.backends.finish(prompt_id)
+        msgs, submitted_at, _ = self._outstanding.pop(prompt_id, (None, None, None))
+        if not msgs:
+            return
+        failed = status.get("status_str") == "error"
+        total_seconds = round(time.monotonic() - submitted_at, 3)
+        # Without execution events the whole turnaround stands in for GPU time
+        self.coalescer.complete(prompt_id, total_seconds)
+        self.health.record_latency(total_seconds)
+        self.metrics.stage["completion"].observe(total_seconds)
+        (self.metrics.failed if failed else self.metrics.completed).inc()
+        result = {
+            "status": "failed" if failed else "completed",
+            "prompt_id": prompt_id,
+            "outputs": extract_outputs(entry),
+            "timings": {"total_seconds": total_seconds},
+            "backend": backend.name,
+        }
+        for msg, batch in msgs:
+            self.tracer.record_completion(msg, result)
+            await self._replies.put((msg, result, False, batch))
+
+    async def _track_loop(self):
+        limit = asyncio.Semaphore(TRACK_CONCURRENCY)
+        while self.running:
+            if self._outstanding:
+                await asyncio.gather(*(self._check_prompt(pid, limit) for pid in list(self._outstanding)))
+            await asyncio.sleep(self.track_interval)
+
+    async def recover_jobs(self) -> int:
+        """Finish the jobs a previous run left without a final reply.
+
+        Same reconciliation as ``ComfyUIMeshAgent.recover_jobs``; without
+        completion tracking, prompts still on ComfyUI go back to the
+        ``/history`` poller. Returns how many jobs were picked up.
+        """
+        jobs = self.journal.open_jobs()
+        for job in jobs:
+            msg = journal_message(job)
+            response = job.get("response")
+            if job["state"] == RECEIVED:
+                for claimed in await self._claim([msg]):
+                    await self._dispatch(claimed)
+            elif job["state"] == COMPLETED and job.get("result"):
+                await self._replies.put((msg, job["result"], False, None))
+            elif not job.get("prompt_id") or (response or {}).get("cached"):
+                # The stored response was already the final one
+                if response:
+                    await self._replies.put((msg, response, False, None))
+                else:
+                    self.journal.drop(msg["id"])
+            else:
+                await self._recover_prompt(msg, job)
+        if jobs:
+            print(f"Recovered {len(jobs)} unfinished jobs from the journal")
+        return len(jobs)
+
+    async def _recover_prompt(self, msg: dict, job: Dict[str, Any]):
+        prompt_id, batch = job["prompt_id"], job.get("batch")
+        backend = self.backends.get(job.get("backend"))
+        if backend is None:
+            await self._replies.put((msg, {
+                "status": "failed", "prompt_id": prompt_id,
+                "error": f"ComfyUI backend {job.get('backend')} is no longer configured",
+            }, False, None))
+            return
+        result, queued = None, True
+        try:
+            resp = await self._request(self._comfyui, backend.breaker, "GET", f"{backend.url}/history/{prompt_id}")
+            entry = resp.json().get(prompt_id) if resp.status_code == 200 else None
+            result = history_result(prompt_id, entry) if entry else None
+            if result is None:
+                resp = await self._request(self._comfyui, backend.breaker, "GET", f"{backend.url}/queue")
+                queued = prompt_id in comfyui_queue_ids(resp.json())
+        except Exception as e:
+            # Left to the tracker or the /history poller
+            print(f"Could not check prompt {prompt_id} on {backend.name}: {e}")
+        if result is not None:
+            await self._replies.put((msg, {**result, "backend": backend.name}, False, batch))
+        elif queued:
+            priority = message_priority(msg)
+            self.backends.adopt(prompt_id, backend, priority)
+            self._in_flight.add(prompt_id, priority)
+            if backend.tracker:
+                backend.tracker.watch(prompt_id, (msg, batch))
+            else:
+                outstanding = self._outstanding.setdefault(prompt_id, ([], time.monotonic(), backend))
+                outstanding[0].append((msg, batch))
+        else:
+            await self._replies.put((msg, {
+                "status": "failed", "prompt_id": prompt_id, "backend": backend.name,
+                "error": "ComfyUI no longer has this prompt",
+            }, False, None))
+
+    async def run(self):
+        """Register, announce and serve requests until ``stop()`` is called."""
+        async with self:
+            await asyncio.to_thread(self.ledger.compact)
+            if not await self.register_with_mesh():
+                return
+            await self.broadcast_availability()
+
+            self.running = True
+            self._stopped = asyncio.Event()
+            self._replies = asyncio.Queue()
+            self._wake = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+            await self.recover_jobs()
+            for backend in self.backends.backends():
+                if backend.tracker:
+                    backend.tracker.start()
+            if self.metrics_port is not None:
+                self.metrics.registry.serve(self.metrics_port)
+            if self.artifact_server:
+                self.artifact_server.start()
+            print(f"{self.agent_name} listening for mesh requests (asyncio)...")
+
+            tasks = [asyncio.create_task(self._intake_loop()), asyncio.create_task(self._schedule_loop())]
+            if not self.track_completions:
+                tasks.append(asyncio.create_task(self._track_loop()))
+            tasks.append(asyncio.create_task(self._sample_loop()))
+            tasks.append(asyncio.create_task(self._report_loop()))
+            tasks += [asyncio.create_task(self._reply_worker()) for _ in range(self.reply_workers)]
+            try:
+                await self._stopped.wait()
+            finally:
+                tasks += list(self._request_tasks)
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                for backend in self.backends.backends():
+                    if backend.tracker:
+                        await asyncio.to_thread(backend.tracker.stop)
+                self.metrics.registry.stop_serving()
+                if self.artifact_server:
+                    self.artifact_server.stop()
+                await asyncio.to_thread(self.tracer.flush)
+                await self.flush_acks()
+                await asyncio.to_thread(self.journal.close)
+
+    def stop(self):
+        """Stop the agent. Must be called from the event loop thread."""
+        self.running = False
+        if self._stopped is not None:
+            self._stopped.set()
+        print(f"{self.agent_name} stopped")
+
+
+def run_async_mesh_integration():
+    """Run the asyncio ComfyUI mesh integration."""
+    asyncio.run(AsyncComfyUIMeshAgent().run())
+
+
+if __name__ == "__main__":
+    run_async_mesh_integration()
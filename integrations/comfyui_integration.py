@@ -10,12 +10,47 @@ Usage:
     agent = ComfyUIMeshAgent()
     agent.register_with_mesh()
     agent.listen_for_generation_requests()
+
+When websocket-client is installed, requests are received over the mesh's
+/ws push channel; inbox polling is only used while that socket is down.
 """
 
-import requests
 import json
+import mimetypes
+import threading
 import time
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
+
+from .admission import SAMPLE_INTERVAL
+from .artifacts import ArtifactServer, ArtifactStore
+from .backends import Backend, BackendPool
+from .batching import BATCH_WINDOW, LatentBatcher, batch_limit, batchable, split_batch_result
+from .breaker import CircuitOpenError
+from .coalescing import SingleFlight, workflow_key
+from .completion import CompletionTracker
+from .delivery import UPLOAD_TIMEOUT, OutputPublisher, upload_body, upload_fields
+from .dispatcher import (
+    DEFAULT_LIMIT,
+    TYPE_LIMITS,
+    InferenceDispatcher,
+    cancel_target_of,
+    cancelled_response,
+    preemption_response,
+    request_type_of,
+)
+from .health_report import HealthReporter
+from .inbox import InboxCursor, state_path
+from .journal import COMPLETED, RECEIVED, JobJournal, JournalWriteError, history_result, journal_message
+from .ledger import IGNORED, REPLIED, SUBMITTED, MessageLedger
+from .metrics import IntegrationMetrics
+from .polling import MIN_INTERVAL, AdaptivePoller
+from .mesh_push import MeshPushListener, mesh_ws_url, normalize_message, push_available
+from .result_cache import ResultCache
+from .scheduler import MAX_IN_FLIGHT, comfyui_queue_ids, message_model_group, message_priority
+from .tracing import Tracer, reply_is_final
+from .transport import PooledTransport
+from .workflows import WorkflowRegistry, WorkflowTemplate, default_registry
 
 # Agent Mesh settings
 MESH_API_URL = "http://localhost:4000"
@@ -25,22 +60,176 @@ MESH_API_KEY = "openclaw-mesh-default-key"
 COMFYUI_URL = "http://localhost:8188"
 COMFYUI_DISTRIBUTED_URL = f"{COMFYUI_URL}/distributed"
 
+# Fallback polling (used only while the push socket is unavailable):
+# the idle ceiling of the adaptive interval and the longest wait after errors
+POLL_INTERVAL = 10
+ERROR_BACKOFF = 30
+
+# Threads copying finished outputs to the artifact store and the mesh file store
+PUBLISH_WORKERS = 4
+# Bytes read from /view per step when storing an artifact
+ARTIFACT_CHUNK = 1024 * 1024
+
 # This agent's identity
 AGENT_NAME = "ComfyUI-Mesh-Agent"
 
 
+def build_image_workflow(prompt: dict, options: dict) -> Dict[str, Any]:
+    """Build the SDXL text-to-image ComfyUI graph for a request."""
+    return default_registry().get("image_generation").instantiate(prompt, options)
+
+
+def build_video_workflow(prompt: dict, options: dict) -> Dict[str, Any]:
+    """Build the WAN2.2 text-to-video ComfyUI graph for a request."""
+    return default_registry().get("video_generation").instantiate(prompt, options)
+
+
 class ComfyUIMeshAgent:
     """Integrates ComfyUI with Agent Mesh for distributed inference."""
     
-    def __init__(self, agent_name: str = None):
+    def __init__(self, agent_name: str = None, use_websocket: bool = True,
+                 transport: Optional[PooledTransport] = None,
+                 type_limits: Optional[Dict[str, int]] = None,
+                 queue_size: Optional[int] = None,
+                 concurrent: bool = True,
+                 inbox: Optional[InboxCursor] = None,
+                 ledger: Optional[MessageLedger] = None,
+                 workflows: Optional[WorkflowRegistry] = None,
+                 track_completions: bool = True,
+                 results: Optional[ResultCache] = None,
+                 cache_files: bool = False,
+                 batch_window: float = BATCH_WINDOW,
+                 max_batch: Optional[int] = None,
+                 preempt: bool = False,
+                 admission: bool = True,
+                 backends: Optional[BackendPool] = None,
+                 health: Optional[HealthReporter] = None,
+                 metrics: Optional[IntegrationMetrics] = None,
+                 metrics_port: Optional[int] = None,
+                 tracer: Optional[Tracer] = None,
+                 poll_interval: float = POLL_INTERVAL,
+                 journal: Optional[JobJournal] = None,
+                 poller: Optional[AdaptivePoller] = None,
+                 publish_outputs: bool = True,
+                 publisher: Optional[OutputPublisher] = None,
+                 artifacts: Optional[ArtifactStore] = None,
+                 artifacts_port: Optional[int] = None):
         self.mesh_url = MESH_API_URL
+        self.mesh_ws_url = mesh_ws_url(MESH_API_URL)
         self.mesh_key = MESH_API_KEY
-        self.comfyui_url = COMFYUI_URL
-        self.comfyui_distributed_url = COMFYUI_DISTRIBUTED_URL
+        # ComfyUI instances this agent fronts; add_backend/remove_backend change it live
+        self.backends = backends or BackendPool([Backend(COMFYUI_URL, name="default")])
         self.agent_name = agent_name or AGENT_NAME
         self.mesh_agent_id = None
         self.running = False
+        self.use_websocket = use_websocket
+        # Inbox poll timing while the push socket is down
+        self.poller = poller or AdaptivePoller(
+            min_interval=min(MIN_INTERVAL, poll_interval), max_interval=poll_interval,
+            max_error_interval=ERROR_BACKOFF,
+        )
+        # Shared keep-alive sessions; mesh auth rides on the session headers
+        self.transport = transport or PooledTransport(mesh_headers={"X-API-Key": self.mesh_key})
+        self._push: Optional[MeshPushListener] = None
+        # What happened to every handled message, so restarts never re-queue work
+        self.ledger = ledger or MessageLedger(state_path(self.agent_name, "ledger.db"))
+        # Every job still owed a reply, so a crash never loses a prompt_id
+        self.journal = journal or JobJournal(state_path(self.agent_name, "journal.log"))
+        self.workflows = workflows or default_registry()
+        # Identical in-flight generations share one ComfyUI prompt
+        self.coalescer = SingleFlight()
+        # Completed generations by workflow hash; cache_files also keeps the bytes
+        self.results = results or ResultCache(
+            state_path(self.agent_name, "results.db"),
+            files_dir=state_path(self.agent_name, "results") if cache_files else None,
+        )
+        # Compatible unseeded image requests share one latent batch
+        self.batcher: Optional[LatentBatcher] = None
+        image_limit = (TYPE_LIMITS if type_limits is None else type_limits).get("image_generation", DEFAULT_LIMIT)
+        max_batch = batch_limit(max_batch, image_limit)
+        if max_batch > 1:
+            self.batcher = LatentBatcher(self._submit_batch, window=batch_window, max_batch=max_batch)
+        # Finished outputs go to the mesh file store; replies carry their file ids
+        self.publisher = (publisher or OutputPublisher()) if publish_outputs else None
+        # Local content-addressed copies of outputs, served on artifacts_port while listening
+        self.artifacts = artifacts
+        self.artifact_server: Optional[ArtifactServer] = None
+        if artifacts is not None and artifacts_port is not None:
+            self.artifact_server = ArtifactServer(artifacts, artifacts_port)
+        self._publishing: Optional[ThreadPoolExecutor] = None
+        if self.publisher or self.artifacts:
+            self._publishing = ThreadPoolExecutor(PUBLISH_WORKERS, thread_name_prefix="output-publish")
+        # Durable inbox high-water mark and pending read acknowledgements
+        self.inbox = inbox or InboxCursor(state_path(self.agent_name, "inbox.json"))
+        # Final inference_response per job from each backend's event stream
+        self.track_completions = track_completions and push_available()
+        for backend in self.backends.backends():
+            self._attach_backend(backend)
+        self.backends.on_added = self._attach_backend
+        self.backends.on_removed = self._detach_backend
+        # Status last broadcast to the mesh
+        self._announced: Optional[str] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._sampler_stop = threading.Event()
+        # Load published to the mesh health dashboard
+        self.health = health or HealthReporter()
+        self._reporter: Optional[threading.Thread] = None
+        self._reporter_stop = threading.Event()
+        # Stage latencies and counters; served on metrics_port while listening
+        self.metrics = metrics or IntegrationMetrics()
+        self.metrics_port = metrics_port
+        # Per-request stage spans; trace ids go back in every response
+        self.tracer = tracer or Tracer()
+        self.dispatcher: Optional[InferenceDispatcher] = None
+        if concurrent:
+            dispatcher_options = {"type_limits": type_limits}
+            if queue_size is not None:
+                dispatcher_options["queue_size"] = queue_size
+            self.dispatcher = InferenceDispatcher(
+                handler=self._process_and_reply,
+                reject=self.send_response,
+                classify=self._model_group,
+                # Holding jobs locally needs completions to know when ComfyUI frees up
+                max_in_flight=MAX_IN_FLIGHT if self.track_completions else None,
+                preempt=self._preempt_prompt if preempt and self.track_completions else None,
+                # Sampled queue depth and VRAM of every backend decide when held jobs go out
+                admission=self.backends if admission and self.track_completions else None,
+                hold=self.send_response,
+                **dispatcher_options
+            )
+        self.metrics.watch(self, lambda: len(self.dispatcher.scheduler) if self.dispatcher else 0)
+        if self.dispatcher:
+            self.dispatcher.scheduler.on_release = self.metrics.record_release
+        if self.batcher:
+            self.batcher.on_batch = self.metrics.batch_size.observe
     
+    def add_backend(self, url: str, name: Optional[str] = None,
+                    models: Optional[List[str]] = None, max_resolution: Optional[int] = None,
+                    output_dir: Optional[str] = None) -> Backend:
+        """Start sending work to another ComfyUI instance."""
+        return self.backends.add(Backend(url, name, models, max_resolution, output_dir=output_dir))
+
+    def remove_backend(self, name: str) -> bool:
+        """Stop sending work to a ComfyUI instance; its queued prompts still finish."""
+        return self.backends.remove(name)
+
+    def _attach_backend(self, backend: Backend):
+        if self.track_completions and backend.tracker is None:
+            backend.tracker = CompletionTracker(
+                backend.url,
+                on_complete=lambda context, result: self._on_job_complete(context, result, backend),
+                fetch_history=lambda prompt_id: self._fetch_history(prompt_id, backend),
+                on_start=self.journal.running,
+            )
+            if self.running:
+                backend.tracker.start()
+        print(f"ComfyUI backend {backend.name} added ({backend.url})")
+
+    def _detach_backend(self, backend: Backend):
+        if backend.tracker is not None:
+            backend.tracker.stop()
+        print(f"ComfyUI backend {backend.name} removed")
+
     def register_with_mesh(self) -> bool:
         """Register this agent with the Agent Mesh."""
         print(f"Registering {self.agent_name} with Agent Mesh...")
@@ -57,9 +246,8 @@ class ComfyUIMeshAgent:
         }
         
         try:
-            resp = requests.post(
+            resp = self.transport.mesh_post(
                 f"{self.mesh_url}/api/agents/register",
-                headers={"X-API-Key": self.mesh_key, "Content-Type": "application/json"},
                 json=payload,
                 timeout=10
             )
@@ -77,7 +265,10 @@ class ComfyUIMeshAgent:
             return False
     
     def broadcast_availability(self):
-        """Broadcast that ComfyUI is available for inference."""
+        """Broadcast whether ComfyUI is available, degraded or unavailable for inference."""
+        status = self.backends.availability()
+        backends = [b for b in self.backends.backends() if not b.draining]
+        primary = backends[0] if backends else None
         payload = {
             "content": json.dumps({
                 "type": "service_announcement",
@@ -88,10 +279,11 @@ class ComfyUIMeshAgent:
                     "distributed_inference",
                     "multi_gpu_processing"
                 ],
-                "endpoint": self.comfyui_distributed_url,
-                "api_endpoint": f"{self.comfyui_url}/api",
-                "distributed_endpoint": self.comfyui_distributed_url,
-                "status": "available",
+                "endpoint": primary.distributed_url if primary else None,
+                "api_endpoint": f"{primary.url}/api" if primary else None,
+                "distributed_endpoint": primary.distributed_url if primary else None,
+                "backends": [b.describe() for b in backends],
+                "status": status,
                 "gpu": "NVIDIA GeForce RTX 5060 Ti (16GB)"
             }),
             "sender": self.agent_name,
@@ -99,41 +291,92 @@ class ComfyUIMeshAgent:
         }
         
         try:
-            resp = requests.post(
+            resp = self.transport.mesh_post(
                 f"{self.mesh_url}/api/broadcast",
-                headers={"X-API-Key": self.mesh_key, "Content-Type": "application/json"},
                 json=payload,
                 timeout=10
             )
             if resp.status_code == 200:
-                print("Broadcast availability to mesh")
+                self._announced = status
+                print(f"Broadcast availability to mesh: {status}")
             else:
                 print(f"Broadcast failed: {resp.status_code}")
         except Exception as e:
             print(f"Broadcast error: {e}")
     
-    def check_mesh_messages(self) -> list:
-        """Check for messages from other agents."""
+    def check_mesh_messages(self, long_poll: bool = False) -> list:
+        """Check for new messages from other agents.
+
+        Only unread messages past the inbox cursor are requested; the
+        returned messages (oldest first) advance the cursor. With
+        ``long_poll`` a mesh that supports it holds an empty read open
+        until a message arrives.
+        """
         if not self.mesh_agent_id:
             return []
         
+        params = self.inbox.query_params()
+        wait = self.poller.wait_seconds() if long_poll else 0
+        if wait:
+            params.update(self.poller.query_params())
+        started = time.perf_counter()
         try:
-            resp = requests.get(
+            resp = self.transport.mesh_get(
                 f"{self.mesh_url}/api/messages/{self.mesh_agent_id}",
-                headers={"X-API-Key": self.mesh_key},
-                timeout=5
+                params=params,
+                timeout=5 + wait
             )
             
             if resp.status_code == 200:
-                return resp.json().get("messages", [])
+                data = resp.json()
+                if isinstance(data, dict):
+                    data = data.get("messages", [])
+                messages = self.inbox.accept([normalize_message(m) for m in data])
+                self.metrics.messages.inc(len(messages))
+                self.poller.record(len(messages), resp.headers, long_polled=bool(wait))
+                return messages
+            self.metrics.errors["inbox_fetch"].inc()
+            self.poller.record_error()
             return []
         except:
+            self.metrics.errors["inbox_fetch"].inc()
+            self.poller.record_error()
             return []
+        finally:
+            self.metrics.stage["inbox_fetch"].since(started)
+    
+    def flush_acks(self) -> int:
+        """Mark handled messages read on the mesh. Returns how many succeeded."""
+        batch = self.inbox.take_acks()
+        if not batch:
+            return 0
+        
+        failed = set()
+        for message_id in batch:
+            try:
+                resp = self.transport.mesh_post(
+                    f"{self.mesh_url}/api/messages/{message_id}/read",
+                    idempotent=True,
+                    timeout=5
+                )
+                if resp.status_code != 200:
+                    failed.add(message_id)
+            except Exception:
+                failed.add(message_id)
+        
+        self.inbox.acked([m for m in batch if m not in failed], list(failed))
+        return len(batch) - len(failed)
     
     def process_inference_request(self, message: dict) -> Optional[Dict[str, Any]]:
         """Process an inference request from another agent."""
         try:
-            content = json.loads(message.get("content", "{}"))
+            started = time.perf_counter()
+            try:
+                content = json.loads(message.get("content", "{}"))
+            except ValueError:
+                self.metrics.errors["json_parse"].inc()
+                raise
+            self.metrics.stage["json_parse"].since(started)
             
             if content.get("type") != "inference_request":
                 return None
@@ -156,147 +399,766 @@ class ComfyUIMeshAgent:
         except Exception as e:
             return {"error": str(e)}
     
-    def generate_image(self, prompt: dict, options: dict) -> Dict[str, Any]:
-        """Generate an image via ComfyUI."""
+    def submit_template(self, name: str, prompt: dict, options: dict) -> Dict[str, Any]:
+        """Instantiate a workflow template and queue it on ComfyUI.
+
+        A workflow that was already generated is answered from the result
+        cache (marked ``cached``). A request identical to one already in
+        flight is not submitted again; it gets the in-flight ``prompt_id``
+        (marked ``coalesced``) instead.
+        """
+        started = time.perf_counter()
         try:
-            workflow = {
-                "3": {"class_type": "CLIPTextEncode", "inputs": {"text": prompt.get("positive", ""), "clip": ["4", 0]}},
-                "4": {"class_type": "CLIPTextEncode", "inputs": {"text": prompt.get("negative", "bad quality"), "clip": ["4", 0]}},
-                "5": {"class_type": "KSampler", "inputs": {"seed": options.get("seed", 42), "steps": options.get("steps", 20), "cfg": options.get("cfg", 8), "sampler_name": options.get("sampler", "euler"), "scheduler": "normal", "model": ["6", 0], "positive": ["3", 0], "negative": ["4", 0], "latent_image": ["7", 0]}},
-                "6": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": options.get("model", "sd_xl_base_1.0.safetensors")}},
-                "7": {"class_type": "EmptyLatentImage", "inputs": {"width": options.get("width", 1024), "height": options.get("height", 1024), "batch_size": 1}},
-                "8": {"class_type": "VAEDecode", "inputs": {"samples": ["5", 0], "vae": ["6", 0]}},
-                "9": {"class_type": "SaveImage", "inputs": {"images": ["8", 0], "filename_prefix": options.get("filename", "mesh_generated")}}
-            }
-            
-            resp = requests.post(
-                f"{self.comfyui_url}/api/prompt",
-                json={"prompt": workflow, "client_id": "mesh-agent"},
-                timeout=10
-            )
-            
-            if resp.status_code == 200:
-                return {"status": "queued", "prompt_id": resp.json().get("prompt_id")}
-            else:
-                return {"error": f"ComfyUI error: {resp.status_code}"}
-                
+            with self.tracer.span("workflow_build", workflow=name):
+                template = self.workflows.get(name)
+                workflow_json = template.render(prompt, options)
         except Exception as e:
+            self.metrics.errors["workflow_build"].inc()
             return {"error": str(e)}
+        self.metrics.stage["workflow_build"].since(started)
+        
+        key = workflow_key(workflow_json)
+        cached = self.results.lookup(key)
+        if cached:
+            return cached
+        
+        flight, leader = self.coalescer.begin(key)
+        if not leader:
+            response = self.coalescer.wait(flight)
+            if response:
+                return response
+        
+        response = None
+        try:
+            response = self._queue_prompt(template, workflow_json)
+            if response.get("prompt_id") and "error" not in response:
+                self.results.expect(response["prompt_id"], key)
+            return response
+        finally:
+            if leader:
+                self.coalescer.resolve(flight, response)
     
-    def generate_video(self, prompt: dict, options: dict) -> Dict[str, Any]:
-        """Generate a video via ComfyUI (WAN2.2)."""
+    def _queue_prompt(self, template: WorkflowTemplate, workflow_json: str) -> Dict[str, Any]:
+        """Submit a rendered workflow to the backend the pool picks for it."""
         try:
-            workflow = {
-                "unet": {"class_type": "UNETLoader", "inputs": {"unet_name": "wan2.2_ti2v_5B_fp16.safetensors"}},
-                "clip": {"class_type": "CLIPLoader", "inputs": {"clip_name": "umt5_xxl_fp8_e4m3fn_scaled.safetensors", "type": "wan"}},
-                "vae": {"class_type": "VAELoader", "inputs": {"vae_name": "wan2.2_vae.safetensors"}},
-                "pos": {"class_type": "CLIPTextEncode", "inputs": {"clip": ["clip", 0], "text": prompt.get("prompt", "")}},
-                "neg": {"class_type": "CLIPTextEncode", "inputs": {"clip": ["clip", 0], "text": "blurry, distorted, cartoon"}},
-                "model_shift": {"class_type": "ModelSamplingSD3", "inputs": {"model": ["unet", 0], "shift": 8}},
-                "i2v": {"class_type": "Wan22ImageToVideoLatent", "inputs": {"vae": ["vae", 0], "width": options.get("width", 1280), "height": options.get("height", 704), "length": options.get("frames", 125), "batch_size": 1}},
-                "samp": {"class_type": "KSampler", "inputs": {"seed": options.get("seed", 77777), "steps": 20, "cfg": 5, "sampler_name": "uni_pc", "model": ["model_shift", 0], "positive": ["pos", 0], "negative": ["neg", 0], "latent_image": ["i2v", 0]}},
-                "decode": {"class_type": "VAEDecode", "inputs": {"samples": ["samp", 0], "vae": ["vae", 0]}},
-                "create_video": {"class_type": "CreateVideo", "inputs": {"images": ["decode", 0], "fps": 24}},
-                "save": {"class_type": "SaveVideo", "inputs": {"video": ["create_video", 0], "filename_prefix": options.get("filename", "mesh_video"), "format": "mp4"}}
-            }
-            
-            resp = requests.post(
-                f"{self.comfyui_url}/api/prompt",
-                json={"prompt": workflow, "client_id": "mesh-agent-video"},
-                timeout=10
-            )
+            backend = self.backends.choose(json.loads(workflow_json))
+        except CircuitOpenError as e:
+            return {"error": str(e), "retry_after": round(e.retry_after, 1)}
+        if backend is None:
+            return {"error": "No ComfyUI backend has the models and resolution this workflow needs"}
+        prompt_id = None
+        started = time.perf_counter()
+        try:
+            with self.tracer.span("comfyui_submit", backend=backend.name):
+                resp = self.transport.comfyui_post(
+                    f"{backend.url}/api/prompt",
+                    data=template.body_for(workflow_json, self._client_id(backend)),
+                    headers={"Content-Type": "application/json"},
+                    timeout=10,
+                    breaker=backend.breaker,
+                )
             
             if resp.status_code == 200:
-                return {"status": "queued", "prompt_id": resp.json().get("prompt_id")}
+                prompt_id = resp.json().get("prompt_id")
+                return {"status": "queued", "prompt_id": prompt_id, "backend": backend.name}
             else:
                 return {"error": f"ComfyUI error: {resp.status_code}"}
                 
         except Exception as e:
             return {"error": str(e)}
+        finally:
+            self.metrics.stage["comfyui_submit"].since(started)
+            if prompt_id:
+                self.backends.assign(prompt_id, backend)
+            else:
+                self.metrics.errors["comfyui_submit"].inc()
+                self.backends.abandon(backend)
+    
+    def generate_image(self, prompt: dict, options: dict) -> Dict[str, Any]:
+        """Generate an image via ComfyUI, batched with compatible requests."""
+        name = options.get("workflow", "image_generation")
+        if self.batcher:
+            template = self.workflows.get(name)
+            if batchable(template, options) and not self._reusable(template, prompt, options):
+                return self.batcher.submit(template, prompt, options)
+        return self.submit_template(name, prompt, options)
+
+    def _reusable(self, template: WorkflowTemplate, prompt: dict, options: dict) -> bool:
+        """True if this exact request is cached or in flight, so it should not start a batch."""
+        try:
+            key = workflow_key(template.render(prompt, options))
+        except Exception:
+            return False
+        return key in self.results or self.coalescer.in_flight(key)
+
+    def _submit_batch(self, name: str, prompt: dict, options: dict) -> Dict[str, Any]:
+        """Submit for the batcher; a latent batch also stands in for its first image alone."""
+        response = self.submit_template(name, prompt, options)
+        size = options.get("batch_size", 1)
+        if size > 1 and response.get("status") == "queued" and not response.get("coalesced"):
+            # Later identical requests join slot 0 instead of starting another batch
+            slot = {"size": size, "index": 0}
+            key = workflow_key(self.workflows.get(name).render(prompt, {**options, "batch_size": 1}))
+            if self.coalescer.publish(key, {**response, "batch": slot}):
+                self.results.expect(response["prompt_id"], key, slot)
+        return response
+    
+    def generate_video(self, prompt: dict, options: dict) -> Dict[str, Any]:
+        """Generate a video via ComfyUI (WAN2.2)."""
+        return self.submit_template(options.get("workflow", "video_generation"), prompt, options)
     
     def queue_distributed_workflow(self, workflow: dict, options: dict) -> Dict[str, Any]:
         """Queue a distributed workflow via ComfyUI-Distributed API."""
+        try:
+            backend = self.backends.choose(workflow) if isinstance(workflow, dict) else None
+        except CircuitOpenError as e:
+            return {"error": str(e), "retry_after": round(e.retry_after, 1)}
+        if backend is None:
+            return {"error": "No ComfyUI backend can run this workflow"}
+        prompt_id = None
+        started = time.perf_counter()
         try:
             payload = {
                 "prompt": workflow,
-                "client_id": "mesh-distributed",
+                "client_id": self._client_id(backend, "mesh-distributed"),
                 "delegate_master": options.get("delegate_master", False),
                 "enabled_worker_ids": options.get("worker_ids", [])
             }
             
-            resp = requests.post(
-                f"{self.comfyui_distributed_url}/queue",
-                json=payload,
-                timeout=10
-            )
+            with self.tracer.span("comfyui_submit", backend=backend.name, distributed=True):
+                resp = self.transport.comfyui_post(
+                    f"{backend.distributed_url}/queue",
+                    json=payload,
+                    timeout=10,
+                    breaker=backend.breaker,
+                )
             
             if resp.status_code == 200:
                 data = resp.json()
+                prompt_id = data.get("prompt_id")
                 return {
                     "status": "distributed_queued",
-                    "prompt_id": data.get("prompt_id"),
-                    "worker_count": data.get("worker_count", 1)
+                    "prompt_id": prompt_id,
+                    "worker_count": data.get("worker_count", 1),
+                    "backend": backend.name,
                 }
             else:
                 return {"error": f"Distributed API error: {resp.status_code}"}
                 
         except Exception as e:
             return {"error": str(e)}
+        finally:
+            self.metrics.stage["comfyui_submit"].since(started)
+            if prompt_id:
+                self.backends.assign(prompt_id, backend)
+            else:
+                self.metrics.errors["comfyui_submit"].inc()
+                self.backends.abandon(backend)
     
-    def send_response(self, original_message: dict, response: Dict[str, Any]):
-        """Send response back to the requesting agent."""
+    def send_response(self, original_message: dict, response: Dict[str, Any]) -> bool:
+        """Send response back to the requesting agent, tagged with its trace id."""
+        trace = self.tracer.get(original_message)
+        if trace:
+            response = {**response, "trace_id": trace.trace_id}
         payload = {
             "content": json.dumps({
                 "type": "inference_response",
                 "original_request": json.loads(original_message.get("content", "{}")),
                 "response": response
             }),
-            "sender": self.agent_name,
-            "recipient": original_message.get("sender"),
-            "priority": "normal"
+            "from": self.mesh_agent_id or self.agent_name,
+            "to": original_message.get("sender"),
+            "messageType": "direct"
         }
         
+        started = time.perf_counter()
+        sent_at = time.time()
         try:
-            requests.post(
-                f"{self.mesh_url}/api/messages/send",
-                headers={"X-API-Key": self.mesh_key, "Content-Type": "application/json"},
+            resp = self.transport.mesh_post(
+                f"{self.mesh_url}/api/messages",
                 json=payload,
                 timeout=10
             )
+            if not 200 <= resp.status_code < 300:
+                self.metrics.errors["response_send"].inc()
+                print(f"Failed to send response: mesh returned {resp.status_code}")
+                return False
             print(f"Sent response to {original_message.get('sender')}")
+            return True
         except Exception as e:
+            self.metrics.errors["response_send"].inc()
             print(f"Failed to send response: {e}")
+            return False
+        finally:
+            self.metrics.stage["response_send"].since(started)
+            if trace:
+                status = response.get("status") or ("error" if "error" in response else None)
+                trace.add("response_send", sent_at, time.time(), status=status)
+                if reply_is_final(response, self.track_completions):
+                    self.tracer.finish(original_message, status=status)
     
+    @staticmethod
+    def _client_id(backend: Backend, default: Optional[str] = None) -> Optional[str]:
+        # ComfyUI only streams execution events to the submitting client id
+        return backend.tracker.client_id if backend.tracker else default
+
+    def _backend_of(self, response: Dict[str, Any]) -> Optional[Backend]:
+        return self.backends.get(response.get("backend")) or self.backends.backend_for(response.get("prompt_id"))
+
+    def _fetch_history(self, prompt_id: str, backend: Backend) -> Optional[Dict[str, Any]]:
+        resp = self.transport.comfyui_get(f"{backend.url}/history/{prompt_id}", timeout=5, breaker=backend.breaker)
+        if resp.status_code != 200:
+            return None
+        return resp.json().get(prompt_id)
+
+    def _on_job_complete(self, context: tuple, result: Dict[str, Any], backend: Backend):
+        """Send the final inference_response once ComfyUI finishes a prompt."""
+        message, batch = context
+        print(f"Job {result['prompt_id']} {result['status']} in {result['timings']['total_seconds']}s")
+        self.coalescer.complete(result["prompt_id"], result["timings"]["run_seconds"])
+        if self.backends.finish(result["prompt_id"]):
+            # First watcher of the prompt: count its GPU time and latency once
+            backend.admission.observe(result["timings"]["run_seconds"])
+            self.health.record_latency(result["timings"]["total_seconds"])
+            self.metrics.stage["completion"].observe(result["timings"]["total_seconds"])
+            (self.metrics.failed if result["status"] == "failed" else self.metrics.completed).inc()
+        result = {**result, "backend": backend.name}
+        self.tracer.record_completion(message, result)
+        if self.dispatcher:
+            self.dispatcher.prompt_finished(result["prompt_id"])
+        reply = split_batch_result(result, batch)
+        if reply.get("status") == "completed" and reply.get("outputs") and self._publishing:
+            # Copies and uploads can take minutes; keep them off the backend's event thread
+            self._publishing.submit(self._deliver, message, reply, result, backend)
+        else:
+            self._deliver(message, reply, result, backend)
+
+    def _deliver(self, message: dict, reply: Dict[str, Any], result: Dict[str, Any], backend: Backend):
+        if self.artifacts is not None:
+            reply = self.store_outputs(reply, backend)
+        if self.publisher:
+            reply = self.publish_outputs(reply, backend)
+        message_id = message.get("id")
+        if message_id:
+            self.journal.completed(message_id, reply)
+        if self.send_response(message, reply) and message_id:
+            self.journal.replied(message_id)
+            if not self.ledger.finished(message_id):
+                # Its first reply never went out; nothing is left to retry
+                self.ledger.finish(message_id, REPLIED)
+        self._cache_result(result, backend)
+
+    def store_outputs(self, result: Dict[str, Any], backend: Backend) -> Dict[str, Any]:
+        """Add a completed result's outputs to the artifact store; returns it with their digests."""
+        if result.get("status") != "completed":
+            return result
+        outputs = []
+        for output in result.get("outputs") or ():
+            try:
+                digest = self._store_output(output, backend)
+            except Exception as e:
+                print(f"Could not store {output['filename']} as an artifact: {e}")
+                outputs.append(output)
+                continue
+            stored = {**output, "sha256": digest}
+            if self.artifact_server:
+                stored["artifact_url"] = self.artifact_server.url_for(digest)
+            outputs.append(stored)
+        return {**result, "outputs": outputs}
+
+    def _store_output(self, output: Dict[str, Any], backend: Backend) -> str:
+        if output.get("sha256") and output["sha256"] in self.artifacts:
+            return output["sha256"]
+        local = backend.output_path(output)
+        if local:
+            # Same machine as ComfyUI: hard-linked, never copied
+            return self.artifacts.add_file(local)
+        content_type = mimetypes.guess_type(output["filename"])[0]
+        with self.transport.comfyui_get(
+            f"{backend.url}/view", params=output, stream=True, timeout=30, breaker=backend.breaker
+        ) as view:
+            view.raise_for_status()
+            return self.artifacts.add_stream(view.iter_content(ARTIFACT_CHUNK), content_type)
+
+    def publish_outputs(self, result: Dict[str, Any], backend: Backend) -> Dict[str, Any]:
+        """Upload a completed result's outputs to the mesh; returns it with their file ids."""
+        return self.publisher.publish(
+            result, lambda output: self._upload_output(output, backend, result.get("prompt_id"))
+        )
+
+    def _upload_output(self, output: Dict[str, Any], backend: Backend, prompt_id: Optional[str]) -> Dict[str, Any]:
+        """Stream one output into POST /api/files/upload, from the artifact store or ComfyUI's /view."""
+        publisher = self.publisher
+        size = 0
+
+        def counted(chunks):
+            nonlocal size
+            for chunk in chunks:
+                size += len(chunk)
+                publisher.check_size(size)
+                yield chunk
+
+        def upload(chunks):
+            return self.transport.mesh_post(
+                f"{self.mesh_url}/api/files/upload",
+                data=upload_body(upload_fields(self.mesh_agent_id, prompt_id, output), counted(chunks)),
+                headers={"Content-Type": "application/json"},
+                timeout=UPLOAD_TIMEOUT,
+            )
+
+        started = time.perf_counter()
+        stored = self.artifacts.get(output["sha256"]) if self.artifacts is not None and output.get("sha256") else None
+        try:
+            if stored:
+                # Already on local disk: no second /view fetch
+                publisher.check_size(stored["size"])
+                resp = upload(self.artifacts.chunks(stored["sha256"], publisher.chunk_size))
+            else:
+                with self.transport.comfyui_get(
+                    f"{backend.url}/view", params=output, stream=True, timeout=30, breaker=backend.breaker
+                ) as view:
+                    view.raise_for_status()
+                    publisher.check_size(int(view.headers.get("Content-Length") or 0))
+                    resp = upload(view.iter_content(publisher.chunk_size))
+            resp.raise_for_status()
+            uploaded = resp.json()
+        except Exception:
+            self.metrics.errors["output_publish"].inc()
+            raise
+        finally:
+            self.metrics.stage["output_publish"].since(started)
+        return {"file_id": uploaded["fileId"], "url": uploaded["url"], "size": size}
+
+    def _cache_result(self, result: Dict[str, Any], backend: Backend):
+        entries = self.results.take(result["prompt_id"])
+        if not entries or result["status"] != "completed":
+            return
+        # Copied once, into the entry of the workflow that ran; a batch's
+        # single-image entry shares those copies
+        key = entries[0][0]
+        files = {}
+        if self.results.files_dir:
+            for output in result["outputs"]:
+                try:
+                    with self.transport.comfyui_get(
+                        f"{backend.url}/view", params=output, stream=True, timeout=30, breaker=backend.breaker
+                    ) as view:
+                        if view.status_code == 200:
+                            files[output["filename"]] = self.results.save_file(
+                                key, output["filename"], view.iter_content(ARTIFACT_CHUNK)
+                            )
+                except Exception as e:
+                    print(f"Could not fetch {output['filename']} for the result cache: {e}")
+        for key, batch in entries:
+            self.results.store(key, split_batch_result(result, batch), files)
+
+    def _model_group(self, message: dict) -> str:
+        return message_model_group(message, self.workflows)
+
+    def _watch_job(self, message: dict, response: Dict[str, Any]):
+        prompt_id = response.get("prompt_id")
+        if not prompt_id or "error" in response or response.get("cached"):
+            return
+        backend = self._backend_of(response)
+        if backend and backend.tracker:
+            if message.get("id") and any(context[0].get("id") == message["id"]
+                                         for context in backend.tracker.watchers(prompt_id)):
+                # A retried reply; the first attempt is already watching
+                return
+            if self.dispatcher:
+                self.dispatcher.prompt_submitted(prompt_id, message_priority(message))
+            backend.tracker.watch(prompt_id, (message, response.get("batch")))
+
+    def _cancel_queued_prompt(self, prompt_id: str, backend: Backend) -> bool:
+        """Delete a prompt from ComfyUI's pending queue; False if it already ran or is running."""
+        try:
+            resp = self.transport.comfyui_post(
+                f"{backend.url}/queue", json={"delete": [prompt_id]}, timeout=5, breaker=backend.breaker
+            )
+            if resp.status_code != 200:
+                return False
+            queue = self.transport.comfyui_get(f"{backend.url}/queue", timeout=5, breaker=backend.breaker).json()
+            if self._fetch_history(prompt_id, backend):
+                return False
+        except Exception:
+            return False
+        return prompt_id not in comfyui_queue_ids(queue)
+
+    def _preempt_prompt(self, prompt_id: str) -> Optional[dict]:
+        """Take a not-yet-started prompt back from ComfyUI; returns its message to re-queue."""
+        backend = self.backends.backend_for(prompt_id)
+        if backend is None or backend.tracker is None:
+            return None
+        context = backend.tracker.detach(prompt_id)
+        if context is None:
+            return None
+        message, batch = context
+        if batch or not self._cancel_queued_prompt(prompt_id, backend):
+            # Shared with other requesters, or already running: leave it
+            backend.tracker.watch(prompt_id, context)
+            return None
+        self.backends.finish(prompt_id)
+        self.coalescer.complete(prompt_id)
+        self.results.take(prompt_id)
+        if message.get("id"):
+            self.ledger.reopen(message["id"])
+            self.journal.received(message)
+        self.send_response(message, preemption_response(prompt_id))
+        return message
+
+    def _sample_backend(self, backend: Backend):
+        # While the breaker is open only the half-open probe goes out
+        probe = not backend.breaker.available
+        if probe and not backend.breaker.probe_due():
+            return
+        sampled_at = time.monotonic()
+        try:
+            stats = self.transport.comfyui_get(
+                f"{backend.url}/system_stats", timeout=5, breaker=backend.breaker, probe=probe
+            ).json()
+            queue = self.transport.comfyui_get(f"{backend.url}/queue", timeout=5, breaker=backend.breaker).json()
+            backend.admission.update(queue, stats, sampled_at=sampled_at)
+        except Exception:
+            backend.admission.update(None, None)
+
+    def _probe_mesh(self):
+        breaker = self.transport.mesh_breaker
+        if breaker.probe_due():
+            try:
+                self.transport.mesh_get(f"{self.mesh_url}/health", timeout=5, probe=True)
+            except Exception:
+                pass
+
+    def _announce_availability(self):
+        """Re-broadcast availability when backend breakers change it."""
+        if self.backends.availability() != self._announced and self.transport.mesh_breaker.available:
+            self.broadcast_availability()
+
+    def _sample_comfyui_load(self):
+        """Probe the mesh and every backend; feed admission and availability."""
+        while not self._sampler_stop.wait(SAMPLE_INTERVAL):
+            self._probe_mesh()
+            for backend in self.backends.backends():
+                self._sample_backend(backend)
+            self._announce_availability()
+            if self.dispatcher:
+                self.dispatcher.poke()
+
+    def _start_sampler(self):
+        self._sampler_stop.clear()
+        self._sampler = threading.Thread(target=self._sample_comfyui_load, name="comfyui-load", daemon=True)
+        self._sampler.start()
+
+    def _stop_sampler(self):
+        self._sampler_stop.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=5)
+            self._sampler = None
+
+    def _health_report(self) -> Dict[str, Any]:
+        stats = self.dispatcher.stats() if self.dispatcher else {}
+        return self.health.build(
+            self.backends,
+            stats.get("scheduler", {}).get("pending", 0),
+            held=stats.get("held", 0),
+        )
+
+    def report_health(self):
+        """Post the load report if it changed, and the heartbeat when due."""
+        if not self.mesh_agent_id:
+            return
+        agent_url = f"{self.mesh_url}/api/agents/{self.mesh_agent_id}"
+        report = self._health_report()
+        if self.health.report_due(report):
+            try:
+                resp = self.transport.mesh_post(f"{agent_url}/health", json=report, timeout=5)
+                if resp.status_code == 200:
+                    self.health.reported(report)
+            except Exception as e:
+                print(f"Health report failed: {e}")
+        if self.health.heartbeat_due():
+            try:
+                resp = self.transport.mesh_post(f"{agent_url}/heartbeat", timeout=5)
+                if resp.status_code == 200:
+                    self.health.heartbeat_sent()
+            except Exception as e:
+                print(f"Heartbeat failed: {e}")
+
+    def _report_loop(self):
+        while not self._reporter_stop.wait(self.health.interval):
+            self.report_health()
+
+    def _start_reporter(self):
+        self._reporter_stop.clear()
+        self._reporter = threading.Thread(target=self._report_loop, name="mesh-health", daemon=True)
+        self._reporter.start()
+
+    def _stop_reporter(self):
+        self._reporter_stop.set()
+        if self._reporter is not None:
+            self._reporter.join(timeout=5)
+            self._reporter = None
+
+    def _cancel_request(self, message: dict, request_id: str):
+        """Withdraw a held request at its sender's asking."""
+        original = self.dispatcher.cancel(request_id, message.get("sender")) if self.dispatcher else None
+        if original is not None:
+            self.send_response(original, cancelled_response(request_id))
+            self.ledger.finish(request_id, REPLIED)
+            self.inbox.ack(original)
+        else:
+            print(f"Cancel for {request_id} ignored: not waiting here")
+
+    def _process_and_reply(self, message: dict):
+        trace = self.tracer.get(message)
+        if trace:
+            trace.add("local_queue", trace.received_at, time.time())
+        with self.tracer.activate(trace):
+            self._handle_request(message)
+
+    def _handle_request(self, message: dict):
+        message_id = message.get("id")
+        finished = False
+        try:
+            entry = self.ledger.get(message_id) if message_id else None
+            if entry and entry["status"] == SUBMITTED:
+                # Submitted before a restart but never answered: reply, don't resubmit
+                response = entry["response"]
+            else:
+                if message_id:
+                    self.journal.received(message)
+                response = self.process_inference_request(message)
+                if response and message_id:
+                    self.ledger.record_response(message_id, response)
+            
+            if not response:
+                finished = True
+                if message_id:
+                    self.journal.drop(message_id)
+            else:
+                if message_id:
+                    # On disk before the requester hears about the prompt
+                    try:
+                        self.journal.submitted(message_id, response, wait=True)
+                    except JournalWriteError as e:
+                        # Still answered; only a crash before completion would lose it
+                        print(f"Job {message_id} is not recoverable after a crash: {e}")
+                finished = self.send_response(message, response)
+                if finished and message_id and reply_is_final(response, self.track_completions):
+                    self.journal.replied(message_id)
+                self._watch_job(message, response)
+        finally:
+            if finished:
+                if message_id:
+                    self.ledger.finish(message_id, REPLIED if response else IGNORED)
+                self.inbox.ack(message)
+            else:
+                # Unread on the mesh: fetched again and answered from the ledger
+                if message_id:
+                    self.ledger.release(message_id)
+                self.inbox.retry(message)
+
+    def handle_message(self, message: dict):
+        """Process one mesh message and reply if it was an inference request.
+
+        Messages already finished according to the ledger are skipped. With
+        the dispatcher enabled the work runs on the worker pool for the
+        message's request type and this call returns immediately. An
+        ``inference_cancel`` withdraws a request still held by the dispatcher.
+        """
+        message_id = message.get("id")
+        if message_id and self.ledger.begin(message_id) is None:
+            if self.ledger.finished(message_id):
+                # Handled before (e.g. by an earlier run); mark it read so the cursor moves on
+                self.inbox.ack(message)
+                if self.journal.tracks(message_id):
+                    # A journal entry left open would be replayed on every start
+                    self.journal.drop(message_id)
+            return
+        self.inbox.track(message)
+        self.tracer.begin(message)
+        cancel_target = cancel_target_of(message)
+        if cancel_target:
+            try:
+                self._cancel_request(message, cancel_target)
+            finally:
+                if message_id:
+                    self.ledger.finish(message_id, IGNORED)
+                self.inbox.ack(message)
+        elif self.dispatcher:
+            if not self.dispatcher.submit(message):
+                # Not an inference request, or rejected and already answered
+                if message_id:
+                    self.ledger.finish(message_id, IGNORED if request_type_of(message) is None else REPLIED)
+                self.inbox.ack(message)
+        else:
+            self._process_and_reply(message)
+
+    def poll_once(self, long_poll: bool = False) -> int:
+        """Fetch the inbox over HTTP and handle anything not yet seen."""
+        messages = self.check_mesh_messages(long_poll)
+        for msg in messages:
+            self.handle_message(msg)
+        return len(messages)
+
+    def recover_jobs(self) -> int:
+        """Finish the jobs a previous run left without a final reply.
+
+        Jobs that were only received are handled again (the ledger skips
+        any that finished). Submitted jobs are looked up on their backend:
+        finished prompts are answered from ``/history``, queued or running
+        ones are watched again, and prompts ComfyUI no longer has are
+        reported failed. Returns how many jobs were picked up.
+        """
+        jobs = self.journal.open_jobs()
+        for job in jobs:
+            message = journal_message(job)
+            if job["state"] == RECEIVED:
+                self.handle_message(message)
+            elif job["state"] == COMPLETED and job.get("result"):
+                self._recovered_reply(message, job["result"])
+            elif not self.track_completions or not job.get("prompt_id") or (job.get("response") or {}).get("cached"):
+                # The stored response was already the final one
+                self._recovered_reply(message, job.get("response"))
+            else:
+                self._recover_prompt(message, job)
+        if jobs:
+            print(f"Recovered {len(jobs)} unfinished jobs from the journal")
+        return len(jobs)
+
+    def _recovered_reply(self, message: dict, response: Optional[Dict[str, Any]]):
+        if not response:
+            self.journal.drop(message["id"])
+        elif self.send_response(message, response):
+            self.journal.replied(message["id"])
+
+    def _recover_prompt(self, message: dict, job: Dict[str, Any]):
+        prompt_id = job["prompt_id"]
+        backend = self.backends.get(job.get("backend"))
+        if backend is None or backend.tracker is None:
+            self._recovered_reply(message, {
+                "status": "failed", "prompt_id": prompt_id,
+                "error": f"ComfyUI backend {job.get('backend')} is no longer configured",
+            })
+            return
+        result, queued = None, True
+        try:
+            entry = self._fetch_history(prompt_id, backend)
+            result = history_result(prompt_id, entry) if entry else None
+            if result is None:
+                queue = self.transport.comfyui_get(f"{backend.url}/queue", timeout=5, breaker=backend.breaker).json()
+                queued = prompt_id in comfyui_queue_ids(queue)
+        except Exception as e:
+            # The tracker reconciles against /history once it reaches the backend
+            print(f"Could not check prompt {prompt_id} on {backend.name}: {e}")
+        if result is not None:
+            result = split_batch_result({**result, "backend": backend.name}, job.get("batch"))
+            if self.artifacts is not None:
+                result = self.store_outputs(result, backend)
+            if self.publisher:
+                result = self.publish_outputs(result, backend)
+            self.journal.completed(message["id"], result)
+            self._recovered_reply(message, result)
+        elif queued:
+            self.backends.adopt(prompt_id, backend, message_priority(message))
+            if self.dispatcher:
+                self.dispatcher.prompt_submitted(prompt_id, message_priority(message))
+            backend.tracker.watch(prompt_id, (message, job.get("batch")))
+        else:
+            self._recovered_reply(message, {
+                "status": "failed", "prompt_id": prompt_id, "backend": backend.name,
+                "error": "ComfyUI no longer has this prompt",
+            })
+
+    def _start_push(self) -> bool:
+        """Open the /ws push channel if websocket-client is available."""
+        if not self.use_websocket or not self.mesh_agent_id:
+            return False
+        if not push_available():
+            print("websocket-client not installed; falling back to polling")
+            return False
+        self._push = MeshPushListener(
+            self.mesh_ws_url,
+            self.mesh_agent_id,
+            on_message=self.handle_message,
+            on_reconnect=self.poll_once,
+        )
+        self._push.start()
+        return True
+
     def listen_for_requests(self):
         """Listen for inference requests from mesh agents."""
         print(f"{self.agent_name} listening for mesh requests...")
         self.running = True
+        self._start_push()
+        for backend in self.backends.backends():
+            if backend.tracker:
+                backend.tracker.start()
+        self._start_sampler()
+        self._start_reporter()
+        if self.metrics_port is not None:
+            self.metrics.registry.serve(self.metrics_port)
+        if self.artifact_server:
+            self.artifact_server.start()
         
-        while self.running:
-            try:
-                messages = self.check_mesh_messages()
-                
-                for msg in messages:
-                    response = self.process_inference_request(msg)
+        try:
+            while self.running:
+                try:
+                    if self.inbox.ack_due():
+                        self.flush_acks()
                     
-                    if response:
-                        self.send_response(msg, response)
-                
-                time.sleep(10)  # Poll every 10 seconds
-                
-            except Exception as e:
-                print(f"Error in listen loop: {e}")
-                time.sleep(30)
+                    if self._push and self._push.connected:
+                        # Push mode: the listener thread does the work. Messages
+                        # handed back for a retry are not pushed again; fetch them.
+                        if self.inbox.retry_pending():
+                            self.poll_once()
+                        time.sleep(1)
+                        continue
+                    
+                    # Degraded mode: socket down or unavailable
+                    self.poll_once(long_poll=True)
+                    time.sleep(self.poller.next_delay())
+                    
+                except Exception as e:
+                    print(f"Error in listen loop: {e}")
+                    self.poller.record_error()
+                    time.sleep(self.poller.next_delay())
+        finally:
+            if self._push:
+                self._push.stop()
+                self._push = None
+            for backend in self.backends.backends():
+                if backend.tracker:
+                    backend.tracker.stop()
+            self._stop_sampler()
+            self._stop_reporter()
+            if self._publishing:
+                # Unsent replies stay in the journal and are recovered on restart
+                self._publishing.shutdown(wait=False, cancel_futures=True)
+            if self.artifact_server:
+                self.artifact_server.stop()
+            self.metrics.registry.stop_serving()
+            self.tracer.flush()
+            self.flush_acks()
+            self.journal.close()
     
     def start(self):
         """Start the mesh integration."""
+        self.ledger.compact()
         if self.register_with_mesh():
+            self.recover_jobs()
             self.broadcast_availability()
             self.listen_for_requests()
     
     def stop(self):
         """Stop the mesh integration."""
         self.running = False
+        push = self._push
+        if push:
+            push.stop()
+        if self.dispatcher:
+            self.dispatcher.shutdown(wait=False)
+        self.transport.close()
         print(f"{self.agent_name} stopped")
 
 
@@ -0,0 +1,348 @@
+"""
+ComfyUI completion tracking
+
+Subscribes once to ComfyUI's ``/ws?clientId=`` event stream and follows
+every outstanding ``prompt_id`` through ``execution_start``, ``executing``,
+``progress``, ``executed`` and ``execution_success``/``execution_error``.
+When a job finishes the tracker calls back with its output files and
+timings, so the agent can send a final ``inference_response`` without
+polling ``/history`` per job.
+
+ComfyUI only sends execution events to the ``client_id`` a prompt was
+submitted with, so prompts must be queued with ``tracker.client_id``.
+After every (re)connect, and on each retry while the socket is down, the
+outstanding jobs are reconciled against ``/history`` so completions are
+not missed. A socket silent for ``recv_timeout`` is pinged and reconciled;
+if nothing comes back within another ``recv_timeout`` it is treated as
+dead and reopened, so a half-open connection cannot stall completions.
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+from .mesh_push import MAX_RECONNECT_INTERVAL, RECONNECT_INTERVAL, push_available
+
+try:
+    import websocket  # websocket-client
+except ImportError:  # pragma: no cover - optional dependency
+    websocket = None
+
+# Finished prompts remembered for late watchers and trailing events
+RESULTS_LIMIT = 1000
+# Seconds of silence on the event socket before it is pinged (and, after
+# as long again without a frame, reconnected)
+RECV_TIMEOUT = 30
+
+
+def extract_outputs(history_entry: Dict[str, Any]) -> list:
+    """Collect output file references from a ComfyUI ``/history`` entry."""
+    files = []
+    for node_output in history_entry.get("outputs", {}).values():
+        for items in node_output.values():
+            if not isinstance(items, list):
+                continue
+            for item in items:
+                if isinstance(item, dict) and "filename" in item:
+                    files.append({
+                        "filename": item["filename"],
+                        "subfolder": item.get("subfolder", ""),
+                        "type": item.get("type", "output"),
+                    })
+    return files
+
+
+def comfyui_ws_url(comfyui_url: str, client_id: str) -> str:
+    """ComfyUI event-stream URL for a client id."""
+    if comfyui_url.startswith("https://"):
+        base = "wss://" + comfyui_url[len("https://"):]
+    elif comfyui_url.startswith("http://"):
+        base = "ws://" + comfyui_url[len("http://"):]
+    else:
+        base = comfyui_url
+    return f"{base.rstrip('/')}/ws?clientId={client_id}"
+
+
+class CompletionTracker:
+    """One ComfyUI WebSocket shared by every outstanding prompt."""
+
+    def __init__(
+        self,
+        comfyui_url: str,
+        on_complete: Callable[[Any, Dict[str, Any]], None],
+        client_id: Optional[str] = None,
+        fetch_history: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None,
+        on_start: Optional[Callable[[str], None]] = None,
+        recv_timeout: float = RECV_TIMEOUT,
+    ):
+        if not push_available():
+            raise RuntimeError("websocket-client is required for completion tracking (pip install websocket-client)")
+        self.comfyui_url = comfyui_url
+        self.on_complete = on_complete
+        self.client_id = client_id or f"mesh-agent-{uuid.uuid4().hex[:12]}"
+        self.fetch_history = fetch_history or self._default_fetch_history
+        # Called once per watched prompt when ComfyUI starts executing it
+        self.on_start = on_start
+        self.recv_timeout = recv_timeout
+        self.connected = False
+        self.reconnects = 0
+        # prompt_id -> job state (contexts, timings, progress, outputs)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        # Results of recently finished prompts, for watch() calls that arrive late
+        self._results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Partial state for prompts seen on the socket but not yet watched
+        self._unwatched: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._ws = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _default_fetch_history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        resp = requests.get(f"{self.comfyui_url}/history/{prompt_id}", timeout=5)
+        if resp.status_code != 200:
+            return None
+        return resp.json().get(prompt_id)
+
+    @staticmethod
+    def _new_state() -> Dict[str, Any]:
+        return {
+            "contexts": [],
+            "submitted_at": time.time(),
+            "started_at": None,
+            "node": None,
+            "progress": None,
+            "outputs": [],
+        }
+
+    def watch(self, prompt_id: str, context: Any):
+        """Track a submitted prompt; ``on_complete(context, result)`` fires once per context.
+
+        Several contexts may watch the same prompt (coalesced requests).
+        """
+        with self._lock:
+            finished = self._results.get(prompt_id)
+            if finished is None:
+                state = self._jobs.get(prompt_id)
+                if state is None:
+                    state = self._unwatched.pop(prompt_id, None) or self._new_state()
+                    self._jobs[prompt_id] = state
+                state["contexts"].append(context)
+                return
+        self.on_complete(context, finished)
+
+    def detach(self, prompt_id: str) -> Any:
+        """Stop tracking a prompt that has not started and has a single watcher.
+
+        Returns that watcher's context, or None if the prompt is not eligible.
+        Used before removing a queued prompt from ComfyUI; ``watch`` again
+        to undo.
+        """
+        with self._lock:
+            state = self._jobs.get(prompt_id)
+            if state is None or state["started_at"] is not None or len(state["contexts"]) != 1:
+                return None
+            del self._jobs[prompt_id]
+            return state["contexts"][0]
+
+    def watchers(self, prompt_id: str) -> List[Any]:
+        """Contexts waiting for a tracked prompt (empty once it finished)."""
+        with self._lock:
+            state = self._jobs.get(prompt_id)
+            return list(state["contexts"]) if state else []
+
+    def outstanding(self) -> int:
+        """Number of prompts still being tracked."""
+        with self._lock:
+            return len(self._jobs)
+
+    def progress(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """Current node and sampler progress for a tracked prompt."""
+        with self._lock:
+            state = self._jobs.get(prompt_id)
+            if state is None:
+                return None
+            return {"node": state["node"], "progress": state["progress"], "started": state["started_at"] is not None}
+
+    def start(self) -> threading.Thread:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="comfyui-events", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+    def _state_for(self, prompt_id: str) -> Dict[str, Any]:
+        state = self._jobs.get(prompt_id)
+        if state is None:
+            state = self._unwatched.get(prompt_id)
+            if state is None:
+                state = self._unwatched[prompt_id] = self._new_state()
+                if len(self._unwatched) > RESULTS_LIMIT:
+                    self._unwatched.popitem(last=False)
+        return state
+
+    def _finish(self, prompt_id: str, status: str, error: Optional[str] = None, outputs: Optional[list] = None):
+        with self._lock:
+            if prompt_id in self._results:
+                return
+            state = self._jobs.pop(prompt_id, None)
+            watched = state is not None
+            if state is None:
+                state = self._unwatched.pop(prompt_id, None) or self._new_state()
+            finished_at = time.time()
+            started_at = state["started_at"] or finished_at
+            result = {
+                "status": status,
+                "prompt_id": prompt_id,
+                "outputs": outputs if outputs is not None else state["outputs"],
+                "timings": {
+                    "queued_seconds": round(max(0.0, started_at - state["submitted_at"]), 3),
+                    "run_seconds": round(finished_at - started_at, 3),
+                    "total_seconds": round(finished_at - state["submitted_at"], 3),
+                },
+            }
+            if error:
+                result["error"] = error
+            # Kept so late watchers of a finished prompt still get the result
+            self._results[prompt_id] = result
+            if len(self._results) > RESULTS_LIMIT:
+                self._results.popitem(last=False)
+            if not watched:
+                return
+        for context in state["contexts"]:
+            try:
+                self.on_complete(context, result)
+            except Exception as e:
+                print(f"[ComfyUI WS] Completion callback failed for {prompt_id}: {e}")
+
+    def handle_event(self, event: Dict[str, Any]):
+        """Apply one ComfyUI event (exposed for replay and testing)."""
+        kind = event.get("type")
+        data = event.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+
+        if prompt_id in self._results:
+            # Trailing events of a finished prompt
+            return
+        if kind == "execution_success":
+            self._finish(prompt_id, "completed")
+            return
+        if kind == "execution_error":
+            self._finish(prompt_id, "failed", error=data.get("exception_message") or "execution error")
+            return
+        if kind == "execution_interrupted":
+            self._finish(prompt_id, "failed", error="interrupted")
+            return
+
+        finished = False
+        with self._lock:
+            state = self._state_for(prompt_id)
+            started = state["started_at"] is None and kind in ("execution_start", "executing")
+            if kind == "execution_start":
+                state["started_at"] = state["started_at"] or time.time()
+            elif kind == "executing":
+                state["started_at"] = state["started_at"] or time.time()
+                state["node"] = data.get("node")
+                # Older ComfyUI signals completion with node == None only
+                finished = data.get("node") is None
+            elif kind == "progress":
+                state["progress"] = {"value": data.get("value"), "max": data.get("max")}
+            elif kind == "executed":
+                state["outputs"].extend(extract_outputs({"outputs": {data.get("node"): data.get("output") or {}}}))
+            started = started and prompt_id in self._jobs
+        if started and self.on_start:
+            try:
+                self.on_start(prompt_id)
+            except Exception as e:
+                print(f"[ComfyUI WS] Start callback failed for {prompt_id}: {e}")
+        if finished:
+            self._finish(prompt_id, "completed")
+
+    def reconcile(self):
+        """Check outstanding prompts against /history (after a reconnect)."""
+        with self._lock:
+            pending = list(self._jobs)
+        for prompt_id in pending:
+            try:
+                entry = self.fetch_history(prompt_id)
+            except Exception:
+                continue
+            if not entry:
+                continue
+            status = entry.get("status", {})
+            if status.get("status_str") == "error":
+                self._finish(prompt_id, "failed", error="execution error", outputs=extract_outputs(entry))
+            elif status.get("completed"):
+                self._finish(prompt_id, "completed", outputs=extract_outputs(entry))
+
+    def _run(self):
+        delay = RECONNECT_INTERVAL
+        url = comfyui_ws_url(self.comfyui_url, self.client_id)
+        while not self._stop.is_set():
+            try:
+                self._ws = websocket.create_connection(url, timeout=10)
+                self._ws.settimeout(self.recv_timeout)
+                self.connected = True
+                delay = RECONNECT_INTERVAL
+                print(f"[ComfyUI WS] Connected as {self.client_id}")
+                self.reconcile()
+                self._receive_loop()
+            except Exception as e:
+                if not self._stop.is_set():
+                    print(f"[ComfyUI WS] Connection lost: {e}")
+            finally:
+                self.connected = False
+                if self._ws is not None:
+                    try:
+                        self._ws.close()
+                    except Exception:
+                        pass
+                    self._ws = None
+            if self._stop.is_set():
+                break
+            self.reconnects += 1
+            # Degraded: while the socket is down, completions come from /history
+            self.reconcile()
+            self._stop.wait(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, MAX_RECONNECT_INTERVAL)
+
+    def _receive_loop(self):
+        pinged = False
+        while not self._stop.is_set():
+            try:
+                opcode, data = self._ws.recv_data(control_frame=True)
+            except websocket.WebSocketTimeoutException:
+                if pinged:
+                    raise ConnectionError(f"no reply to a ping within {self.recv_timeout:g}s")
+                # Quiet: make sure the connection is alive and nothing was missed
+                self._ws.ping()
+                pinged = True
+                self.reconcile()
+                continue
+            pinged = False
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                raise ConnectionError("socket closed by server")
+            if opcode != websocket.ABNF.OPCODE_TEXT:
+                # Pongs, and binary frames carrying latent previews
+                continue
+            try:
+                self.handle_event(json.loads(data))
+            except ValueError:
+                continue
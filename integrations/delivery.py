@@ -0,0 +1,257 @@
+"""
+Streaming output delivery
+
+Requesters usually cannot reach ComfyUI, so a ``prompt_id`` alone does not
+get them the image or video. The agents copy every finished output from
+ComfyUI's ``/view`` to the mesh file API (``POST /api/files/upload``) and
+list it in the final ``inference_response`` with its mesh ``file_id`` and
+download ``url``.
+
+The upload body is JSON with the file as a base64 ``fileData`` string,
+and no file is ever held whole. The ``/view`` response is read in
+``CHUNK_SIZE`` pieces. Each piece is base64-encoded as it arrives; the
+0-2 bytes that do not fill a 3-byte group are carried over to the next
+piece. The encoded pieces go out as a chunked request body, so memory per
+upload stays at a few chunks however large the video.
+
+``OutputPublisher`` uploads each output once per prompt. Coalesced
+requesters and retried replies get the file ids already published.
+Outputs already in the artifact store (``artifacts.py``) carry their
+SHA-256 and are keyed by it instead, so identical bytes from different
+prompts are uploaded once, read from local disk.
+"""
+
+import asyncio
+import base64
+import json
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+# Bytes read from /view per step (a multiple of 3, so pieces encode without carry)
+CHUNK_SIZE = 3 * 256 * 1024
+# Request body limit of the stock mesh upload route (AGENT_MESH_UPLOAD_LIMIT)
+MESH_UPLOAD_LIMIT = 128 * 1024 ** 2
+# Largest output whose base64 body still fits that limit (about 96 MB);
+# larger outputs stay on ComfyUI and count as skipped, not failed
+MAX_BYTES = (MESH_UPLOAD_LIMIT - 64 * 1024) // 4 * 3
+# ComfyUI output types worth publishing (previews are "temp")
+OUTPUT_TYPES = ("output",)
+# Published outputs remembered for later requesters of the same prompt
+PUBLISHED_LIMIT = 2048
+
+UPLOAD_TIMEOUT = 300
+
+
+class OutputTooLarge(ValueError):
+    """An output exceeded ``max_bytes`` while it was being streamed."""
+
+
+class Base64Encoder:
+    """Incremental base64 that matches encoding the whole input at once."""
+
+    def __init__(self):
+        self._carry = b""
+
+    def feed(self, data: bytes) -> bytes:
+        data = self._carry + data
+        cut = len(data) - len(data) % 3
+        self._carry = data[cut:]
+        return base64.b64encode(data[:cut])
+
+    def finish(self) -> bytes:
+        tail, self._carry = self._carry, b""
+        return base64.b64encode(tail)
+
+
+def _body_parts(fields: Dict[str, Any]):
+    # fileData goes last, so everything before it is plain JSON
+    head = json.dumps(fields, separators=(",", ":"))
+    return f'{head[:-1]},"fileData":"'.encode(), b'"}'
+
+
+def upload_body(fields: Dict[str, Any], chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """``/api/files/upload`` JSON body with ``chunks`` as streamed base64 ``fileData``."""
+    head, tail = _body_parts(fields)
+    encoder = Base64Encoder()
+    yield head
+    for chunk in chunks:
+        encoded = encoder.feed(chunk)
+        if encoded:
+            yield encoded
+    yield encoder.finish() + tail
+
+
+async def async_upload_body(fields: Dict[str, Any], chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """``upload_body`` for an async byte stream."""
+    head, tail = _body_parts(fields)
+    encoder = Base64Encoder()
+    yield head
+    async for chunk in chunks:
+        encoded = encoder.feed(chunk)
+        if encoded:
+            yield encoded
+    yield encoder.finish() + tail
+
+
+def upload_fields(agent_id: Optional[str], prompt_id: Optional[str], output: Dict[str, Any]) -> Dict[str, Any]:
+    """Everything in the upload body except ``fileData``."""
+    filename = os.path.basename(output["filename"])
+    return {
+        "agentId": agent_id,
+        "filename": filename,
+        "fileType": mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        "description": f"ComfyUI output of prompt {prompt_id}",
+    }
+
+
+class OutputPublisher:
+    """Publishes ComfyUI outputs to the mesh file store, once per prompt.
+
+    The agents supply the I/O as ``upload(output) -> {"file_id", "url",
+    "size"}``; the publisher decides what to upload, shares results between
+    requesters of the same prompt and counts what happened.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, max_bytes: int = MAX_BYTES,
+                 output_types=OUTPUT_TYPES, limit: int = PUBLISHED_LIMIT):
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.output_types = tuple(output_types)
+        self.limit = limit
+        # (prompt_id, type, subfolder, filename) or ("sha256", digest) -> published file
+        self._published: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        # One upload per output at a time; later callers wait and reuse it.
+        # Each lock is kept with its number of holders and waiters, and
+        # removed when the last one leaves.
+        self._locks: Dict[tuple, Tuple[threading.Lock, int]] = {}
+        self._async_locks: Dict[tuple, Tuple[asyncio.Lock, int]] = {}
+        self._lock = threading.Lock()
+        self.uploaded = 0
+        self.reused = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes = 0
+
+    @staticmethod
+    def _key(prompt_id: Optional[str], output: Dict[str, Any]) -> tuple:
+        if output.get("sha256"):
+            return ("sha256", output["sha256"])
+        return (prompt_id, output.get("type", "output"), output.get("subfolder", ""), output["filename"])
+
+    def wants(self, result: Dict[str, Any]) -> bool:
+        """True if a completion result has outputs to publish."""
+        return result.get("status") == "completed" and any(self._todo(o) for o in result.get("outputs") or ())
+
+    def check_size(self, size: int):
+        """Raise ``OutputTooLarge`` once a stream passes ``max_bytes``."""
+        if size > self.max_bytes:
+            raise OutputTooLarge(f"output is larger than the {self.max_bytes}-byte mesh upload limit; "
+                                 "fetch it from ComfyUI instead")
+
+    def _cached(self, key: tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            published = self._published.get(key)
+            if published is not None:
+                self._published.move_to_end(key)
+                self.reused += 1
+            return published
+
+    def _record(self, key: tuple, published: Dict[str, Any]):
+        with self._lock:
+            self._published[key] = published
+            if len(self._published) > self.limit:
+                self._published.popitem(last=False)
+            self.uploaded += 1
+            self.bytes += published.get("size") or 0
+
+    def _record_error(self, output: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+        with self._lock:
+            if isinstance(error, OutputTooLarge):
+                self.skipped += 1
+            else:
+                self.failed += 1
+        print(f"Could not publish {output['filename']} to the mesh: {error}")
+        if isinstance(error, OutputTooLarge):
+            return {**output, "publish_error": str(error), "publish_limit": self.max_bytes}
+        return {**output, "publish_error": str(error)}
+
+    @staticmethod
+    def _release(locks: Dict[tuple, tuple], key: tuple):
+        lock, waiters = locks[key]
+        if waiters > 1:
+            locks[key] = (lock, waiters - 1)
+        else:
+            del locks[key]
+
+    def _todo(self, output: Dict[str, Any]) -> bool:
+        return output.get("type", "output") in self.output_types and "file_id" not in output
+
+    def publish(self, result: Dict[str, Any], upload: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        """``result`` with every publishable output annotated with its mesh file."""
+        if not self.wants(result):
+            return result
+        outputs = []
+        for output in result["outputs"]:
+            if not self._todo(output):
+                outputs.append(output)
+                continue
+            key = self._key(result.get("prompt_id"), output)
+            with self._lock:
+                lock, waiters = self._locks.get(key, (threading.Lock(), 0))
+                self._locks[key] = (lock, waiters + 1)
+            try:
+                with lock:
+                    published = self._cached(key)
+                    if published is None:
+                        try:
+                            published = upload(output)
+                            self._record(key, published)
+                        except Exception as e:
+                            outputs.append(self._record_error(output, e))
+                            continue
+            finally:
+                with self._lock:
+                    self._release(self._locks, key)
+            outputs.append({**output, **published})
+        return {**result, "outputs": outputs}
+
+    async def publish_async(self, result: Dict[str, Any],
+                            upload: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """``publish`` for an async ``upload``; call from one event loop."""
+        if not self.wants(result):
+            return result
+        outputs = []
+        for output in result["outputs"]:
+            if not self._todo(output):
+                outputs.append(output)
+                continue
+            key = self._key(result.get("prompt_id"), output)
+            lock, waiters = self._async_locks.get(key, (asyncio.Lock(), 0))
+            self._async_locks[key] = (lock, waiters + 1)
+            try:
+                async with lock:
+                    published = self._cached(key)
+                    if published is None:
+                        try:
+                            published = await upload(output)
+                            self._record(key, published)
+                        except Exception as e:
+                            outputs.append(self._record_error(output, e))
+                            continue
+            finally:
+                self._release(self._async_locks, key)
+            outputs.append({**output, **published})
+        return {**result, "outputs": outputs}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "uploaded": self.uploaded,
+                "reused": self.reused,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "bytes": self.bytes,
+            }
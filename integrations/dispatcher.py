@@ -0,0 +1,333 @@
+"""
+Concurrent inference dispatcher
+
+Sits between message intake and ``process_inference_request``. Each
+``request_type`` gets its own concurrency cap and its own bounded backlog,
+so a batch of long video jobs cannot hold up short image jobs. When a
+type's backlog is full the request is rejected straight away with an
+explicit ``inference_response`` instead of queueing without limit.
+
+Waiting requests are released by a ``JobScheduler`` in priority order,
+keeping jobs for the currently loaded model together. With
+``max_in_flight`` set, jobs are only released while fewer prompts than
+that are running in ComfyUI, so the backlog stays here where it can still
+be reordered. An ``AdmissionController`` replaces that fixed limit with
+ComfyUI's sampled queue depth and free VRAM, and requests that have to
+wait are told their estimated start time; until released they can be
+withdrawn with an ``inference_cancel`` message. With a ``preempt``
+callback, an urgent or high priority arrival that finds ComfyUI full can
+bump a lower-priority prompt that has not started yet back into the local
+queue.
+
+Usage:
+    from integrations.dispatcher import InferenceDispatcher
+
+    dispatcher = InferenceDispatcher(handler=process_and_reply, reject=send_response)
+    dispatcher.submit(message)
+"""
+
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .admission import AdmissionController
+from .scheduler import (
+    DEFAULT_GROUP,
+    DEFAULT_PRIORITY,
+    MAX_GROUP_RUN,
+    MAX_GROUP_WAIT,
+    PREEMPTING,
+    InFlight,
+    JobScheduler,
+    message_priority,
+)
+
+# Concurrent jobs per request type
+TYPE_LIMITS = {
+    "image_generation": 4,
+    "video_generation": 1,
+    "distributed_inference": 2,
+}
+DEFAULT_LIMIT = 1
+
+# Requests allowed to wait per type on top of the running ones
+QUEUE_SIZE = 50
+
+
+def request_type_of(message: dict) -> Optional[str]:
+    """Return the ``request_type`` of an inference request, else None."""
+    try:
+        content = json.loads(message.get("content", "{}"))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(content, dict) or content.get("type") != "inference_request":
+        return None
+    return content.get("request_type") or "unknown"
+
+
+def cancel_target_of(message: dict) -> Optional[str]:
+    """Return the ``request_id`` an ``inference_cancel`` message withdraws, else None."""
+    try:
+        content = json.loads(message.get("content", "{}"))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(content, dict) or content.get("type") != "inference_cancel":
+        return None
+    return content.get("request_id")
+
+
+def rejection_response(request_type: str, queued: int) -> Dict[str, Any]:
+    """Response sent when a request type's backlog is full."""
+    return {
+        "status": "rejected",
+        "error": f"Queue full for {request_type} ({queued} pending), retry later",
+        "request_type": request_type,
+    }
+
+
+def held_response(request_type: str, position: int, estimated_start_seconds: float) -> Dict[str, Any]:
+    """Response sent when a request waits locally for ComfyUI capacity."""
+    return {
+        "status": "held",
+        "request_type": request_type,
+        "position": position,
+        "estimated_start_seconds": estimated_start_seconds,
+        "estimated_start_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + estimated_start_seconds)),
+    }
+
+
+def cancelled_response(request_id: str) -> Dict[str, Any]:
+    """Response sent when a held request is cancelled by its sender."""
+    return {"status": "cancelled", "request_id": request_id}
+
+
+def preemption_response(prompt_id: str) -> Dict[str, Any]:
+    """Response sent when a queued prompt is taken back for higher-priority work."""
+    return {
+        "status": "preempted",
+        "prompt_id": prompt_id,
+        "detail": "Re-queued behind higher-priority work; a new prompt_id follows",
+    }
+
+
+class InferenceDispatcher:
+    """Worker-thread dispatcher with per-request-type concurrency caps."""
+
+    def __init__(
+        self,
+        handler: Callable[[dict], None],
+        reject: Callable[[dict, Dict[str, Any]], None],
+        type_limits: Optional[Dict[str, int]] = None,
+        default_limit: int = DEFAULT_LIMIT,
+        queue_size: int = QUEUE_SIZE,
+        classify: Optional[Callable[[dict], str]] = None,
+        max_in_flight: Optional[int] = None,
+        max_group_run: int = MAX_GROUP_RUN,
+        max_group_wait: float = MAX_GROUP_WAIT,
+        preempt: Optional[Callable[[str], Optional[dict]]] = None,
+        admission: Optional[AdmissionController] = None,
+        hold: Optional[Callable[[dict, Dict[str, Any]], None]] = None,
+    ):
+        self.handler = handler
+        self.reject = reject
+        self.type_limits = dict(TYPE_LIMITS if type_limits is None else type_limits)
+        self.default_limit = default_limit
+        self.queue_size = queue_size
+        self.classify = classify
+        self.max_in_flight = max_in_flight
+        self.admission = admission
+        # hold(message, response) tells a requester its job is waiting here
+        self.hold = hold
+        # preempt(prompt_id) pulls a queued prompt out of ComfyUI and returns its message
+        self.preempt = preempt
+        self.scheduler = JobScheduler(max_group_run=max_group_run, max_group_wait=max_group_wait)
+        self._workers: List[threading.Thread] = []
+        self._worker_types = set()
+        self._pending: Dict[str, int] = {}
+        self._running: Dict[str, int] = {}
+        self._in_flight = InFlight()
+        self._preempting = set()
+        self._counts = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0, "preempted": 0,
+                        "held_total": 0, "cancelled": 0}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._closed = False
+
+    def _limit(self, request_type: str) -> int:
+        return self.type_limits.get(request_type, self.default_limit)
+
+    def _add_workers(self, request_type: str):
+        # Enough generic workers for every type seen to run at its cap
+        if request_type in self._worker_types:
+            return
+        self._worker_types.add(request_type)
+        for _ in range(self._limit(request_type)):
+            worker = threading.Thread(target=self._work, name=f"infer-{len(self._workers)}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def submit(self, message: dict) -> bool:
+        """Queue an inference request. Returns False if it was rejected or ignored."""
+        request_type = request_type_of(message)
+        if request_type is None:
+            return False
+
+        with self._lock:
+            pending = self._pending.get(request_type, 0)
+            limit = self._limit(request_type) + self.queue_size
+            rejected = pending >= limit
+            if rejected:
+                self._counts["rejected"] += 1
+
+        if rejected:
+            print(f"Rejected {request_type} request from {message.get('sender')}: queue full")
+            self.reject(message, rejection_response(request_type, pending))
+            return False
+
+        priority = message_priority(message)
+        with self._changed:
+            self._counts["accepted"] += 1
+        held = self._enqueue(message, request_type, priority)
+        if held is not None and self.hold:
+            self.hold(message, held)
+        self._maybe_preempt(priority)
+        return True
+
+    def _enqueue(self, message: dict, request_type: str, priority: str) -> Optional[Dict[str, Any]]:
+        # Returns a held response if the job cannot be released right away
+        group = self.classify(message) if self.classify else DEFAULT_GROUP
+        with self._changed:
+            self._pending[request_type] = self._pending.get(request_type, 0) + 1
+            job = self.scheduler.put(message, request_type, group, priority)
+            self._add_workers(request_type)
+            self._changed.notify()
+            ahead = len(self.scheduler) - 1
+            if self.admission is None or self.admission.admit(self._in_flight, ahead):
+                return None
+            self.scheduler.hold(job)
+            self._counts["held_total"] += 1
+            return held_response(request_type, ahead, self.admission.estimate_start(ahead, self._in_flight))
+
+    def _admitting(self) -> bool:
+        if self.admission is not None:
+            return self.admission.admit(self._in_flight)
+        return self.max_in_flight is None or len(self._in_flight) < self.max_in_flight
+
+    def poke(self):
+        """Re-check admission (after a new ComfyUI sample)."""
+        with self._changed:
+            self._changed.notify_all()
+
+    def cancel(self, message_id: str, sender: Optional[str] = None) -> Optional[dict]:
+        """Withdraw a waiting request; only its original sender may cancel it."""
+        def matches(message: dict) -> bool:
+            return message.get("id") == message_id and (sender is None or message.get("sender") == sender)
+
+        with self._changed:
+            removed = self.scheduler.remove(matches)
+            for job in removed:
+                self._pending[job.request_type] -= 1
+                self._counts["cancelled"] += 1
+        return removed[0].item if removed else None
+
+    def _maybe_preempt(self, priority: str):
+        if self.preempt is None or priority not in PREEMPTING:
+            return
+        with self._lock:
+            if self._admitting():
+                return
+            victim = self._in_flight.victim(priority, exclude=self._preempting)
+            if victim is None:
+                return
+            self._preempting.add(victim)
+        # ComfyUI round trips stay off the intake thread
+        threading.Thread(target=self._preempt, args=(victim,), name="infer-preempt", daemon=True).start()
+
+    def _preempt(self, prompt_id: str):
+        try:
+            message = self.preempt(prompt_id)
+        except Exception as e:
+            print(f"Preempting {prompt_id} failed: {e}")
+            message = None
+        finally:
+            with self._lock:
+                self._preempting.discard(prompt_id)
+        if message is None:
+            return
+        print(f"Preempted {prompt_id}; re-queued request {message.get('id')} locally")
+        with self._changed:
+            self._counts["preempted"] += 1
+            self._in_flight.discard(prompt_id)
+            self._changed.notify_all()
+        self._enqueue(message, request_type_of(message) or "unknown", message_priority(message))
+
+    def _next_job(self):
+        with self._changed:
+            while not self._closed:
+                if self._admitting():
+                    blocked = [t for t, n in self._running.items() if n >= self._limit(t)]
+                    job = self.scheduler.pick(blocked)
+                    if job is not None:
+                        self._running[job.request_type] = self._running.get(job.request_type, 0) + 1
+                        return job
+                self._changed.wait()
+            return None
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            self._run(job.request_type, job.item)
+
+    def _run(self, request_type: str, message: dict):
+        outcome = "completed"
+        try:
+            self.handler(message)
+        except Exception as e:
+            outcome = "failed"
+            print(f"Error handling {request_type} request {message.get('id')}: {e}")
+        finally:
+            with self._changed:
+                self._pending[request_type] -= 1
+                self._running[request_type] -= 1
+                self._counts[outcome] += 1
+                self._changed.notify_all()
+
+    def prompt_submitted(self, prompt_id: str, priority: str = DEFAULT_PRIORITY):
+        """Count a prompt as running in ComfyUI until ``prompt_finished``."""
+        with self._changed:
+            self._in_flight.add(prompt_id, priority)
+
+    def prompt_finished(self, prompt_id: str):
+        """A prompt left ComfyUI; release the next held job."""
+        with self._changed:
+            if self._in_flight.discard(prompt_id):
+                self._changed.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """Pending requests per type, accept/reject counters and scheduling.
+
+        ``held`` is the number of requests waiting now after a held
+        response; ``held_total`` counts every held response sent.
+        """
+        with self._lock:
+            return {
+                "pending": dict(self._pending),
+                "running": dict(self._running),
+                "in_flight": len(self._in_flight),
+                "held": self.scheduler.held,
+                **self._counts,
+                "scheduler": self.scheduler.stats(),
+                "admission": self.admission.stats() if self.admission else None,
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers; requests still waiting are dropped."""
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
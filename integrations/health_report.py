@@ -0,0 +1,214 @@
+"""
+Load reports to the mesh health dashboard
+
+The mesh lists an agent's health only once it posts to
+``/api/agents/:id/health``. It counts an agent offline when
+``/api/agents/:id/heartbeat`` has been silent for five minutes.
+``HealthReporter`` turns the agent's load into a health report:
+
+- jobs waiting locally and prompts in flight on ComfyUI
+- recent job latency (submission to completion)
+- per-backend ComfyUI queue depth and GPU VRAM
+- this process's CPU and RSS
+
+Requesters can read it back to pick the least busy GPU agent.
+
+A report is only sent when some value moved by more than
+``change_threshold`` (relative) and its per-metric minimum since the last
+report, or when ``max_silence`` seconds have passed. The heartbeat goes
+out every ``heartbeat_interval`` seconds regardless.
+
+The reporter only decides what to send. The agents run the loop and post
+the reports.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+try:
+    import psutil
+except ImportError:  # RSS then comes from /proc where available
+    psutil = None
+
+# Seconds between load samples
+REPORT_INTERVAL = 10.0
+
+# Seconds between heartbeats (the mesh marks agents offline after 300)
+HEARTBEAT_INTERVAL = 60.0
+
+# Seconds after which an unchanged report is sent anyway
+MAX_SILENCE = 300.0
+
+# Relative change that makes a metric worth reporting
+CHANGE_THRESHOLD = 0.1
+
+# Smallest absolute change that counts, by metric name; counts default to any change
+MIN_CHANGE = {
+    "cpuUsage": 5.0,
+    "memoryUsage": 32.0,
+    "vram_free_mb": 256.0,
+    "job_latency_seconds": 1.0,
+    "job_latency_p95_seconds": 1.0,
+}
+DEFAULT_MIN_CHANGE = 0.5
+
+# Recent job latencies kept for the mean and p95
+LATENCY_SAMPLES = 200
+
+# Mesh health status for the backend pool's availability
+HEALTH_STATUS = {"available": "healthy", "degraded": "degraded", "unavailable": "unhealthy"}
+
+MB = 1024 * 1024
+
+
+def rss_bytes() -> Optional[int]:
+    """Resident set size of this process, or None if it cannot be read."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _flatten(value: Any, prefix: str = "") -> Dict[str, Any]:
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return {prefix: value}
+    flat = {}
+    for key, item in items:
+        flat.update(_flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+    return flat
+
+
+class HealthReporter:
+    """Builds health reports and suppresses ones that say nothing new."""
+
+    def __init__(self, interval: float = REPORT_INTERVAL, heartbeat_interval: float = HEARTBEAT_INTERVAL,
+                 max_silence: float = MAX_SILENCE, change_threshold: float = CHANGE_THRESHOLD):
+        self.interval = interval
+        self.heartbeat_interval = heartbeat_interval
+        self.max_silence = max_silence
+        self.change_threshold = change_threshold
+        self.started_at = time.monotonic()
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._cpu_mark = (time.monotonic(), time.process_time())
+        self._last: Dict[str, Any] = {}
+        self.reported_at: Optional[float] = None
+        self.heartbeat_at: Optional[float] = None
+        self.reports = 0
+        self.suppressed = 0
+        self.heartbeats = 0
+        self._lock = threading.Lock()
+
+    def record_latency(self, seconds: Optional[float]):
+        """Fold a finished job's submission-to-completion time into the report."""
+        if seconds is not None and seconds >= 0:
+            with self._lock:
+                self._latencies.append(seconds)
+
+    def _cpu_percent(self) -> float:
+        # Process CPU time over wall time since the previous sample, in % of one core
+        now, cpu = time.monotonic(), time.process_time()
+        with self._lock:
+            then, cpu_then = self._cpu_mark
+            self._cpu_mark = (now, cpu)
+        return round(100.0 * (cpu - cpu_then) / max(now - then, 1e-6), 1)
+
+    def _latency(self) -> Tuple[Optional[float], Optional[float]]:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None, None
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return round(sum(samples) / len(samples), 1), round(p95, 1)
+
+    def build(self, backends, queue_depth: int, **metrics) -> Dict[str, Any]:
+        """Health report body for the agent's ``BackendPool`` and local queue."""
+        pool = backends.stats()["backends"]
+        rss = rss_bytes()
+        mean, p95 = self._latency()
+        return {
+            "status": HEALTH_STATUS[backends.availability()],
+            "uptimeSeconds": int(time.monotonic() - self.started_at),
+            "cpuUsage": self._cpu_percent(),
+            "memoryUsage": round(rss / MB, 1) if rss is not None else None,
+            "customMetrics": {
+                "queue_depth": queue_depth,
+                "in_flight": sum(b["outstanding"] for b in pool.values()),
+                "job_latency_seconds": mean,
+                "job_latency_p95_seconds": p95,
+                **metrics,
+                "backends": {
+                    name: {
+                        "status": b["status"],
+                        "outstanding": b["outstanding"],
+                        "comfyui_queue_depth": b["admission"]["comfyui_queue_depth"],
+                        "gpus": b["admission"]["gpus"],
+                    }
+                    for name, b in pool.items()
+                },
+            },
+        }
+
+    def _changed(self, report: Dict[str, Any]) -> bool:
+        flat = _flatten(report)
+        flat.pop("uptimeSeconds", None)
+        if flat.keys() != self._last.keys():
+            return True
+        for key, value in flat.items():
+            old = self._last[key]
+            numeric = isinstance(value, (int, float)) and isinstance(old, (int, float))
+            if not numeric:
+                if value != old:
+                    return True
+                continue
+            floor = MIN_CHANGE.get(key.rsplit(".", 1)[-1], DEFAULT_MIN_CHANGE)
+            if abs(value - old) > max(self.change_threshold * abs(old), floor):
+                return True
+        return False
+
+    def report_due(self, report: Dict[str, Any]) -> bool:
+        """True if ``report`` should be sent; counts it as suppressed otherwise."""
+        now = time.monotonic()
+        with self._lock:
+            if self.reported_at is None or now - self.reported_at >= self.max_silence or self._changed(report):
+                return True
+            self.suppressed += 1
+            return False
+
+    def reported(self, report: Dict[str, Any]):
+        """Remember a report the mesh accepted as the baseline for the next one."""
+        flat = _flatten(report)
+        flat.pop("uptimeSeconds", None)
+        with self._lock:
+            self._last = flat
+            self.reported_at = time.monotonic()
+            self.reports += 1
+
+    def heartbeat_due(self) -> bool:
+        return self.heartbeat_at is None or time.monotonic() - self.heartbeat_at >= self.heartbeat_interval
+
+    def heartbeat_sent(self):
+        with self._lock:
+            self.heartbeat_at = time.monotonic()
+            self.heartbeats += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Reports sent and suppressed, heartbeats sent."""
+        with self._lock:
+            return {
+                "reports": self.reports,
+                "suppressed": self.suppressed,
+                "heartbeats": self.heartbeats,
+                "last_report_age_seconds": (
+                    round(time.monotonic() - self.reported_at, 1) if self.reported_at is not None else None
+                ),
+            }
@@ -0,0 +1,200 @@
+"""
+Incremental inbox cursor
+
+Tracks how far an agent has read its mesh inbox so that each
+``GET /api/messages/:agentId`` only asks for unread messages newer than the
+cursor, and collects handled message ids so they can be acknowledged via
+``POST /api/messages/:id/read`` in batches.
+
+The cursor is persisted as a small JSON file. The saved ``since`` point is
+the oldest message that was fetched but not yet acknowledged, so anything
+in flight when the process stops is fetched again on the next start while
+acknowledged messages are excluded by ``unreadOnly``. A message whose
+reply could not be sent is handed back with ``retry`` instead of being
+acknowledged, and the next fetch returns it again.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+# Where per-agent state files live
+STATE_DIR = os.environ.get("AGENT_MESH_STATE_DIR", os.path.join(os.path.expanduser("~"), ".agent-mesh"))
+
+# Acknowledge once this many messages are pending, or after ACK_INTERVAL seconds
+ACK_BATCH_SIZE = 20
+ACK_INTERVAL = 2.0
+
+# SQLite CURRENT_TIMESTAMP format used by the mesh's created_at column
+MESH_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def state_path(agent_name: str, suffix: str) -> str:
+    """Path of a per-agent state file under STATE_DIR."""
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in agent_name)
+    return os.path.join(STATE_DIR, f"{safe}.{suffix}")
+
+
+def mesh_timestamp(value: Optional[str]) -> Optional[str]:
+    """Normalize a mesh timestamp (SQLite or ISO 8601) to the SQLite format."""
+    if not value:
+        return None
+    text = value.strip().replace("T", " ").rstrip("Z")
+    try:
+        return datetime.fromisoformat(text).strftime(MESH_TIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def _second_before(timestamp: str) -> str:
+    # The server filters with created_at > since at one-second resolution;
+    # stepping back a second keeps messages that share the cursor's second.
+    return (datetime.strptime(timestamp, MESH_TIME_FORMAT) - timedelta(seconds=1)).strftime(MESH_TIME_FORMAT)
+
+
+class InboxCursor:
+    """Durable high-water mark plus batched read acknowledgements."""
+
+    def __init__(self, path: Optional[str] = None, ack_batch_size: int = ACK_BATCH_SIZE,
+                 ack_interval: float = ACK_INTERVAL):
+        self.path = path
+        self.ack_batch_size = ack_batch_size
+        self.ack_interval = ack_interval
+        self.created_at: Optional[str] = None
+        self.message_id: Optional[str] = None
+        # Fetched or pushed but not yet acknowledged: id -> created_at
+        self._inflight: Dict[str, Optional[str]] = {}
+        # In flight when the cursor was last saved; fetched again after a restart
+        self._recovered: Dict[str, Optional[str]] = {}
+        self._pending_acks: List[str] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Load the saved cursor, if any."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable inbox cursor {self.path}: {e}")
+            return
+        self.created_at = state.get("created_at")
+        self.message_id = state.get("message_id")
+        self._recovered = dict(state.get("inflight", {}))
+
+    def save(self):
+        """Atomically write the cursor to disk."""
+        if not self.path:
+            return
+        with self._lock:
+            state = {
+                "created_at": self.created_at,
+                "message_id": self.message_id,
+                "inflight": {**self._recovered, **self._inflight},
+            }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with self._save_lock:
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+
+    def query_params(self) -> Dict[str, str]:
+        """Query string for the next inbox fetch."""
+        params = {"unreadOnly": "true"}
+        with self._lock:
+            marks = [ts for ts in self._inflight.values() if ts]
+            marks += [ts for ts in self._recovered.values() if ts]
+            if self.created_at:
+                marks.append(self.created_at)
+        if marks:
+            params["since"] = _second_before(min(marks))
+        return params
+
+    def accept(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Filter a fetched page down to new messages, oldest first, and advance."""
+        fresh = []
+        with self._lock:
+            if self._recovered:
+                # Recovered ids missing from an unread page were already acknowledged
+                page_ids = {msg.get("id") for msg in messages}
+                self._recovered = {k: v for k, v in self._recovered.items() if k in page_ids}
+            for msg in messages:
+                message_id = msg.get("id")
+                if message_id in self._inflight:
+                    continue
+                # The high-water message itself, unless it needs replaying after a restart
+                if message_id and message_id == self.message_id and message_id not in self._recovered:
+                    continue
+                fresh.append(msg)
+            fresh.sort(key=lambda m: (mesh_timestamp(m.get("created_at")) or "", m.get("id") or ""))
+            for msg in fresh:
+                created_at = mesh_timestamp(msg.get("created_at"))
+                if msg.get("id"):
+                    self._inflight[msg["id"]] = created_at
+                    self._recovered.pop(msg["id"], None)
+                if created_at and (self.created_at is None or created_at >= self.created_at):
+                    self.created_at = created_at
+                    self.message_id = msg.get("id")
+        return fresh
+
+    def track(self, message: Dict[str, Any]):
+        """Record a message that arrived outside ``accept`` (e.g. pushed)."""
+        message_id = message.get("id")
+        if not message_id:
+            return
+        with self._lock:
+            self._inflight.setdefault(message_id, mesh_timestamp(message.get("created_at")))
+
+    def retry(self, message: Dict[str, Any]):
+        """Hand back a message that could not be answered; the next fetch returns it again."""
+        message_id = message.get("id")
+        if not message_id:
+            return
+        with self._lock:
+            if message_id in self._inflight:
+                self._recovered[message_id] = self._inflight.pop(message_id)
+
+    def retry_pending(self) -> bool:
+        """True while handed-back (or recovered) messages wait to be fetched again."""
+        with self._lock:
+            return bool(self._recovered)
+
+    def ack(self, message: Dict[str, Any]):
+        """Mark a message as handled; it is acknowledged on the next flush."""
+        message_id = message.get("id")
+        if message_id:
+            with self._lock:
+                self._pending_acks.append(message_id)
+
+    def ack_due(self) -> bool:
+        """True when a batch of acknowledgements should be sent."""
+        with self._lock:
+            if not self._pending_acks:
+                return False
+            return (len(self._pending_acks) >= self.ack_batch_size
+                    or time.monotonic() - self._last_flush >= self.ack_interval)
+
+    def take_acks(self) -> List[str]:
+        """Remove and return the pending acknowledgement batch."""
+        with self._lock:
+            batch, self._pending_acks = self._pending_acks, []
+            self._last_flush = time.monotonic()
+        return batch
+
+    def acked(self, message_ids: List[str], failed: Optional[List[str]] = None):
+        """Settle a flushed batch; failed ids are retried on the next flush."""
+        with self._lock:
+            for message_id in message_ids:
+                self._inflight.pop(message_id, None)
+                self._recovered.pop(message_id, None)
+            if failed:
+                self._pending_acks.extend(failed)
+        self.save()
@@ -0,0 +1,339 @@
+"""
+Crash-safe job journal
+
+An append-only write-ahead log of every job's state transitions:
+``received``, ``submitted`` (with the ``prompt_id``, backend and the
+immediate response), ``running``, ``completed`` (with the result) and
+``replied`` (the final ``inference_response`` went out). One JSON line per
+transition, so a process that dies between queueing a prompt on ComfyUI and
+sending its completion reply still knows which ``prompt_id`` belongs to
+which requester.
+
+The ledger (``ledger.py``) answers "was this message handled?". The
+journal answers "which jobs are still owed a reply?". After the first
+reply the message is acknowledged on the mesh and never fetched again,
+so the journal is the only record of jobs still waiting on ComfyUI.
+
+Writes use group commit. Appends only queue a line; a background thread
+writes everything queued within ``commit_interval`` and fsyncs once for
+the whole batch. A caller that must not go on before its record is
+durable waits for that commit (``wait(seq)``) and shares the fsync with
+every other record in the batch. If the commit fails, ``wait`` raises
+``JournalWriteError`` and the next commit rewrites the file from memory.
+
+Replaying the file on start gives ``open_jobs()``: every job not yet
+``replied``. The agents reconcile those against ComfyUI's ``/history``
+and ``/queue`` (``recover_jobs``). The file is rewritten with just the
+open jobs once it grows past ``compact_bytes``.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .completion import extract_outputs
+
+# How long the committer gathers records before one write + fsync
+COMMIT_INTERVAL = 0.01
+# Records that trigger a commit without waiting for the interval
+MAX_BATCH = 512
+# Rewrite the file with only open jobs beyond this size
+COMPACT_BYTES = 8 * 1024 * 1024
+# Failed commits remembered for late waiters
+FAILED_COMMITS = 256
+
+RECEIVED = "received"
+SUBMITTED = "submitted"
+RUNNING = "running"
+COMPLETED = "completed"
+REPLIED = "replied"
+# Recovery decided the job needs no reply from the journal (the inbox redelivers it)
+DROPPED = "dropped"
+
+FINISHED = (REPLIED, DROPPED)
+
+
+class JournalWriteError(OSError):
+    """A journal record could not be written to disk."""
+
+
+def history_result(prompt_id: str, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Completion result from a ComfyUI ``/history`` entry; None if not finished.
+
+    GPU time comes from the ``execution_start`` and ``execution_success``
+    timestamps in the entry's status messages, when ComfyUI recorded them.
+    """
+    status = entry.get("status") or {}
+    failed = status.get("status_str") == "error"
+    if not failed and not status.get("completed"):
+        return None
+    stamps = {}
+    for item in status.get("messages") or []:
+        if isinstance(item, list) and len(item) == 2 and isinstance(item[1], dict):
+            stamps[item[0]] = item[1].get("timestamp")
+    result = {
+        "status": "failed" if failed else "completed",
+        "prompt_id": prompt_id,
+        "outputs": extract_outputs(entry),
+        "timings": {},
+        "recovered": True,
+    }
+    started, finished = stamps.get("execution_start"), stamps.get("execution_success") or stamps.get("execution_error")
+    if started and finished:
+        result["timings"]["run_seconds"] = round((finished - started) / 1000, 3)
+    if failed:
+        result["error"] = "execution error"
+    return result
+
+
+def journal_message(job: Dict[str, Any]) -> Dict[str, Any]:
+    """The parts of the original mesh message a reply needs."""
+    return {"id": job["id"], "sender": job.get("sender"), "content": job.get("content") or "{}"}
+
+
+class JobJournal:
+    """Append-only, group-committed journal of job state transitions."""
+
+    def __init__(self, path: Optional[str] = None, commit_interval: float = COMMIT_INTERVAL,
+                 max_batch: int = MAX_BATCH, compact_bytes: int = COMPACT_BYTES):
+        # None keeps the journal in memory only (nothing survives a restart)
+        self.path = path
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.compact_bytes = compact_bytes
+        # message id -> merged state of every job without a final reply
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        # prompt_id -> message ids waiting on it
+        self._prompts: Dict[str, set] = {}
+        self._pending: List[str] = []
+        self._appended = 0
+        # Highest sequence number written, and highest whose commit has finished either way
+        self._durable = 0
+        self._attempted = 0
+        # (first, last) sequence numbers of commits that failed
+        self._failed: Deque[Tuple[int, int]] = deque(maxlen=FAILED_COMMITS)
+        self._rewrite = False
+        self.error: Optional[OSError] = None
+        self.write_errors = 0
+        self._cond = threading.Condition()
+        self._file = None
+        self._size = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.commits = 0
+        self.records = 0
+        self.compactions = 0
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._replay()
+
+    def _apply(self, record: Dict[str, Any]):
+        state = record.get("state")
+        if state == RUNNING and "id" not in record:
+            # Keyed by prompt: every job waiting on it is now running
+            for message_id in self._prompts.get(record.get("prompt_id"), ()):
+                job = self._jobs.get(message_id)
+                if job and job["state"] == SUBMITTED:
+                    job["state"] = RUNNING
+            return
+        message_id = record.get("id")
+        if not message_id:
+            return
+        job = self._jobs.get(message_id)
+        if job and job.get("prompt_id"):
+            self._prompts.get(job["prompt_id"], set()).discard(message_id)
+        if state in FINISHED:
+            self._jobs.pop(message_id, None)
+            return
+        job = self._jobs.setdefault(message_id, {})
+        job.update(record)
+        if job.get("prompt_id"):
+            self._prompts.setdefault(job["prompt_id"], set()).add(message_id)
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    self._apply(json.loads(line))
+                except ValueError:
+                    # A torn final line from a crash mid-write
+                    continue
+
+    def open_jobs(self) -> List[Dict[str, Any]]:
+        """Jobs that have not had their final reply, oldest first."""
+        with self._cond:
+            jobs = [dict(job) for job in self._jobs.values()]
+        return sorted(jobs, key=lambda job: job.get("at", 0))
+
+    def append(self, record: Dict[str, Any], wait: bool = False) -> int:
+        """Queue one transition; returns its sequence number.
+
+        With ``wait`` the call returns only once the record is on disk.
+        """
+        record = {**record, "at": round(time.time(), 3)}
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._cond:
+            self._apply(record)
+            self.records += 1
+            self._appended += 1
+            seq = self._appended
+            if not self.path:
+                self._durable = self._attempted = seq
+                return seq
+            self._pending.append(line)
+            self._ensure_committer()
+            self._cond.notify_all()
+        if wait:
+            self.wait(seq)
+        return seq
+
+    def wait(self, seq: int, timeout: Optional[float] = None) -> bool:
+        """Block until record ``seq`` is durable; False on timeout.
+
+        Raises ``JournalWriteError`` if the commit holding it failed.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._attempted >= seq, timeout):
+                return False
+            if any(first <= seq <= last for first, last in self._failed):
+                raise JournalWriteError(f"job journal record {seq} was not written: {self.error}")
+            return True
+
+    def received(self, message: Dict[str, Any]) -> int:
+        """A request was taken for processing (resets any earlier attempt)."""
+        return self.append({
+            "id": message["id"], "state": RECEIVED, "sender": message.get("sender"),
+            "content": message.get("content"), "prompt_id": None, "backend": None,
+            "batch": None, "response": None, "result": None,
+        })
+
+    def submitted(self, message_id: str, response: Dict[str, Any], wait: bool = False) -> int:
+        """ComfyUI accepted the job (or the request was answered without it)."""
+        return self.append({
+            "id": message_id, "state": SUBMITTED, "prompt_id": response.get("prompt_id"),
+            "backend": response.get("backend"), "batch": response.get("batch"), "response": response,
+        }, wait=wait)
+
+    def running(self, prompt_id: str) -> int:
+        """ComfyUI started executing a prompt."""
+        return self.append({"state": RUNNING, "prompt_id": prompt_id})
+
+    def completed(self, message_id: str, result: Dict[str, Any]) -> int:
+        """ComfyUI finished the job; the result is kept until the reply is sent."""
+        if not self.tracks(message_id):
+            return 0
+        return self.append({"id": message_id, "state": COMPLETED, "result": result})
+
+    def replied(self, message_id: str) -> int:
+        """The final reply was sent; the job leaves the journal."""
+        if not self.tracks(message_id):
+            return 0
+        return self.append({"id": message_id, "state": REPLIED})
+
+    def tracks(self, message_id: str) -> bool:
+        """True while a job for ``message_id`` is open."""
+        with self._cond:
+            return message_id in self._jobs
+
+    def drop(self, message_id: str) -> int:
+        """Forget a job without a reply (it will be handled afresh)."""
+        return self.append({"id": message_id, "state": DROPPED})
+
+    def _ensure_committer(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._commit_loop, name="job-journal", daemon=True)
+            self._thread.start()
+
+    def _commit_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                if not self._pending:
+                    return
+                # Let concurrent writers join this commit
+                if len(self._pending) < self.max_batch and not self._stopping:
+                    self._cond.wait_for(lambda: len(self._pending) >= self.max_batch or self._stopping,
+                                        self.commit_interval)
+                batch, self._pending = self._pending, []
+                first, seq = self._attempted + 1, self._appended
+            error = None
+            try:
+                self._write(batch)
+            except OSError as e:
+                error = e
+            with self._cond:
+                if error is None:
+                    self._durable = seq
+                    self.commits += 1
+                else:
+                    self._failed.append((first, seq))
+                    self.error = error
+                    self.write_errors += 1
+                    # The file may end in a torn line; the next commit rewrites it
+                    self._rewrite = True
+                self._attempted = seq
+                self._cond.notify_all()
+
+    def _write(self, lines: List[str]):
+        if self._rewrite:
+            # Memory already holds these lines' effect, and the failed ones'
+            self.compact()
+            self._rewrite = False
+            return
+        if self._file is None:
+            self._file = open(self.path, "a")
+            self._size = self._file.tell()
+        data = "".join(lines)
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._size += len(data)
+        if self._size > self.compact_bytes:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the file with one record per open job (committer thread or idle)."""
+        if not self.path:
+            return
+        with self._cond:
+            snapshot = "".join(json.dumps(job, separators=(",", ":")) + "\n" for job in self._jobs.values())
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "a")
+        self._size = len(snapshot)
+        self.compactions += 1
+
+    def close(self):
+        """Commit everything queued and close the file; later appends reopen it."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "open_jobs": len(self._jobs),
+                "records": self.records,
+                "commits": self.commits,
+                "records_per_commit": round(self.records / self.commits, 1) if self.commits else 0.0,
+                "compactions": self.compactions,
+                "write_errors": self.write_errors,
+            }
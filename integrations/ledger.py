@@ -0,0 +1,166 @@
+"""
+Processed-message ledger
+
+Records, per mesh message id, how far handling got: ``received`` (claimed,
+not yet submitted), ``submitted`` (ComfyUI accepted it; the response is
+stored), ``replied`` (response sent) or ``ignored`` (not an inference
+request). The agent consults it before ``process_inference_request`` so a
+restart never re-queues a GPU job that was already submitted, and a job
+whose reply was lost in a crash gets its stored response re-sent instead.
+
+Lookups are served from a bounded in-memory LRU in front of SQLite, so the
+hot path is a dictionary hit.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Entries kept in the in-memory LRU
+CACHE_SIZE = 10000
+
+# Finished entries older than this are removed by compact()
+RETENTION_SECONDS = 7 * 24 * 3600
+
+RECEIVED = "received"
+SUBMITTED = "submitted"
+REPLIED = "replied"
+IGNORED = "ignored"
+
+FINISHED = (REPLIED, IGNORED)
+
+
+class MessageLedger:
+    """SQLite-backed ledger of handled message ids with an LRU cache."""
+
+    def __init__(self, path: Optional[str] = None, cache_size: int = CACHE_SIZE):
+        self.path = path or ":memory:"
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.cache_size = cache_size
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS processed_messages (
+                message_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                prompt_id TEXT,
+                response TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Ids being handled by this process right now
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def _remember(self, message_id: str, entry: Dict[str, Any]):
+        self._cache[message_id] = entry
+        self._cache.move_to_end(message_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _load(self, message_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(message_id)
+        if entry is not None:
+            self._cache.move_to_end(message_id)
+            return entry
+        row = self._db.execute(
+            "SELECT status, prompt_id, response FROM processed_messages WHERE message_id = ?",
+            (message_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = {
+            "status": row[0],
+            "prompt_id": row[1],
+            "response": json.loads(row[2]) if row[2] else None,
+        }
+        self._remember(message_id, entry)
+        return entry
+
+    def _write(self, message_id: str, entry: Dict[str, Any]):
+        self._db.execute(
+            "INSERT OR REPLACE INTO processed_messages (message_id, status, prompt_id, response, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (message_id, entry["status"], entry.get("prompt_id"),
+             json.dumps(entry["response"]) if entry.get("response") is not None else None, time.time())
+        )
+        self._remember(message_id, entry)
+
+    def get(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Return ``{status, prompt_id, response}`` for a message, or None."""
+        with self._lock:
+            entry = self._load(message_id)
+            return dict(entry) if entry else None
+
+    def begin(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Claim a message for handling.
+
+        Returns None if it is already finished or being handled by this
+        process; otherwise the existing entry (an unfinished one left by a
+        previous run) or a fresh ``received`` entry.
+        """
+        with self._lock:
+            if message_id in self._active:
+                return None
+            entry = self._load(message_id)
+            if entry is not None and entry["status"] in FINISHED:
+                return None
+            if entry is None:
+                entry = {"status": RECEIVED, "prompt_id": None, "response": None}
+                self._write(message_id, entry)
+            self._active.add(message_id)
+            return dict(entry)
+
+    def finished(self, message_id: str) -> bool:
+        """True if the message was already replied to or ignored."""
+        with self._lock:
+            entry = self._load(message_id)
+            return entry is not None and entry["status"] in FINISHED
+
+    def record_response(self, message_id: str, response: Dict[str, Any]):
+        """Store the outcome of ``process_inference_request`` before replying."""
+        with self._lock:
+            self._write(message_id, {
+                "status": SUBMITTED,
+                "prompt_id": response.get("prompt_id"),
+                "response": response,
+            })
+
+    def finish(self, message_id: str, status: str = REPLIED):
+        """Mark a message ``replied`` or ``ignored`` and release the claim."""
+        with self._lock:
+            entry = self._load(message_id) or {"prompt_id": None, "response": None}
+            self._write(message_id, {**entry, "status": status})
+            self._active.discard(message_id)
+
+    def reopen(self, message_id: str):
+        """Return a message to ``received`` and claim it, to be processed again."""
+        with self._lock:
+            self._write(message_id, {"status": RECEIVED, "prompt_id": None, "response": None})
+            self._active.add(message_id)
+
+    def release(self, message_id: str):
+        """Drop this process's claim without changing the stored state."""
+        with self._lock:
+            self._active.discard(message_id)
+
+    def compact(self, max_age: float = RETENTION_SECONDS) -> int:
+        """Delete finished entries older than ``max_age`` seconds."""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM processed_messages WHERE status IN (?, ?) AND updated_at < ?",
+                (*FINISHED, time.time() - max_age)
+            )
+            return cursor.rowcount
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,379 @@
+"""
+Synthetic mesh load generator
+
+Registers ``agents`` synthetic agents, puts them into groups, then drives a
+weighted mix of mesh operations against a mesh URL from one asyncio loop
+(``httpx.AsyncClient``, ``pip install httpx``):
+
+| Operation | Endpoint |
+|-----------|----------|
+| ``direct`` | ``POST /api/messages`` |
+| ``broadcast`` | ``POST /api/broadcast`` |
+| ``group_broadcast`` | ``POST /api/groups/:id/broadcast`` |
+| ``heartbeat`` | ``POST /api/agents/:id/heartbeat`` |
+| ``memory_write`` | ``POST /api/groups/:id/memory`` |
+| ``inbox_read`` | ``GET /api/messages/:id?unreadOnly=true`` |
+
+Operations arrive open-loop at ``rate`` per second with at most
+``concurrency`` outstanding. An operation that cannot start on time
+because all slots are busy is counted as ``late``, so a saturated mesh
+shows up as lateness instead of silently lowering the offered load.
+
+Per-endpoint throughput, error counts and latency percentiles are written
+as sorted, indented JSON so two runs can be compared with ``diff`` or
+``--baseline``::
+
+    python -m integrations.loadgen --agents 2000 --rate 500 --duration 60 --output run.json
+    python -m integrations.loadgen --agents 2000 --rate 500 --duration 60 --baseline run.json
+
+``--stub`` runs against an in-process ``StubMesh`` instead, to check the
+generator itself.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .comfyui_integration import MESH_API_KEY, MESH_API_URL
+
+# operation -> share of the offered load
+DEFAULT_MIX = {
+    "direct": 60.0,
+    "broadcast": 0.5,
+    "group_broadcast": 4.5,
+    "heartbeat": 15.0,
+    "memory_write": 5.0,
+    "inbox_read": 15.0,
+}
+
+AGENTS = 100
+GROUPS = 20
+RATE = 200.0
+DURATION = 30.0
+CONCURRENCY = 256
+# Concurrent registrations and group joins during setup
+SETUP_CONCURRENCY = 64
+# Distinct group memory keys written per group
+MEMORY_KEYS = 50
+PAYLOAD_BYTES = 256
+
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class EndpointStats:
+    """Latency samples and outcome counts for one operation."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.status_codes: Dict[str, int] = {}
+
+    def record(self, seconds: float, status: str, ok: bool):
+        self.latencies.append(seconds)
+        self.status_codes[status] = self.status_codes.get(status, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        latency = {f"p{round(f * 100)}": round(_percentile(ordered, f) * 1000, 2) for f in PERCENTILES}
+        latency["mean"] = round(sum(ordered) / count * 1000, 2) if count else 0.0
+        latency["max"] = round(ordered[-1] * 1000, 2) if ordered else 0.0
+        return {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0.0,
+            "per_second": round(count / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": latency,
+            "status_codes": self.status_codes,
+        }
+
+
+class MeshLoadGenerator:
+    """Registers synthetic agents and drives a mix of mesh traffic."""
+
+    def __init__(self, mesh_url: str = MESH_API_URL, api_key: str = MESH_API_KEY,
+                 agents: int = AGENTS, groups: int = GROUPS, mix: Optional[Dict[str, float]] = None,
+                 rate: float = RATE, duration: float = DURATION, concurrency: int = CONCURRENCY,
+                 payload_bytes: int = PAYLOAD_BYTES, prefix: str = "loadgen", seed: Optional[int] = None,
+                 timeout: float = 30):
+        unknown = set(mix or ()) - set(DEFAULT_MIX)
+        if unknown:
+            raise ValueError(f"Unknown operations {sorted(unknown)}, expected some of {sorted(DEFAULT_MIX)}")
+        self.mesh_url = mesh_url.rstrip("/")
+        self.api_key = api_key
+        self.agents = agents
+        self.groups = max(1, min(groups, agents))
+        self.mix = {op: w for op, w in (mix or DEFAULT_MIX).items() if w > 0}
+        self.rate = rate
+        self.duration = duration
+        self.concurrency = concurrency
+        self.payload = "x" * payload_bytes
+        self.prefix = prefix
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.agent_ids: List[str] = []
+        # group id -> member agent ids
+        self.members: Dict[str, List[str]] = {}
+        self.stats: Dict[str, EndpointStats] = {}
+        self.late = 0
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def _call(self, op: str, method: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        """One timed request, recorded under ``op``."""
+        stats = self.stats.setdefault(op, EndpointStats())
+        started = time.perf_counter()
+        try:
+            resp = await self._client.request(method, f"{self.mesh_url}{path}", **kwargs)
+        except httpx.HTTPError as e:
+            stats.record(time.perf_counter() - started, type(e).__name__, False)
+            return None
+        stats.record(time.perf_counter() - started, str(resp.status_code), resp.status_code < 400)
+        return resp
+
+    async def _bounded(self, items, call, limit: int = SETUP_CONCURRENCY) -> list:
+        semaphore = asyncio.Semaphore(limit)
+
+        async def one(item):
+            async with semaphore:
+                return await call(item)
+        return await asyncio.gather(*(one(item) for item in items))
+
+    async def _register(self, index: int) -> Optional[str]:
+        resp = await self._call("register", "POST", "/api/agents/register", json={
+            "name": f"{self.prefix}-agent-{index:05d}",
+            "endpoint": None,
+            "capabilities": ["loadgen"],
+        })
+        if resp is None or resp.status_code != 200:
+            return None
+        return resp.json().get("agentId")
+
+    async def _join(self, pair) -> bool:
+        group_id, agent_id = pair
+        resp = await self._call("group_join", "POST", f"/api/groups/{group_id}/members", json={"agentId": agent_id})
+        # 409: already a member from an earlier run
+        return resp is not None and resp.status_code in (200, 409)
+
+    async def setup(self):
+        """Register the agents, create the groups and spread the agents over them."""
+        ids = await self._bounded(range(self.agents), self._register)
+        self.agent_ids = [agent_id for agent_id in ids if agent_id]
+        if not self.agent_ids:
+            raise RuntimeError(f"No synthetic agent could register with {self.mesh_url}")
+        for index in range(self.groups):
+            resp = await self._call("group_create", "POST", "/api/groups", json={
+                "name": f"{self.prefix}-group-{index:03d}",
+                "createdBy": self.agent_ids[0],
+            })
+            if resp is not None and resp.status_code == 200:
+                self.members[resp.json()["groupId"]] = []
+        groups = list(self.members)
+        pairs = [(groups[i % len(groups)], agent_id) for i, agent_id in enumerate(self.agent_ids)] if groups else []
+        joined = await self._bounded(pairs, self._join)
+        for (group_id, agent_id), ok in zip(pairs, joined):
+            if ok:
+                self.members[group_id].append(agent_id)
+        # Groups need two members for a group broadcast to reach anyone
+        self.members = {g: m for g, m in self.members.items() if len(m) > 1}
+
+    def _operation(self, op: str):
+        rng = self.rng
+        agent = rng.choice(self.agent_ids)
+        content = json.dumps({"type": "loadgen", "sent_at": time.time(), "body": self.payload})
+        if op == "direct":
+            return self._call(op, "POST", "/api/messages",
+                              json={"from": agent, "to": rng.choice(self.agent_ids), "content": content})
+        if op == "broadcast":
+            return self._call(op, "POST", "/api/broadcast", json={"from": agent, "content": content})
+        if op == "heartbeat":
+            return self._call(op, "POST", f"/api/agents/{agent}/heartbeat")
+        if op == "inbox_read":
+            return self._call(op, "GET", f"/api/messages/{agent}", params={"unreadOnly": "true"})
+        group_id = rng.choice(list(self.members))
+        member = rng.choice(self.members[group_id])
+        if op == "group_broadcast":
+            return self._call(op, "POST", f"/api/groups/{group_id}/broadcast",
+                              json={"from": member, "content": content})
+        return self._call(op, "POST", f"/api/groups/{group_id}/memory", json={
+            "agentId": member,
+            "key": f"{self.prefix}-key-{rng.randrange(MEMORY_KEYS)}",
+            "value": {"writer": member, "at": time.time()},
+        })
+
+    async def drive(self) -> float:
+        """Offer the mix at ``rate`` for ``duration`` seconds; returns the elapsed time."""
+        mix = dict(self.mix)
+        if not self.members:
+            mix.pop("group_broadcast", None)
+            mix.pop("memory_write", None)
+        ops, weights = list(mix), list(mix.values())
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+
+        async def run(op: str):
+            try:
+                await self._operation(op)
+            finally:
+                semaphore.release()
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        total = int(self.rate * self.duration)
+        for index in range(total):
+            due = started + index / self.rate
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if semaphore.locked():
+                self.late += 1
+            await semaphore.acquire()
+            task = asyncio.ensure_future(run(self.rng.choices(ops, weights)[0]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        return loop.time() - started
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        """Result document: configuration plus per-endpoint summaries."""
+        endpoints = {op: stats.summary(elapsed) for op, stats in self.stats.items()
+                     if op not in ("register", "group_create", "group_join")}
+        setup = {op: self.stats[op].summary(elapsed) for op in ("register", "group_create", "group_join")
+                 if op in self.stats}
+        offered = int(self.rate * self.duration)
+        return {
+            "config": {
+                "mesh_url": self.mesh_url,
+                "agents": self.agents,
+                "groups": self.groups,
+                "rate": self.rate,
+                "duration": self.duration,
+                "concurrency": self.concurrency,
+                "payload_bytes": len(self.payload),
+                "mix": self.mix,
+            },
+            "registered_agents": len(self.agent_ids),
+            "usable_groups": len(self.members),
+            "elapsed_seconds": round(elapsed, 3),
+            "offered": offered,
+            "late": self.late,
+            "achieved_per_second": round(sum(e["count"] for e in endpoints.values()) / elapsed, 2) if elapsed else 0.0,
+            "endpoints": endpoints,
+            "setup": setup,
+        }
+
+    async def run(self) -> Dict[str, Any]:
+        """Set up, drive the load and return the report."""
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(headers={"X-API-Key": self.api_key}, limits=limits,
+                                     timeout=self.timeout) as client:
+            self._client = client
+            try:
+                await self.setup()
+                for op in self.mix:
+                    self.stats.setdefault(op, EndpointStats())
+                elapsed = await self.drive()
+            finally:
+                self._client = None
+        return self.report(elapsed)
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Per-endpoint throughput, p95/p99 and error-rate changes as table rows."""
+    rows = [f"{'operation':<16}{'per_second':>22}{'p95 ms':>22}{'p99 ms':>22}{'error_rate':>18}"]
+
+    def cell(old, new) -> str:
+        if old is None:
+            return f"{new}"
+        change = f" ({(new - old) / old * 100:+.0f}%)" if old else ""
+        return f"{old} -> {new}{change}"
+
+    for op, now in sorted(current["endpoints"].items()):
+        before = baseline.get("endpoints", {}).get(op, {})
+        old_latency = before.get("latency_ms", {})
+        rows.append(
+            f"{op:<16}{cell(before.get('per_second'), now['per_second']):>22}"
+            f"{cell(old_latency.get('p95'), now['latency_ms']['p95']):>22}"
+            f"{cell(old_latency.get('p99'), now['latency_ms']['p99']):>22}"
+            f"{cell(before.get('error_rate'), now['error_rate']):>18}"
+        )
+    return rows
+
+
+def _parse_mix(text: str) -> Dict[str, float]:
+    # "direct=60,heartbeat=20,inbox_read=20"
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Drive synthetic agent traffic against an Agent Mesh")
+    parser.add_argument("--mesh-url", default=MESH_API_URL)
+    parser.add_argument("--api-key", default=MESH_API_KEY)
+    parser.add_argument("--agents", type=int, default=AGENTS)
+    parser.add_argument("--groups", type=int, default=GROUPS)
+    parser.add_argument("--rate", type=float, default=RATE, help="operations per second")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="max outstanding requests")
+    parser.add_argument("--mix", type=_parse_mix, default=None,
+                        help=f"operation=weight,... from {','.join(DEFAULT_MIX)}")
+    parser.add_argument("--payload-bytes", type=int, default=PAYLOAD_BYTES)
+    parser.add_argument("--prefix", default="loadgen", help="name prefix of the synthetic agents and groups")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="loadgen-results.json")
+    parser.add_argument("--baseline", default=None, help="earlier result file to compare against")
+    parser.add_argument("--stub", action="store_true", help="run against an in-process StubMesh")
+    args = parser.parse_args(argv)
+
+    stub = None
+    mesh_url = args.mesh_url
+    if args.stub:
+        from .stubs import StubMesh
+        stub = StubMesh()
+        mesh_url = stub.start()
+    try:
+        generator = MeshLoadGenerator(
+            mesh_url, args.api_key, agents=args.agents, groups=args.groups, mix=args.mix, rate=args.rate,
+            duration=args.duration, concurrency=args.concurrency, payload_bytes=args.payload_bytes,
+            prefix=args.prefix, seed=args.seed,
+        )
+        report = asyncio.run(generator.run())
+    finally:
+        if stub is not None:
+            stub.stop()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"{report['registered_agents']} agents, {report['usable_groups']} groups; "
+          f"{report['achieved_per_second']}/s achieved of {args.rate}/s offered, {report['late']} late")
+    for op, summary in sorted(report["endpoints"].items()):
+        latency = summary["latency_ms"]
+        print(f"  {op:<16}{summary['count']:>8}  {summary['per_second']:>8}/s  "
+              f"p50 {latency['p50']:>7}ms  p95 {latency['p95']:>7}ms  p99 {latency['p99']:>7}ms  "
+              f"errors {summary['errors']}")
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print("\n".join(compare(baseline, report)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Agent Mesh WebSocket push intake
+
+Keeps a persistent connection to the mesh's ``/ws`` endpoint so that
+``new_message`` events addressed to an agent are delivered the moment the
+server stores them, instead of waiting for the next inbox poll.
+
+Usage:
+    from integrations.mesh_push import MeshPushListener
+
+    listener = MeshPushListener(
+        "ws://localhost:4000/ws",
+        agent_id,
+        on_message=handle_message,
+        on_reconnect=fetch_missed_messages,
+    )
+    listener.start()
+"""
+
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import websocket  # websocket-client
+except ImportError:  # pragma: no cover - optional dependency
+    websocket = None
+
+# Seconds between heartbeat frames (matches websocket-client.js)
+HEARTBEAT_INTERVAL = 30
+
+# Reconnect backoff bounds in seconds
+RECONNECT_INTERVAL = 5
+MAX_RECONNECT_INTERVAL = 60
+
+
+def push_available() -> bool:
+    """Return True if the websocket-client package is installed."""
+    return websocket is not None
+
+
+def mesh_ws_url(mesh_url: str) -> str:
+    """Derive the mesh WebSocket URL from its HTTP base URL."""
+    if mesh_url.startswith("https://"):
+        base = "wss://" + mesh_url[len("https://"):]
+    elif mesh_url.startswith("http://"):
+        base = "ws://" + mesh_url[len("http://"):]
+    else:
+        base = mesh_url
+    return base.rstrip("/") + "/ws"
+
+
+def normalize_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a pushed ``new_message`` payload onto the inbox row shape.
+
+    The server pushes ``{id, from, to, content, createdAt}`` while
+    ``GET /api/messages/:id`` returns ``{id, from_agent, to_agent, content,
+    created_at}``; handlers see both spellings plus ``sender``.
+    """
+    msg = dict(message)
+    sender = msg.get("from") or msg.get("from_agent") or msg.get("sender")
+    recipient = msg.get("to") or msg.get("to_agent") or msg.get("recipient")
+    msg.setdefault("from_agent", sender)
+    msg.setdefault("to_agent", recipient)
+    msg.setdefault("sender", sender)
+    if "created_at" not in msg and "createdAt" in msg:
+        msg["created_at"] = msg["createdAt"]
+    return msg
+
+
+class MeshPushListener:
+    """Background WebSocket listener that dispatches messages for one agent."""
+
+    def __init__(
+        self,
+        ws_url: str,
+        agent_id: str,
+        on_message: Callable[[Dict[str, Any]], None],
+        on_reconnect: Optional[Callable[[], None]] = None,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL,
+        reconnect_interval: float = RECONNECT_INTERVAL,
+        max_reconnect_interval: float = MAX_RECONNECT_INTERVAL,
+    ):
+        if websocket is None:
+            raise RuntimeError("websocket-client is required for push intake (pip install websocket-client)")
+        self.ws_url = ws_url
+        self.agent_id = agent_id
+        self.on_message = on_message
+        self.on_reconnect = on_reconnect
+        self.heartbeat_interval = heartbeat_interval
+        self.reconnect_interval = reconnect_interval
+        self.max_reconnect_interval = max_reconnect_interval
+        self.connected = False
+        self.reconnects = 0
+        self._ws = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> threading.Thread:
+        """Start the listener thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="mesh-push", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Stop the listener and close the socket."""
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+    def _send(self, frame: Dict[str, Any]):
+        self._ws.send(json.dumps(frame))
+
+    def _connect(self):
+        self._ws = websocket.create_connection(self.ws_url, timeout=10)
+        self._ws.settimeout(self.heartbeat_interval)
+        self._send({"type": "register_agent", "agentId": self.agent_id})
+        self.connected = True
+        print(f"[WS] Connected to {self.ws_url}")
+
+    def _run(self):
+        delay = self.reconnect_interval
+        while not self._stop.is_set():
+            try:
+                self._connect()
+                delay = self.reconnect_interval
+                # Anything sent while we were away is fetched over HTTP
+                if self.on_reconnect:
+                    self.on_reconnect()
+                self._receive_loop()
+            except Exception as e:
+                if not self._stop.is_set():
+                    print(f"[WS] Connection lost: {e}")
+            finally:
+                self.connected = False
+                if self._ws is not None:
+                    try:
+                        self._ws.close()
+                    except Exception:
+                        pass
+                    self._ws = None
+
+            if self._stop.is_set():
+                break
+            self.reconnects += 1
+            # Jitter so a mesh restart does not get every agent back at once
+            self._stop.wait(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, self.max_reconnect_interval)
+
+    def _receive_loop(self):
+        last_heartbeat = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                raw = self._ws.recv()
+            except websocket.WebSocketTimeoutException:
+                raw = None
+
+            if time.monotonic() - last_heartbeat >= self.heartbeat_interval:
+                self._send({"type": "heartbeat"})
+                last_heartbeat = time.monotonic()
+
+            if not raw:
+                if raw == "":
+                    raise ConnectionError("socket closed by server")
+                continue
+
+            try:
+                event = json.loads(raw)
+            except ValueError:
+                continue
+
+            if event.get("type") != "new_message":
+                continue
+            message = normalize_message(event.get("message") or {})
+            if message.get("to_agent") != self.agent_id:
+                continue
+            try:
+                self.on_message(message)
+            except Exception as e:
+                print(f"[WS] Error handling message {message.get('id')}: {e}")
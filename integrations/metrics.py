@@ -0,0 +1,364 @@
+"""
+Prometheus-style metrics for the integration
+
+A small in-process registry of counters, latency histograms and
+scrape-time callbacks, rendered in the Prometheus text exposition format
+and optionally served on a local HTTP endpoint (``/metrics``). It has no
+dependencies.
+
+Instrumentation is cheap enough to leave on. Labelled series are bound
+once with ``labels(...)`` when the agent starts, so a hot-path ``inc`` or
+``observe`` is a short locked update with no label dict or string
+building. Gauges and the counters kept by existing components
+(dispatcher, backend pool, result cache, coalescer) are read through
+callbacks only when the endpoint is scraped.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .scheduler import PRIORITIES
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# Upper bounds of the latent batch size histogram buckets
+BATCH_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16)
+
+# Endpoint binds to loopback unless told otherwise
+METRICS_HOST = "127.0.0.1"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Pipeline stages timed by both agents
+STAGES = ("inbox_fetch", "json_parse", "workflow_build", "comfyui_submit", "completion", "output_publish",
+          "response_send")
+
+LabelValues = Tuple[str, ...]
+CallbackValue = Union[float, Dict[LabelValues, float], None]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild:
+    """One labelled counter series."""
+
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class HistogramChild:
+    """One labelled histogram series."""
+
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # Per-bucket (not cumulative) counts; the last slot is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def since(self, started: float):
+        """Observe the seconds elapsed since ``time.perf_counter()`` was ``started``."""
+        self.observe(time.perf_counter() - started)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._children: Dict[LabelValues, Any] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The series for these label values; bind it once and keep it."""
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+        key = tuple(str(v) for v in values)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _series(self) -> List[Tuple[LabelValues, Any]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._samples()
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        """Increment the unlabelled series."""
+        self.labels().inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_label_text(self.label_names, values)} {_number(child.value)}"
+            for values, child in self._series()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        """Observe into the unlabelled series."""
+        self.labels().observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in self._series():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), counts):
+                cumulative += count
+                le = _label_text(self.label_names, values, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _label_text(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Callback(_Metric):
+    """Gauge or counter whose value is read from ``fn`` at scrape time.
+
+    ``fn`` returns a number for an unlabelled metric, or a mapping of label
+    value tuples to numbers. ``None`` values are skipped.
+    """
+
+    def __init__(self, name: str, help_text: str, kind: str, fn: Callable[[], CallbackValue],
+                 labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def _samples(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception as e:
+            return [f"# {self.name} unavailable: {_escape(e)}"]
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        return [
+            f"{self.name}{_label_text(self.label_names, values)} {_number(v)}"
+            for values, v in items
+            if v is not None
+        ]
+
+
+class MetricsRegistry:
+    """Named metrics, rendered together in the text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                    raise ValueError(f"Metric {metric.name!r} is already registered differently")
+                if isinstance(metric, Callback):
+                    # Re-registering a callback (a new agent on a shared registry) replaces it
+                    self._metrics[metric.name] = metric
+                    return metric
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def gauge_fn(self, name: str, help_text: str, fn: Callable[[], CallbackValue],
+                 labels: Sequence[str] = ()) -> Callback:
+        """Gauge read from ``fn`` at scrape time."""
+        return self._register(Callback(name, help_text, "gauge", fn, labels))
+
+    def counter_fn(self, name: str, help_text: str, fn: Callable[[], CallbackValue],
+                   labels: Sequence[str] = ()) -> Callback:
+        """Counter kept elsewhere, read from ``fn`` at scrape time."""
+        return self._register(Callback(name, help_text, "counter", fn, labels))
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = METRICS_HOST) -> ThreadingHTTPServer:
+        """Serve ``GET /metrics`` from a daemon thread; ``port=0`` picks a free port."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Metrics on http://{host}:{self._server.server_port}/metrics")
+        return self._server
+
+    def stop_serving(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class IntegrationMetrics:
+    """The instruments both ComfyUI agents record into, bound once per agent."""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        seconds = r.histogram(
+            "comfyui_mesh_stage_seconds", "Time spent per pipeline stage in seconds", ("stage",)
+        )
+        errors = r.counter("comfyui_mesh_stage_errors_total", "Failed pipeline stage calls", ("stage",))
+        self.stage = {name: seconds.labels(name) for name in STAGES}
+        self.errors = {name: errors.labels(name) for name in STAGES}
+        messages = r.counter("comfyui_mesh_messages_total", "Inbox messages fetched from the mesh")
+        self.messages = messages.labels()
+        completions = r.counter("comfyui_mesh_completions_total", "ComfyUI prompts finished", ("status",))
+        self.completed = completions.labels("completed")
+        self.failed = completions.labels("failed")
+        self.batch_size = r.histogram(
+            "comfyui_mesh_batch_size", "Requests per latent batch submitted to ComfyUI", buckets=BATCH_BUCKETS
+        ).labels()
+        waits = r.histogram(
+            "comfyui_mesh_queue_wait_seconds", "Time requests waited in the local scheduler in seconds", ("priority",)
+        )
+        self.queue_wait = {priority: waits.labels(priority) for priority in PRIORITIES}
+        self.model_switches = r.counter(
+            "comfyui_mesh_model_switches_total", "Scheduler releases that changed the model group"
+        ).labels()
+
+    def record_release(self, job, wait: float, switched: bool):
+        """``JobScheduler.on_release`` hook: queue wait per priority and model switches."""
+        self.queue_wait[job.priority].observe(wait)
+        if switched:
+            self.model_switches.inc()
+
+    def watch(self, agent, queue_depth: Callable[[], int]):
+        """Register scrape-time gauges and counters read from ``agent``'s components."""
+        r = self.registry
+        r.gauge_fn("comfyui_mesh_queue_depth", "Requests waiting in the local scheduler", queue_depth)
+        r.gauge_fn("comfyui_mesh_in_flight", "Prompts submitted to ComfyUI and not finished",
+                   lambda: sum(b["outstanding"] for b in agent.backends.stats()["backends"].values()))
+        r.gauge_fn("comfyui_mesh_backend_up", "1 while a backend's circuit breaker is closed",
+                   lambda: {(b.name,): int(b.breaker.available) for b in agent.backends.backends()},
+                   ("backend",))
+        r.gauge_fn("comfyui_mesh_backend_outstanding", "Prompts queued or running per backend",
+                   lambda: {(n,): b["outstanding"] for n, b in agent.backends.stats()["backends"].items()},
+                   ("backend",))
+        r.gauge_fn("comfyui_mesh_backend_queue_depth", "Last sampled ComfyUI queue depth per backend",
+                   lambda: {(n,): b["admission"]["comfyui_queue_depth"]
+                            for n, b in agent.backends.stats()["backends"].items()},
+                   ("backend",))
+        r.counter_fn("comfyui_mesh_breaker_trips_total", "Times a circuit breaker opened",
+                     lambda: {(b.name,): b.breaker.trips for b in agent.backends.backends()},
+                     ("backend",))
+        r.counter_fn("comfyui_mesh_result_cache_hits_total", "Requests answered from the result cache",
+                     lambda: agent.results.hits)
+        r.counter_fn("comfyui_mesh_result_cache_misses_total", "Result cache lookups that missed",
+                     lambda: agent.results.misses)
+        r.counter_fn("comfyui_mesh_coalesced_total", "Requests that shared an identical in-flight prompt",
+                     lambda: agent.coalescer.hits)
+        r.counter_fn("comfyui_mesh_inbox_polls_total", "Inbox fetches over HTTP", lambda: agent.poller.polls)
+        r.counter_fn("comfyui_mesh_inbox_empty_polls_total", "Inbox fetches that returned no new messages",
+                     lambda: agent.poller.empty_polls)
+        r.gauge_fn("comfyui_mesh_inbox_poll_rate", "Inbox fetches per second over the last 5 minutes",
+                   agent.poller.poll_rate)
+        r.gauge_fn("comfyui_mesh_inbox_poll_interval_seconds", "Current adaptive wait between inbox fetches",
+                   lambda: agent.poller.interval)
+        r.counter_fn("comfyui_mesh_outputs_published_total", "Outputs uploaded to the mesh file store",
+                     lambda: agent.publisher.uploaded if agent.publisher else 0)
+        r.counter_fn("comfyui_mesh_output_bytes_published_total", "Output bytes uploaded to the mesh file store",
+                     lambda: agent.publisher.bytes if agent.publisher else 0)
+        r.counter_fn("comfyui_mesh_output_publish_failures_total", "Outputs that could not be published",
+                     lambda: agent.publisher.failed + agent.publisher.skipped if agent.publisher else 0)
+        r.gauge_fn("comfyui_mesh_artifact_bytes", "Bytes held in the local artifact store",
+                   lambda: agent.artifacts.stats()["bytes"] if agent.artifacts is not None else None)
+        r.counter_fn("comfyui_mesh_artifact_evictions_total", "Artifacts deleted to stay within the disk quota",
+                     lambda: agent.artifacts.evictions if agent.artifacts is not None else 0)
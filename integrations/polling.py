@@ -0,0 +1,151 @@
+"""
+Adaptive inbox polling
+
+Used while the mesh push socket is unavailable. Instead of a fixed sleep
+between inbox fetches, ``AdaptivePoller`` polls again after
+``min_interval`` while messages keep arriving. Each empty poll multiplies
+the wait by ``backoff`` up to ``max_interval``. Failed fetches back off
+separately, from ``error_interval`` up to ``max_error_interval``. Every
+wait is scaled by a random factor within ``±jitter`` so agents started
+together do not poll in lockstep.
+
+If the mesh supports long-poll reads (``GET /api/messages/:id?wait=N``,
+answered with an ``X-Long-Poll`` header) the server holds empty reads
+open itself and the next fetch goes out straight away. A mesh that
+ignores ``wait`` is detected on the first response, and the poller falls
+back to sleeping between polls.
+
+``stats()`` reports the effective poll rate over the last
+``RATE_WINDOW`` seconds and the share of polls that came back empty.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Mapping, Optional
+
+MIN_INTERVAL = 0.5
+MAX_INTERVAL = 10.0
+BACKOFF = 2.0
+JITTER = 0.2
+ERROR_INTERVAL = 1.0
+MAX_ERROR_INTERVAL = 30.0
+
+# Seconds a long-poll read asks the mesh to wait (0 disables long-poll)
+LONG_POLL = 20.0
+LONG_POLL_HEADER = "X-Long-Poll"
+
+# Polls counted for the effective rate
+RATE_WINDOW = 300.0
+
+
+class AdaptivePoller:
+    """Chooses the wait before each inbox fetch from recent outcomes."""
+
+    def __init__(self, min_interval: float = MIN_INTERVAL, max_interval: float = MAX_INTERVAL,
+                 backoff: float = BACKOFF, jitter: float = JITTER,
+                 error_interval: float = ERROR_INTERVAL, max_error_interval: float = MAX_ERROR_INTERVAL,
+                 long_poll: float = LONG_POLL, rng: Optional[random.Random] = None):
+        self.min_interval = min(min_interval, max_interval)
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.error_interval = error_interval
+        self.max_error_interval = max_error_interval
+        self.long_poll = long_poll
+        # None until the first long-poll read shows whether the mesh honours ``wait``
+        self.long_poll_supported: Optional[bool] = None if long_poll > 0 else False
+        self.interval = self.min_interval
+        self.polls = 0
+        self.empty_polls = 0
+        self.errors = 0
+        self.messages = 0
+        self.long_polls = 0
+        self._error_streak = 0
+        self._last_error = False
+        self._last_long_poll = False
+        self._recent: Deque[float] = deque()
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def wait_seconds(self) -> float:
+        """Server-side wait to ask for on the next fetch (0 for a plain read)."""
+        return self.long_poll if self.long_poll_supported is not False else 0.0
+
+    def query_params(self) -> Dict[str, str]:
+        """Extra inbox query parameters for the next fetch."""
+        wait = self.wait_seconds()
+        return {"wait": f"{wait:g}"} if wait else {}
+
+    def record(self, count: int, headers: Optional[Mapping[str, str]] = None, long_polled: bool = False):
+        """Note a successful fetch that returned ``count`` messages.
+
+        Pass the response ``headers`` of a fetch that asked to long-poll, so
+        the poller learns whether the mesh supports it.
+        """
+        with self._lock:
+            if long_polled and headers is not None:
+                self.long_poll_supported = bool(headers.get(LONG_POLL_HEADER))
+            self._last_long_poll = long_polled and bool(self.long_poll_supported)
+            self.polls += 1
+            self.long_polls += int(self._last_long_poll)
+            now = time.monotonic()
+            self._recent.append(now)
+            while now - self._recent[0] > RATE_WINDOW:
+                self._recent.popleft()
+            self._error_streak = 0
+            self._last_error = False
+            if count:
+                self.messages += count
+                self.interval = self.min_interval
+            else:
+                self.empty_polls += 1
+                self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def record_error(self):
+        """Note a failed fetch."""
+        with self._lock:
+            self.errors += 1
+            self._error_streak += 1
+            self._last_error = True
+            self._last_long_poll = False
+
+    def next_delay(self) -> float:
+        """Seconds to wait before the next fetch, jittered."""
+        with self._lock:
+            if self._last_error:
+                base = min(self.max_error_interval,
+                           self.error_interval * self.backoff ** (self._error_streak - 1))
+            elif self._last_long_poll:
+                # The mesh already waited for traffic
+                return 0.0
+            else:
+                base = self.interval
+            return base * self._rng.uniform(1 - self.jitter, 1 + self.jitter) if self.jitter else base
+
+    def poll_rate(self) -> float:
+        """Polls per second over the last ``RATE_WINDOW`` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] > RATE_WINDOW:
+                self._recent.popleft()
+            if not self._recent:
+                return 0.0
+            span = max(now - self._recent[0], 1.0)
+            return len(self._recent) / span
+
+    def stats(self) -> Dict[str, Any]:
+        rate = self.poll_rate()
+        with self._lock:
+            return {
+                "polls": self.polls,
+                "empty_polls": self.empty_polls,
+                "wasted_fraction": round(self.empty_polls / self.polls, 3) if self.polls else 0.0,
+                "errors": self.errors,
+                "messages": self.messages,
+                "polls_per_minute": round(rate * 60, 2),
+                "interval": round(self.interval, 3),
+                "long_poll": self.long_poll_supported,
+                "long_polls": self.long_polls,
+            }
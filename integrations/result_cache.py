@@ -0,0 +1,214 @@
+"""
+Generation result cache
+
+Completed generations are stored under the canonical workflow hash
+(``coalescing.workflow_key``), so a request whose instantiated workflow is
+identical to one already generated (same template, prompt, seed, model and
+resolution) is answered from the cache without touching the GPU.
+
+Entries hold the output file references from the completion result and,
+optionally, the output bytes copied into a local directory. Copies are
+streamed to disk in pieces (``save_file``), never held whole. The index is
+a SQLite table; entries expire after ``max_age`` seconds and the least
+recently used ones are evicted beyond ``max_entries`` or ``max_bytes``.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Eviction limits
+MAX_ENTRIES = 5000
+MAX_BYTES = 2 * 1024 ** 3
+MAX_AGE = 24 * 3600
+
+# Submitted prompts remembered until their completion arrives
+PENDING_LIMIT = 10000
+
+
+class ResultCache:
+    """Completed generation results keyed by workflow hash."""
+
+    def __init__(self, path: Optional[str] = None, files_dir: Optional[str] = None,
+                 max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES,
+                 max_age: float = MAX_AGE):
+        self.path = path or ":memory:"
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.files_dir = files_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS generation_results (
+                workflow_key TEXT PRIMARY KEY,
+                prompt_id TEXT,
+                outputs TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+        """)
+        # prompt_id -> (workflow key, batch slot) for submitted, not yet completed prompts
+        self._pending: "OrderedDict[str, List[Tuple[str, Optional[Dict[str, int]]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.files_dir, key[:2], key)
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached response for a workflow key, or None (counts a miss)."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT prompt_id, outputs, created_at FROM generation_results WHERE workflow_key = ?",
+                (key,)
+            ).fetchone()
+            outputs = json.loads(row[1]) if row else None
+            if row and (now - row[2] > self.max_age
+                        or any(o.get("local_path") and not os.path.exists(o["local_path"]) for o in outputs)):
+                self._delete(key)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE generation_results SET used_at = ? WHERE workflow_key = ?", (now, key))
+            self.hits += 1
+        return {
+            "status": "completed",
+            "prompt_id": row[0],
+            "outputs": outputs,
+            "cached": True,
+            "cache_age_seconds": round(now - row[2], 3),
+        }
+
+    def __contains__(self, key: str) -> bool:
+        """True if ``lookup`` would likely hit (counts nothing, touches nothing)."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT created_at FROM generation_results WHERE workflow_key = ?", (key,)
+            ).fetchone()
+        return row is not None and time.time() - row[0] <= self.max_age
+
+    def expect(self, prompt_id: str, key: str, batch: Optional[Dict[str, int]] = None):
+        """Remember which workflow a submitted prompt ran, for ``take``.
+
+        A latent batch may also be expected under the key of one of its
+        images rendered alone; ``batch`` is that image's slot.
+        """
+        with self._lock:
+            self._pending.setdefault(prompt_id, []).append((key, batch))
+            if len(self._pending) > PENDING_LIMIT:
+                self._pending.popitem(last=False)
+
+    def take(self, prompt_id: str) -> List[Tuple[str, Optional[Dict[str, int]]]]:
+        """Workflow keys (with batch slots) of a submitted prompt, once; empty if unknown."""
+        with self._lock:
+            return self._pending.pop(prompt_id, [])
+
+    def file_path(self, key: str, filename: str) -> str:
+        """Where an entry keeps its copy of an output (the directory is created)."""
+        directory = self._entry_dir(key)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, os.path.basename(filename))
+
+    def save_file(self, key: str, filename: str, chunks: Iterable[bytes]) -> str:
+        """Write an output's bytes for ``store`` as they arrive; returns the copy's path."""
+        path = self.file_path(key, filename)
+        partial = path + ".part"
+        try:
+            with open(partial, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(partial, path)
+        except BaseException:
+            self.discard_file(partial)
+            raise
+        return path
+
+    @staticmethod
+    def discard_file(path: str):
+        """Remove a partly written copy."""
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def store(self, key: str, result: Dict[str, Any], files: Optional[Dict[str, str]] = None) -> bool:
+        """Cache a completed result; ``files`` maps output filenames to copies from ``save_file``."""
+        if result.get("status") != "completed" or not result.get("outputs"):
+            return False
+        outputs = [dict(o) for o in result["outputs"]]
+        size = len(json.dumps(outputs))
+        if files and self.files_dir:
+            for output in outputs:
+                local_path = files.get(output["filename"])
+                if local_path is None:
+                    continue
+                output["local_path"] = local_path
+                size += os.path.getsize(local_path)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO generation_results "
+                "(workflow_key, prompt_id, outputs, size, created_at, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, result.get("prompt_id"), json.dumps(outputs), size, now, now)
+            )
+            self._evict(now)
+        return True
+
+    def _delete(self, key: str):
+        self._db.execute("DELETE FROM generation_results WHERE workflow_key = ?", (key,))
+        if self.files_dir:
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        self.evictions += 1
+
+    def _evict(self, now: float):
+        expired = self._db.execute(
+            "SELECT workflow_key FROM generation_results WHERE created_at < ?", (now - self.max_age,)
+        ).fetchall()
+        for (key,) in expired:
+            self._delete(key)
+        count, total = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generation_results"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+            "SELECT workflow_key, size FROM generation_results ORDER BY used_at"
+        ).fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._delete(key)
+            count -= 1
+            total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters and current size."""
+        with self._lock:
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generation_results"
+            ).fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": count,
+                "bytes": total,
+            }
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,345 @@
+"""
+Model-affinity job scheduling
+
+Pending inference jobs are grouped by the models their workflow loads:
+the checkpoint for SDXL images, the UNET/CLIP/VAE set for WAN 2.2 video.
+The scheduler keeps releasing jobs from the group ComfyUI has loaded and
+only switches when that group is drained, so alternating checkpoints do
+not force a multi-GB reload between almost every job.
+
+A fairness bound keeps other groups from starving: after
+``max_group_run`` consecutive jobs from one group, or once another
+group's oldest job has waited ``max_group_wait`` seconds, the group with
+the oldest waiting job goes next.
+
+Affinity only applies within a priority class. The message ``priority``
+(``urgent``, ``high``, ``normal``, ``low``) is honoured first, so urgent
+image requests overtake queued video jobs; every ``priority_aging``
+seconds of waiting lifts a job one class so low priority work still runs.
+
+The scheduler itself is not thread-safe; the dispatcher calls it under
+its own lock.
+"""
+
+import json
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Collection, Deque, Dict, FrozenSet, List, Optional
+
+from .workflows import WorkflowRegistry
+
+# Consecutive jobs from one model group before waiting groups get a turn
+MAX_GROUP_RUN = 8
+
+# Seconds a waiting group may be passed over in favour of the loaded one
+MAX_GROUP_WAIT = 120.0
+
+# Prompts allowed in ComfyUI (submitted, not finished) before jobs are held
+MAX_IN_FLIGHT = 2
+
+# Seconds after which a prompt that never reported completion stops counting as in flight
+IN_FLIGHT_TTL = 3600
+
+# Priority classes, most urgent first; missing or unknown values count as normal
+PRIORITIES = ("urgent", "high", "normal", "low")
+DEFAULT_PRIORITY = "normal"
+
+# Classes allowed to preempt lower-priority prompts waiting in ComfyUI's queue
+PREEMPTING = ("urgent", "high")
+
+# Seconds of waiting that lift a job one priority class
+PRIORITY_AGING = 300.0
+
+# Recent wait times kept per priority class for percentiles
+WAIT_SAMPLES = 1000
+
+# Templates used for each request type when options["workflow"] is absent
+DEFAULT_TEMPLATES = {
+    "image_generation": "image_generation",
+    "video_generation": "video_generation",
+}
+
+DEFAULT_GROUP = "default"
+
+
+def workflow_models(workflow: Dict[str, Any]) -> FrozenSet[str]:
+    """Model files a workflow loads, from its ``*Loader*`` nodes' ``*_name`` inputs."""
+    names = set()
+    for node in workflow.values():
+        if not isinstance(node, dict) or "Loader" not in node.get("class_type", ""):
+            continue
+        for key, value in node.get("inputs", {}).items():
+            if key.endswith("_name") and isinstance(value, str):
+                names.add(value)
+    return frozenset(names)
+
+
+def model_group(workflow: Dict[str, Any]) -> str:
+    """Scheduling group of a workflow: the models it loads."""
+    return "+".join(sorted(workflow_models(workflow))) or DEFAULT_GROUP
+
+
+def message_model_group(message: dict, registry: WorkflowRegistry) -> str:
+    """Model group of an inference request message."""
+    try:
+        content = json.loads(message.get("content", "{}"))
+        request_type = content.get("request_type")
+        options = content.get("options") or {}
+        if request_type == "distributed_inference":
+            workflow = content.get("prompt") or {}
+        else:
+            name = options.get("workflow", DEFAULT_TEMPLATES.get(request_type))
+            if name is None:
+                return DEFAULT_GROUP
+            workflow = registry.get(name).instantiate(content.get("prompt"), options)
+        return model_group(workflow)
+    except Exception:
+        # Bad requests fail later with a proper error response
+        return DEFAULT_GROUP
+
+
+def message_priority(message: dict) -> str:
+    """Priority class of a mesh message (message field, else request content)."""
+    value = message.get("priority")
+    if value is None:
+        try:
+            content = json.loads(message.get("content", "{}"))
+            value = content.get("priority") if isinstance(content, dict) else None
+        except (TypeError, ValueError):
+            value = None
+    value = str(value).lower() if value else DEFAULT_PRIORITY
+    return value if value in PRIORITIES else DEFAULT_PRIORITY
+
+
+def priority_rank(priority: str) -> int:
+    """0 for the most urgent class."""
+    try:
+        return PRIORITIES.index(priority)
+    except ValueError:
+        return PRIORITIES.index(DEFAULT_PRIORITY)
+
+
+def comfyui_queue_ids(queue: Dict[str, Any]) -> set:
+    """Prompt ids running or pending in a ComfyUI ``GET /queue`` response."""
+    ids = set()
+    for key in ("queue_running", "queue_pending"):
+        for item in queue.get(key) or []:
+            # Items are [number, prompt_id, prompt, extra_data, outputs_to_execute]
+            if isinstance(item, list) and len(item) > 1:
+                ids.add(item[1])
+    return ids
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Job:
+    """A pending request waiting for the scheduler to release it."""
+
+    __slots__ = ("item", "request_type", "group", "priority", "enqueued_at", "held")
+
+    def __init__(self, item: Any, request_type: str, group: str, priority: str = DEFAULT_PRIORITY):
+        self.item = item
+        self.request_type = request_type
+        self.group = group
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        # The requester was told it is waiting (a "held" response)
+        self.held = False
+
+
+class JobScheduler:
+    """Pending jobs grouped by model, released with affinity and a fairness bound."""
+
+    def __init__(self, max_group_run: int = MAX_GROUP_RUN, max_group_wait: float = MAX_GROUP_WAIT,
+                 priority_aging: float = PRIORITY_AGING):
+        self.max_group_run = max_group_run
+        self.max_group_wait = max_group_wait
+        self.priority_aging = priority_aging
+        self._groups: "OrderedDict[str, Deque[Job]]" = OrderedDict()
+        self._size = 0
+        self.held = 0
+        self.current_group: Optional[str] = None
+        self._run = 0
+        self._last_arrival_group: Optional[str] = None
+        self.switches = 0
+        self.arrival_switches = 0
+        self.started_at = time.monotonic()
+        self._waits: Dict[str, Deque[float]] = {p: deque(maxlen=WAIT_SAMPLES) for p in PRIORITIES}
+        self._released = dict.fromkeys(PRIORITIES, 0)
+        # on_release(job, wait_seconds, switched_group) for every job pick() hands out
+        self.on_release: Optional[Callable[[Job, float, bool], None]] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def put(self, item: Any, request_type: str, group: str = DEFAULT_GROUP,
+            priority: str = DEFAULT_PRIORITY) -> Job:
+        """Add a job; it waits until ``pick`` releases it."""
+        job = Job(item, request_type, group, priority)
+        self._groups.setdefault(group, deque()).append(job)
+        self._size += 1
+        # What submitting in arrival order would have cost, for comparison
+        if self._last_arrival_group is not None and group != self._last_arrival_group:
+            self.arrival_switches += 1
+        self._last_arrival_group = group
+        return job
+
+    def hold(self, job: Job):
+        """Count a waiting job as held until it is released or removed."""
+        if not job.held:
+            job.held = True
+            self.held += 1
+
+    def _rank(self, job: Job, now: float) -> int:
+        aged = int((now - job.enqueued_at) // self.priority_aging) if self.priority_aging else 0
+        return max(0, priority_rank(job.priority) - aged)
+
+    def _eligible(self, blocked_types: Collection[str], now: float) -> Dict[str, Job]:
+        # Per group, its most urgent (then oldest) job of an unblocked type
+        heads = {}
+        for group, jobs in self._groups.items():
+            best = None
+            for job in jobs:
+                if job.request_type in blocked_types:
+                    continue
+                if best is None or self._rank(job, now) < self._rank(best, now):
+                    best = job
+            if best is not None:
+                heads[group] = best
+        return heads
+
+    def pick(self, blocked_types: Collection[str] = ()) -> Optional[Job]:
+        """Remove and return the next job, skipping request types in ``blocked_types``."""
+        now = time.monotonic()
+        heads = self._eligible(blocked_types, now)
+        if not heads:
+            return None
+        top = min(self._rank(job, now) for job in heads.values())
+        heads = {group: job for group, job in heads.items() if self._rank(job, now) == top}
+        oldest = min(heads.values(), key=lambda j: j.enqueued_at)
+        current = heads.get(self.current_group)
+        if current is None:
+            job = oldest
+        elif now - oldest.enqueued_at > self.max_group_wait:
+            job = oldest
+        elif self._run >= self.max_group_run and len(heads) > 1:
+            job = min((j for g, j in heads.items() if g != self.current_group), key=lambda j: j.enqueued_at)
+        else:
+            job = current
+        self._take(job, now)
+        return job
+
+    def _take(self, job: Job, now: float):
+        jobs = self._groups[job.group]
+        jobs.remove(job)
+        if not jobs:
+            del self._groups[job.group]
+        self._size -= 1
+        if job.held:
+            self.held -= 1
+        wait = now - job.enqueued_at
+        self._waits[job.priority].append(wait)
+        self._released[job.priority] += 1
+        switched = False
+        if job.group == self.current_group:
+            self._run += 1
+        else:
+            if self.current_group is not None:
+                self.switches += 1
+                switched = True
+            self.current_group = job.group
+            self._run = 1
+        if self.on_release:
+            self.on_release(job, wait, switched)
+
+    def remove(self, predicate: Callable[[Any], bool]) -> List[Job]:
+        """Take out every waiting job whose item matches ``predicate``."""
+        removed = []
+        for group in list(self._groups):
+            jobs = self._groups[group]
+            for job in [job for job in jobs if predicate(job.item)]:
+                jobs.remove(job)
+                removed.append(job)
+            if not jobs:
+                del self._groups[group]
+        self._size -= len(removed)
+        self.held -= sum(1 for job in removed if job.held)
+        return removed
+
+    def wait_times(self) -> Dict[str, Dict[str, float]]:
+        """Local queue wait per priority class over recent releases (seconds)."""
+        report = {}
+        for priority in PRIORITIES:
+            samples = sorted(self._waits[priority])
+            if not samples:
+                continue
+            report[priority] = {
+                "released": self._released[priority],
+                "mean": round(sum(samples) / len(samples), 3),
+                "p50": round(_percentile(samples, 0.5), 3),
+                "p95": round(_percentile(samples, 0.95), 3),
+                "max": round(samples[-1], 3),
+            }
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        """Pending jobs, model switches (actual vs arrival order) and wait times."""
+        hours = max(time.monotonic() - self.started_at, 1.0) / 3600
+        by_priority = dict.fromkeys(PRIORITIES, 0)
+        for jobs in self._groups.values():
+            for job in jobs:
+                by_priority[job.priority] += 1
+        return {
+            "pending": self._size,
+            "held": self.held,
+            "pending_by_priority": by_priority,
+            "groups": {group: len(jobs) for group, jobs in self._groups.items()},
+            "current_group": self.current_group,
+            "model_switches": self.switches,
+            "model_switches_per_hour": round(self.switches / hours, 2),
+            "arrival_order_switches": self.arrival_switches,
+            "arrival_order_switches_per_hour": round(self.arrival_switches / hours, 2),
+            "wait_seconds": self.wait_times(),
+        }
+
+
+class InFlight:
+    """Prompts queued on ComfyUI and not yet finished, with their priority.
+
+    Not thread-safe; callers hold their own lock.
+    """
+
+    def __init__(self, ttl: float = IN_FLIGHT_TTL):
+        self.ttl = ttl
+        # prompt_id -> (submitted_at, priority)
+        self._prompts: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        now = time.monotonic()
+        for prompt_id, (submitted_at, _) in list(self._prompts.items()):
+            if now - submitted_at > self.ttl:
+                del self._prompts[prompt_id]
+        return len(self._prompts)
+
+    def add(self, prompt_id: str, priority: str = DEFAULT_PRIORITY):
+        if prompt_id not in self._prompts:
+            self._prompts[prompt_id] = (time.monotonic(), priority)
+
+    def submitted_since(self, since: float) -> int:
+        """Prompts added at or after monotonic time ``since``."""
+        return sum(1 for submitted_at, _ in self._prompts.values() if submitted_at >= since)
+
+    def discard(self, prompt_id: str) -> bool:
+        return self._prompts.pop(prompt_id, None) is not None
+
+    def victim(self, priority: str, exclude: Collection[str] = ()) -> Optional[str]:
+        """Lowest-priority, most recently queued prompt below ``priority``."""
+        rank = priority_rank(priority)
+        candidates = [
+            (priority_rank(p), submitted_at, prompt_id)
+            for prompt_id, (submitted_at, p) in self._prompts.items()
+            if priority_rank(p) > rank and prompt_id not in exclude
+        ]
+        return max(candidates)[2] if candidates else None
@@ -0,0 +1,730 @@
+"""
+In-process stub servers for benchmarks and load tests
+
+``StubMesh`` implements the Agent Mesh endpoints the agents call
+(register, inbox fetch and read acks, broadcast, message send, heartbeat,
+health and file upload) plus groups, group broadcast and group memory
+writes for the load generator. It stores messages in memory; ``/api/broadcast`` is only
+counted, not fanned out.
+
+``StubComfyUI`` implements ComfyUI's ``/api/prompt``, ``/queue``,
+``/history``, ``/system_stats``, ``/view``, ``/distributed/queue`` and the
+``/ws`` event stream. Simulated GPUs run queued prompts for a
+configurable time and emit the same execution events as ComfyUI.
+
+File bodies are streamed both ways: ``/view`` writes the output in
+chunks and the stub mesh decodes uploads as they arrive, keeping only
+their size and SHA-256, so large outputs do not inflate the process.
+
+Both run on ``ThreadingHTTPServer`` with no extra dependencies and
+account for the CPU their own threads use (``cpu_seconds``). A benchmark
+can then subtract the stubs' CPU from the process total to get the
+agent's share.
+"""
+
+import base64
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Default simulated GPU time per prompt (seconds)
+JOB_SECONDS = 0.05
+
+# Piece size for streamed bodies (a multiple of 32, the output pattern period)
+STREAM_CHUNK = 64 * 1024
+
+GIB = 1024 ** 3
+
+
+class CpuMeter:
+    """CPU seconds used by the threads that report to it."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.seconds += seconds
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so the agents' pooled sessions are exercised like in production
+    protocol_version = "HTTP/1.1"
+    stub: Any = None
+
+    def log_message(self, *args):
+        pass
+
+    def handle_one_request(self):
+        started = time.thread_time()
+        try:
+            super().handle_one_request()
+        finally:
+            self.stub.cpu.add(time.thread_time() - started)
+
+    def _body(self) -> Any:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    def _body_chunks(self):
+        """Raw request body in pieces, with a Content-Length or chunked encoding."""
+        if "chunked" not in (self.headers.get("Transfer-Encoding") or "").lower():
+            remaining = int(self.headers.get("Content-Length") or 0)
+            while remaining:
+                data = self.rfile.read(min(remaining, STREAM_CHUNK))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+            return
+        while True:
+            size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+            if not size:
+                # Trailers end with an empty line
+                while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            while size:
+                data = self.rfile.read(min(size, STREAM_CHUNK))
+                if not data:
+                    return
+                size -= len(data)
+                yield data
+            self.rfile.readline()
+
+    def _send_stream(self, chunks, length: int, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    def _send(self, body: Any, status: int = 200, content_type: str = "application/json",
+              headers: Optional[Dict[str, str]] = None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _Stub:
+    handler = _Handler
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.cpu = CpuMeter()
+        self._server: Optional[_StubServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self._server.server_port}"
+
+    def start(self) -> str:
+        """Serve from a daemon thread; returns the base URL."""
+        handler = type(f"{type(self).__name__}Handler", (self.handler,), {"stub": self})
+        self._server = _StubServer((self.host, self.port), handler)
+        threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _mesh_time(at: float) -> str:
+    # The mesh stores SQLite CURRENT_TIMESTAMP: UTC, second resolution
+    return datetime.fromtimestamp(at, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class _MeshHandler(_Handler):
+    def do_GET(self):
+        path = urlparse(self.path)
+        parts = path.path.strip("/").split("/")
+        if path.path == "/health":
+            return self._send({"status": "ok"})
+        if len(parts) == 3 and parts[:2] == ["api", "messages"]:
+            query = {k: v[0] for k, v in parse_qs(path.query).items()}
+            wait = float(query.get("wait") or 0)
+            rows = self.stub.inbox(parts[2], query.get("since"), query.get("unreadOnly") == "true", wait)
+            return self._send(rows, headers={"X-Long-Poll": "30"} if wait else None)
+        self._send({"error": "not found"}, 404)
+
+    def do_POST(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        stub = self.stub
+        if parts == ["api", "files", "upload"]:
+            stored = stub.upload(self._body_chunks())
+            if stored is None:
+                return self._send({"error": "agentId, filename, and fileData are required"}, 400)
+            return self._send({"success": True, "fileId": stored["id"], "url": f"/api/files/{stored['id']}",
+                               "filename": stored["filename"], "fileSize": stored["size"]})
+        body = self._body()
+        if parts == ["api", "agents", "register"]:
+            return self._send({"success": True, "agentId": stub.register(body.get("name", ""))})
+        if len(parts) == 4 and parts[:2] == ["api", "agents"] and parts[3] in ("heartbeat", "health"):
+            stub.count(parts[3])
+            return self._send({"success": True})
+        if parts == ["api", "broadcast"]:
+            stub.count("broadcast")
+            return self._send({"success": True})
+        if parts == ["api", "messages"]:
+            message_id = stub.deliver(body.get("to"), body.get("content", ""), body.get("from"))
+            return self._send({"success": True, "messageId": message_id})
+        if len(parts) == 4 and parts[:2] == ["api", "messages"] and parts[3] == "read":
+            stub.mark_read(parts[2])
+            return self._send({"success": True})
+        if parts == ["api", "groups"]:
+            return self._send({"success": True, "groupId": stub.create_group(body.get("name", ""))})
+        if len(parts) == 4 and parts[:2] == ["api", "groups"]:
+            return self._group_post(parts[2], parts[3], body)
+        self._send({"error": "not found"}, 404)
+
+    def _group_post(self, group_id: str, action: str, body: Dict[str, Any]):
+        stub = self.stub
+        if group_id not in stub.groups:
+            return self._send({"error": "Group not found"}, 404)
+        if action == "members":
+            if not stub.join_group(group_id, body.get("agentId")):
+                return self._send({"error": "Agent is already a member of this group"}, 409)
+            return self._send({"success": True})
+        if action == "broadcast":
+            ids = stub.group_broadcast(group_id, body.get("from"), body.get("content", ""))
+            if not ids:
+                return self._send({"error": "No agents found in group"}, 404)
+            return self._send({"success": True, "recipientCount": len(ids), "messageIds": ids})
+        if action == "memory":
+            version = stub.remember(group_id, body.get("agentId"), body.get("key"), body.get("value"))
+            if version is None:
+                return self._send({"error": "Agent is not a member of this group"}, 403)
+            return self._send({"success": True, "version": version})
+        self._send({"error": "not found"}, 404)
+
+
+class StubMesh(_Stub):
+    """Agent Mesh stand-in with an in-memory message store.
+
+    ``on_message(message)`` is called for every message delivered to a
+    recipient that is not a registered agent (the synthetic requesters),
+    with ``received_at`` set to the delivery time.
+    """
+
+    handler = _MeshHandler
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 on_message: Optional[Callable[[Dict[str, Any]], None]] = None):
+        super().__init__(host, port)
+        self.on_message = on_message
+        self.agents: Dict[str, str] = {}
+        self._messages: Dict[str, Dict[str, Any]] = {}
+        # recipient -> unread message ids, oldest first
+        self._unread: Dict[str, Deque[str]] = {}
+        self._lock = threading.Lock()
+        # Wakes long-poll inbox reads when a message is stored
+        self._arrived = threading.Condition(self._lock)
+        self.counts: Dict[str, int] = {}
+        # group id -> member agent ids, and (group id, key) -> memory version
+        self.groups: Dict[str, set] = {}
+        self._memory: Dict[tuple, int] = {}
+        # file id -> upload metadata with decoded size and sha256 (bytes are not kept)
+        self.files: Dict[str, Dict[str, Any]] = {}
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def register(self, name: str) -> str:
+        """Agent id for ``name``; re-registering keeps it, like the mesh."""
+        with self._lock:
+            self.counts["register"] = self.counts.get("register", 0) + 1
+            return self.agents.setdefault(name, str(uuid.uuid4()))
+
+    def deliver(self, recipient: Optional[str], content: str, sender: Optional[str] = None) -> str:
+        """Store a message for ``recipient``; returns its id."""
+        now = time.time()
+        message = {
+            "id": str(uuid.uuid4()),
+            "from_agent": sender,
+            "to_agent": recipient,
+            "content": content,
+            "message_type": "direct",
+            "read": 0,
+            "created_at": _mesh_time(now),
+            "received_at": now,
+        }
+        with self._lock:
+            self.counts["messages"] = self.counts.get("messages", 0) + 1
+            agent = recipient in self.agents.values()
+            if agent:
+                self._messages[message["id"]] = message
+                self._unread.setdefault(recipient, deque()).append(message["id"])
+                self._arrived.notify_all()
+        if not agent and self.on_message:
+            self.on_message(message)
+        return message["id"]
+
+    def upload(self, chunks) -> Optional[Dict[str, Any]]:
+        """Consume a streamed ``/api/files/upload`` JSON body; None if malformed.
+
+        Expects ``fileData`` as the last field, as the agents send it.
+        """
+        marker = b'"fileData":"'
+        head, carry, size, digest = b"", b"", 0, hashlib.sha256()
+        found = closed = False
+        for chunk in chunks:
+            if closed:
+                continue
+            if not found:
+                head += chunk
+                if marker not in head:
+                    continue
+                head, _, chunk = head.partition(marker)
+                found = True
+            end = chunk.find(b'"')
+            if end >= 0:
+                chunk, closed = chunk[:end], True
+            data = carry + chunk
+            cut = len(data) - len(data) % 4
+            carry = data[cut:]
+            decoded = base64.b64decode(data[:cut])
+            size += len(decoded)
+            digest.update(decoded)
+        if not closed or carry:
+            return None
+        try:
+            fields = json.loads(head.rstrip(b",") + b"}")
+        except ValueError:
+            return None
+        if not fields.get("agentId") or not fields.get("filename"):
+            return None
+        stored = {"id": str(uuid.uuid4()), "agentId": fields["agentId"], "filename": fields["filename"],
+                  "fileType": fields.get("fileType"), "size": size, "sha256": digest.hexdigest()}
+        with self._lock:
+            self.counts["files"] = self.counts.get("files", 0) + 1
+            self.files[stored["id"]] = stored
+        return stored
+
+    def create_group(self, name: str) -> str:
+        with self._lock:
+            self.counts["group_create"] = self.counts.get("group_create", 0) + 1
+            group_id = str(uuid.uuid4())
+            self.groups[group_id] = set()
+            return group_id
+
+    def join_group(self, group_id: str, agent_id: Optional[str]) -> bool:
+        """Add a member; False if it already was one."""
+        with self._lock:
+            members = self.groups[group_id]
+            if agent_id in members:
+                return False
+            members.add(agent_id)
+            return True
+
+    def group_broadcast(self, group_id: str, sender: Optional[str], content: str) -> List[str]:
+        """Deliver ``content`` to every other member; returns the message ids."""
+        with self._lock:
+            self.counts["group_broadcast"] = self.counts.get("group_broadcast", 0) + 1
+            members = [m for m in self.groups[group_id] if m != sender]
+        return [self.deliver(member, content, sender) for member in members]
+
+    def remember(self, group_id: str, agent_id: Optional[str], key: Optional[str], value: Any) -> Optional[int]:
+        """Store a group memory key; returns its new version, None for non-members."""
+        with self._lock:
+            if agent_id not in self.groups[group_id]:
+                return None
+            self.counts["memory_write"] = self.counts.get("memory_write", 0) + 1
+            version = self._memory.get((group_id, key), 0) + 1
+            self._memory[(group_id, key)] = version
+            return version
+
+    def inbox(self, agent_id: str, since: Optional[str] = None, unread_only: bool = True,
+              wait: float = 0.0) -> List[Dict[str, Any]]:
+        """``GET /api/messages/:agentId``: newest first, like the mesh.
+
+        Messages marked read are dropped, so every fetch is unread-only.
+        With ``wait`` an empty read is held open (long-poll) for up to that
+        many seconds.
+        """
+        deadline = time.monotonic() + min(wait, 30.0)
+        with self._lock:
+            self.counts["inbox_fetch"] = self.counts.get("inbox_fetch", 0) + 1
+            while True:
+                ids = self._unread.get(agent_id, ())
+                rows = [
+                    {k: v for k, v in self._messages[m].items() if k != "received_at"}
+                    for m in ids
+                    if not since or self._messages[m]["created_at"] > since
+                ]
+                remaining = deadline - time.monotonic()
+                if rows or remaining <= 0:
+                    break
+                self._arrived.wait(remaining)
+        return rows[::-1]
+
+    def mark_read(self, message_id: str):
+        with self._lock:
+            message = self._messages.pop(message_id, None)
+            if message is None:
+                return
+            unread = self._unread.get(message["to_agent"])
+            if unread is not None:
+                try:
+                    unread.remove(message_id)
+                except ValueError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.counts,
+                "unread": sum(len(ids) for ids in self._unread.values()),
+                "cpu_seconds": round(self.cpu.seconds, 3),
+            }
+
+
+class WebSocket:
+    """Server side of one RFC 6455 connection; text frames only."""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.open = True
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def accept_key(key: str) -> str:
+        return base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+
+    def _frame(self, opcode: int, payload: bytes) -> bytes:
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        return header + payload
+
+    def send(self, text: str) -> bool:
+        """Send a text frame; False once the connection is gone."""
+        with self._lock:
+            if not self.open:
+                return False
+            try:
+                self.wfile.write(self._frame(0x1, text.encode()))
+                self.wfile.flush()
+                return True
+            except OSError:
+                self.open = False
+                return False
+
+    def receive(self) -> Optional[bytes]:
+        """Next client frame's payload, answering pings; None on close."""
+        while True:
+            head = self.rfile.read(2)
+            if len(head) < 2:
+                return None
+            opcode, length = head[0] & 0x0F, head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self.rfile.read(8))[0]
+            mask = self.rfile.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+            data = bytes(b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(length)))
+            if opcode == 0x8:
+                with self._lock:
+                    if self.open:
+                        try:
+                            self.wfile.write(self._frame(0x8, data[:2]))
+                            self.wfile.flush()
+                        except OSError:
+                            pass
+                return None
+            if opcode == 0x9:
+                with self._lock:
+                    self.wfile.write(self._frame(0xA, data))
+                    self.wfile.flush()
+                continue
+            return data
+
+    def close(self):
+        with self._lock:
+            self.open = False
+
+
+class _ComfyUIHandler(_Handler):
+    def do_GET(self):
+        path = urlparse(self.path)
+        stub = self.stub
+        if path.path == "/ws":
+            return self._websocket(parse_qs(path.query).get("clientId", [""])[0])
+        if path.path == "/queue":
+            return self._send(stub.queue())
+        if path.path.startswith("/history/"):
+            return self._send(stub.history(path.path[len("/history/"):]))
+        if path.path == "/system_stats":
+            return self._send(stub.system_stats())
+        if path.path == "/view":
+            filename = parse_qs(path.query).get("filename", [""])[0]
+            return self._send_stream(stub.file_chunks(filename), stub.output_bytes, "image/png")
+        self._send({"error": "not found"}, 404)
+
+    def do_POST(self):
+        body = self._body()
+        path = urlparse(self.path).path
+        stub = self.stub
+        if path in ("/api/prompt", "/prompt"):
+            return self._send(stub.submit(body.get("prompt") or {}, body.get("client_id")))
+        if path == "/distributed/queue":
+            return self._send({**stub.submit(body.get("prompt") or {}, body.get("client_id")), "worker_count": 1})
+        if path == "/queue":
+            return self._send(stub.delete(body.get("delete") or [], bool(body.get("clear"))))
+        self._send({"error": "not found"}, 404)
+
+    def _websocket(self, client_id: str):
+        key = self.headers.get("Sec-WebSocket-Key")
+        if not key or "websocket" not in (self.headers.get("Upgrade") or "").lower():
+            return self._send({"error": "expected a websocket upgrade"}, 400)
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", WebSocket.accept_key(key))
+        self.end_headers()
+        self.wfile.flush()
+        ws = WebSocket(self.rfile, self.wfile)
+        self.stub.connect(client_id, ws)
+        try:
+            ws.send(json.dumps({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": 0}},
+                                                         "sid": client_id}}))
+            while ws.receive() is not None:
+                pass
+        except OSError:
+            pass
+        finally:
+            ws.close()
+            self.stub.disconnect(client_id, ws)
+            self.close_connection = True
+
+
+class StubComfyUI(_Stub):
+    """ComfyUI stand-in whose simulated GPUs run prompts for ``job_seconds``.
+
+    Each prompt takes ``job_seconds`` scaled by a uniform factor within
+    ``±jitter``; ``failure_rate`` of them end in ``execution_error``.
+    """
+
+    handler = _ComfyUIHandler
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, job_seconds: float = JOB_SECONDS,
+                 jitter: float = 0.0, gpus: int = 1, failure_rate: float = 0.0, output_bytes: int = 1024,
+                 vram_gb: float = 16.0):
+        super().__init__(host, port)
+        self.job_seconds = job_seconds
+        self.jitter = jitter
+        self.gpus = gpus
+        self.failure_rate = failure_rate
+        self.output_bytes = output_bytes
+        self.vram_gb = vram_gb
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._running: Dict[str, Dict[str, Any]] = {}
+        self._history: Dict[str, Dict[str, Any]] = {}
+        self._clients: Dict[str, List[WebSocket]] = {}
+        self._number = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._workers: List[threading.Thread] = []
+        self.submitted = 0
+        self.completed = 0
+        self.deleted = 0
+
+    def start(self) -> str:
+        url = super().start()
+        self._stopped = False
+        self._workers = [
+            threading.Thread(target=self._gpu, args=(i,), name=f"stub-gpu-{i}", daemon=True) for i in range(self.gpus)
+        ]
+        for worker in self._workers:
+            worker.start()
+        return url
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        with self._cond:
+            clients = [ws for sockets in self._clients.values() for ws in sockets]
+        for ws in clients:
+            ws.close()
+        super().stop()
+
+    def connect(self, client_id: str, ws: WebSocket):
+        with self._cond:
+            self._clients.setdefault(client_id, []).append(ws)
+
+    def disconnect(self, client_id: str, ws: WebSocket):
+        with self._cond:
+            sockets = self._clients.get(client_id, [])
+            if ws in sockets:
+                sockets.remove(ws)
+
+    def _emit(self, client_id: Optional[str], kind: str, data: Dict[str, Any]):
+        with self._cond:
+            sockets = list(self._clients.get(client_id, ()))
+        text = json.dumps({"type": kind, "data": data})
+        for ws in sockets:
+            ws.send(text)
+
+    def submit(self, prompt: Dict[str, Any], client_id: Optional[str]) -> Dict[str, Any]:
+        with self._cond:
+            self._number += 1
+            job = {"number": self._number, "prompt_id": str(uuid.uuid4()), "prompt": prompt, "client_id": client_id}
+            self._pending.append(job)
+            self.submitted += 1
+            self._cond.notify()
+        return {"prompt_id": job["prompt_id"], "number": job["number"], "node_errors": {}}
+
+    @staticmethod
+    def _item(job: Dict[str, Any]) -> list:
+        # [number, prompt_id, prompt, extra_data, outputs_to_execute]; the prompt is left out for speed
+        return [job["number"], job["prompt_id"], {}, {"client_id": job["client_id"]}, []]
+
+    def queue(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queue_running": [self._item(job) for job in self._running.values()],
+                "queue_pending": [self._item(job) for job in self._pending],
+            }
+
+    def delete(self, prompt_ids: List[str], clear: bool = False) -> Dict[str, Any]:
+        with self._cond:
+            before = len(self._pending)
+            if clear:
+                self._pending.clear()
+            else:
+                self._pending = deque(job for job in self._pending if job["prompt_id"] not in prompt_ids)
+            self.deleted += before - len(self._pending)
+        return {}
+
+    def history(self, prompt_id: str) -> Dict[str, Any]:
+        with self._cond:
+            entry = self._history.get(prompt_id)
+        return {prompt_id: entry} if entry else {}
+
+    def system_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            busy = len(self._running)
+        total = int(self.vram_gb * GIB)
+        return {
+            "system": {"os": "stub", "comfyui_version": "stub"},
+            "devices": [
+                {"name": f"cuda:{i} Stub GPU", "type": "cuda", "index": i, "vram_total": total,
+                 "vram_free": total // 4 if i < busy else total - GIB}
+                for i in range(self.gpus)
+            ],
+        }
+
+    def file_bytes(self, filename: str) -> bytes:
+        """Deterministic stand-in image of ``output_bytes`` bytes."""
+        seed = hashlib.sha256(filename.encode()).digest()
+        return (b"\x89PNG\r\n\x1a\n" + seed * (self.output_bytes // len(seed) + 1))[:self.output_bytes]
+
+    def file_chunks(self, filename: str):
+        """``file_bytes`` in ``STREAM_CHUNK`` pieces, without building it whole."""
+        seed = hashlib.sha256(filename.encode()).digest()
+        header = b"\x89PNG\r\n\x1a\n"
+        block = seed * (STREAM_CHUNK // len(seed))
+        remaining = self.output_bytes
+        piece = header[:remaining]
+        yield piece
+        remaining -= len(piece)
+        while remaining > 0:
+            piece = block[:remaining]
+            yield piece
+            remaining -= len(piece)
+
+    def _duration(self) -> float:
+        if not self.jitter:
+            return self.job_seconds
+        return max(0.0, self.job_seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _gpu(self, index: int):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                job = self._pending.popleft()
+                self._running[job["prompt_id"]] = job
+            started = time.thread_time()
+            self._run(job)
+            self.cpu.add(time.thread_time() - started)
+
+    def _run(self, job: Dict[str, Any]):
+        prompt_id, client = job["prompt_id"], job["client_id"]
+        self._emit(client, "execution_start", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)})
+        self._emit(client, "executing", {"node": "3", "display_node": "3", "prompt_id": prompt_id})
+        time.sleep(self._duration())
+        failed = random.random() < self.failure_rate
+        images = [] if failed else [{"filename": f"{prompt_id[:8]}_00001_.png", "subfolder": "", "type": "output"}]
+        if images:
+            self._emit(client, "executed", {"node": "9", "display_node": "9",
+                                            "output": {"images": images}, "prompt_id": prompt_id})
+        with self._cond:
+            self._running.pop(prompt_id, None)
+            self._history[prompt_id] = {
+                "prompt": [job["number"], prompt_id, {}, {}, []],
+                "outputs": {"9": {"images": images}} if images else {},
+                "status": {"status_str": "error" if failed else "success", "completed": not failed, "messages": []},
+            }
+            self.completed += 1
+        if failed:
+            self._emit(client, "execution_error", {"prompt_id": prompt_id, "exception_message": "simulated failure"})
+        else:
+            self._emit(client, "execution_success", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)})
+            self._emit(client, "executing", {"node": None, "prompt_id": prompt_id})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "deleted": self.deleted,
+                "pending": len(self._pending),
+                "running": len(self._running),
+                "cpu_seconds": round(self.cpu.seconds, 3),
+            }
@@ -0,0 +1,431 @@
+"""
+Per-request stage tracing
+
+Every inference request gets a trace: a root span from the time the mesh
+stored the message to the agent's final reply, with child spans for each
+stage in between:
+
+- ``mesh_delivery``: mesh ``created_at`` until the agent received the
+  message (the poll gap)
+- ``local_queue``: waiting in the agent's scheduler
+- ``workflow_build`` and ``comfyui_submit``
+- ``comfyui_queue`` and ``comfyui_execute``, from ComfyUI's execution
+  events (a single ``comfyui_total`` when completions are polled)
+- ``response_send``: once per reply sent
+
+The trace id is taken from the request (``"trace_id"``, or a W3C
+``"traceparent"`` whose span becomes the root's parent) or generated. It
+is returned as ``"trace_id"`` in every ``inference_response``.
+
+Stages that run deep inside the agent find their trace through a context
+variable. That variable is per thread for the threaded agent and per task
+for the asyncio one. Finished traces are handed to an exporter on a
+background thread: ``JsonlSpanExporter`` appends to a local file and
+``OtlpSpanExporter`` posts OTLP/HTTP JSON to a collector.
+``run_collector`` is a stand-in collector that writes what it receives
+to JSON lines.
+"""
+
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+# Default OTLP/HTTP traces endpoint (a local collector)
+OTLP_URL = "http://localhost:4318/v1/traces"
+
+# Traces kept open at once; the oldest is exported unfinished past this
+MAX_ACTIVE_TRACES = 10000
+
+# Finished traces waiting for the exporter before new ones are dropped
+EXPORT_QUEUE_SIZE = 10000
+
+# Replies that leave the request open; queued ones too while completions are tracked
+PENDING_STATUSES = ("held", "preempted")
+QUEUED_STATUSES = ("queued", "distributed_queued")
+
+_current: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("comfyui_mesh_trace", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return uuid.uuid4().hex[:nbytes * 2]
+
+
+def _is_hex(value: Any, length: int) -> bool:
+    if not isinstance(value, str) or len(value) != length:
+        return False
+    try:
+        int(value, 16)
+    except ValueError:
+        return False
+    return value.strip("0") != ""
+
+
+def incoming_context(content: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """Trace id and parent span id carried by a request's content, if any."""
+    parts = str(content.get("traceparent") or "").split("-")
+    if len(parts) == 4 and _is_hex(parts[1], 32) and _is_hex(parts[2], 16):
+        return parts[1].lower(), parts[2].lower()
+    trace_id = content.get("trace_id")
+    return (trace_id.lower(), None) if _is_hex(trace_id, 32) else (None, None)
+
+
+def mesh_timestamp(message: dict) -> Optional[float]:
+    """Unix time the mesh stored a message (``created_at``, UTC), or None."""
+    value = message.get("created_at")
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        stamp = datetime.fromisoformat(value.replace("Z", "+00:00").replace(" ", "T"))
+    except ValueError:
+        return None
+    if stamp.tzinfo is None:
+        # SQLite CURRENT_TIMESTAMP is UTC without a zone
+        stamp = stamp.replace(tzinfo=timezone.utc)
+    return stamp.timestamp()
+
+
+def reply_is_final(response: Dict[str, Any], tracked: bool) -> bool:
+    """True if no further reply follows this one for the same request."""
+    if "error" in response:
+        return True
+    status = response.get("status")
+    if status in PENDING_STATUSES:
+        return False
+    if status in QUEUED_STATUSES:
+        return not tracked
+    return True
+
+
+class Trace:
+    """Spans of one request; safe to add to from several threads."""
+
+    def __init__(self, trace_id: str, parent_span_id: Optional[str], started_at: float,
+                 received_at: float, attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_span_id = parent_span_id
+        self.started_at = started_at
+        self.received_at = received_at
+        self.attributes = attributes
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, end: float, **attributes) -> Dict[str, Any]:
+        """Record a finished child span (unix times in seconds)."""
+        span = {
+            "trace_id": self.trace_id,
+            "span_id": _new_id(8),
+            "parent_span_id": self.span_id,
+            "name": name,
+            "start": start,
+            "end": max(start, end),
+            "attributes": attributes,
+        }
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def finish(self, end: float, **attributes) -> List[Dict[str, Any]]:
+        """Close the root span; returns every span, root first."""
+        root = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": "inference_request",
+            "start": self.started_at,
+            "end": max(self.started_at, end),
+            "attributes": {**self.attributes, **attributes},
+        }
+        with self._lock:
+            return [root] + sorted(self.spans, key=lambda s: s["start"])
+
+
+class JsonlSpanExporter:
+    """Appends spans to a local JSON-lines file, one span per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, spans: List[Dict[str, Any]]):
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(span, default=str) + "\n" for span in spans))
+
+    def close(self):
+        pass
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(spans: List[Dict[str, Any]], service_name: str) -> Dict[str, Any]:
+    """OTLP/HTTP JSON ``ExportTraceServiceRequest`` body for spans."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "integrations.tracing"},
+                "spans": [
+                    {
+                        "traceId": span["trace_id"],
+                        "spanId": span["span_id"],
+                        **({"parentSpanId": span["parent_span_id"]} if span["parent_span_id"] else {}),
+                        "name": span["name"],
+                        "kind": 1,
+                        "startTimeUnixNano": str(int(span["start"] * 1e9)),
+                        "endTimeUnixNano": str(int(span["end"] * 1e9)),
+                        "attributes": [
+                            {"key": key, "value": _otlp_value(value)}
+                            for key, value in span["attributes"].items()
+                            if value is not None
+                        ],
+                    }
+                    for span in spans
+                ],
+            }],
+        }]
+    }
+
+
+class OtlpSpanExporter:
+    """Posts spans as OTLP/HTTP JSON to a collector."""
+
+    def __init__(self, url: str = OTLP_URL, service_name: str = "comfyui-mesh-agent", timeout: float = 5):
+        self.url = url
+        self.service_name = service_name
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def export(self, spans: List[Dict[str, Any]]):
+        resp = self._session.post(self.url, json=otlp_payload(spans, self.service_name), timeout=self.timeout)
+        resp.raise_for_status()
+
+    def close(self):
+        self._session.close()
+
+
+class Tracer:
+    """Open traces by message, plus a background exporter for finished ones.
+
+    With no exporter, traces are still kept and trace ids still returned;
+    finished spans are dropped.
+    """
+
+    def __init__(self, exporter=None, max_active: int = MAX_ACTIVE_TRACES):
+        self.exporter = exporter
+        self.max_active = max_active
+        # message key -> open Trace
+        self._traces: "OrderedDict[Any, Trace]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._worker: Optional[threading.Thread] = None
+        self.started = 0
+        self.finished = 0
+        self.exported = 0
+        self.export_errors = 0
+        self.dropped = 0
+
+    @staticmethod
+    def _key(message: dict) -> Any:
+        return message.get("id") or id(message)
+
+    def begin(self, message: dict, received_at: Optional[float] = None) -> Optional[Trace]:
+        """Open (or return) the trace for a just received ``inference_request``.
+
+        Returns None for any other message.
+        """
+        key = self._key(message)
+        with self._lock:
+            trace = self._traces.get(key)
+            if trace is not None:
+                return trace
+        try:
+            content = json.loads(message.get("content", "{}"))
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(content, dict) or content.get("type") != "inference_request":
+            return None
+        received_at = received_at or time.time()
+        trace_id, parent = incoming_context(content)
+        created_at = mesh_timestamp(message)
+        # Second resolution on the mesh side; never start after receipt
+        started_at = min(created_at, received_at) if created_at else received_at
+        trace = Trace(trace_id or _new_id(16), parent, started_at, received_at, {
+            "message.id": message.get("id"),
+            "message.sender": message.get("sender"),
+        })
+        if created_at:
+            trace.add("mesh_delivery", started_at, received_at)
+        evicted = None
+        with self._lock:
+            self._traces[key] = trace
+            self.started += 1
+            if len(self._traces) > self.max_active:
+                _, evicted = self._traces.popitem(last=False)
+        if evicted is not None:
+            self._export(evicted.finish(time.time(), incomplete=True))
+        return trace
+
+    def get(self, message: dict) -> Optional[Trace]:
+        with self._lock:
+            return self._traces.get(self._key(message))
+
+    def finish(self, message: dict, **attributes):
+        """Close a request's trace and queue it for export."""
+        with self._lock:
+            trace = self._traces.pop(self._key(message), None)
+            if trace is None:
+                return
+            self.finished += 1
+        self._export(trace.finish(time.time(), **attributes))
+
+    @contextmanager
+    def activate(self, trace: Optional[Trace]) -> Iterator[Optional[Trace]]:
+        """Make ``trace`` current for spans recorded in this thread or task."""
+        token = _current.set(trace)
+        try:
+            yield trace
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Dict[str, Any]]]:
+        """Time a block into the current trace; a no-op outside one."""
+        trace = _current.get()
+        if trace is None:
+            yield None
+            return
+        start = time.time()
+        try:
+            yield attributes
+        finally:
+            trace.add(name, start, time.time(), **attributes)
+
+    def record_completion(self, message: dict, result: Dict[str, Any]):
+        """Add ComfyUI queue and execution spans from a completion result's timings."""
+        trace = self.get(message)
+        timings = result.get("timings") or {}
+        if trace is None:
+            return
+        finished = time.time()
+        prompt_id = result.get("prompt_id")
+        if "run_seconds" not in timings:
+            # Polled /history only tells submission to completion
+            if "total_seconds" in timings:
+                trace.add("comfyui_total", finished - timings["total_seconds"], finished,
+                          prompt_id=prompt_id, status=result.get("status"))
+            return
+        started = finished - timings["run_seconds"]
+        submitted = started - timings.get("queued_seconds", 0.0)
+        trace.add("comfyui_queue", submitted, started, prompt_id=prompt_id)
+        trace.add("comfyui_execute", started, finished, prompt_id=prompt_id, status=result.get("status"))
+
+    def _export(self, spans: List[Dict[str, Any]]):
+        if self.exporter is None:
+            return
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._export_loop, name="trace-export", daemon=True)
+                self._worker.start()
+
+    def _export_loop(self):
+        while True:
+            spans = self._queue.get()
+            try:
+                if spans is None:
+                    return
+                self.exporter.export(spans)
+                with self._lock:
+                    self.exported += 1
+            except Exception as e:
+                with self._lock:
+                    self.export_errors += 1
+                print(f"Trace export failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait until every queued trace has been exported."""
+        if self._worker is not None:
+            self._queue.join()
+
+    def close(self):
+        """Export what is queued, then stop the exporter."""
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._queue.put(None)
+            worker.join(timeout=10)
+        if self.exporter is not None:
+            self.exporter.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "active": len(self._traces),
+                "started": self.started,
+                "finished": self.finished,
+                "exported": self.exported,
+                "export_errors": self.export_errors,
+                "dropped": self.dropped,
+            }
+
+
+def run_collector(port: int = 4318, path: str = "spans.jsonl", host: str = "127.0.0.1"):
+    """Stand-in OTLP/HTTP JSON collector: writes received spans to JSON lines."""
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self.send_error(400)
+                return
+            lines = []
+            for resource in payload.get("resourceSpans", []):
+                for scope in resource.get("scopeSpans", []):
+                    lines += [json.dumps(span) + "\n" for span in scope.get("spans", [])]
+            with lock, open(path, "a") as f:
+                f.write("".join(lines))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Trace collector on http://{host}:{server.server_port}/v1/traces -> {path}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    run_collector()
@@ -0,0 +1,186 @@
+"""
+Pooled HTTP transport for mesh integrations
+
+One ``requests.Session`` per upstream (the mesh API and ComfyUI), each with
+its own keep-alive connection pool, so repeated calls reuse TCP connections
+instead of opening a new one per request. Idempotent calls are retried with
+jittered exponential backoff. Mesh calls go through the transport's
+``mesh_breaker``; ComfyUI calls pass their backend's breaker.
+
+Usage:
+    from integrations.transport import PooledTransport
+
+    transport = PooledTransport(mesh_headers={"X-API-Key": key})
+    resp = transport.mesh_get("http://localhost:4000/api/agents")
+    print(transport.stats())
+"""
+
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .breaker import CircuitBreaker
+
+# Connection pool sizing (pool_maxsize is per host)
+MESH_POOL_CONNECTIONS = 2
+MESH_POOL_MAXSIZE = 8
+COMFYUI_POOL_CONNECTIONS = 4
+COMFYUI_POOL_MAXSIZE = 16
+
+# Retry policy for idempotent calls
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.25
+BACKOFF_MAX = 5.0
+RETRY_STATUSES = frozenset({502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+class CountingAdapter(HTTPAdapter):
+    """HTTPAdapter that remembers connection counts of pools it discards."""
+
+    def __init__(self, *args, **kwargs):
+        self.retired_connections = 0
+        self.retired_requests = 0
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        pools = self.poolmanager.pools
+        dispose = pools.dispose_func
+
+        def _retire(pool):
+            self.retired_connections += pool.num_connections
+            self.retired_requests += pool.num_requests
+            if dispose:
+                dispose(pool)
+
+        pools.dispose_func = _retire
+
+    def connection_counts(self) -> Dict[str, int]:
+        """Return connections opened and requests sent through this adapter."""
+        opened = self.retired_connections
+        sent = self.retired_requests
+        pools = self.poolmanager.pools
+        with pools.lock:
+            live = list(pools._container.values())
+        for pool in live:
+            opened += pool.num_connections
+            sent += pool.num_requests
+        return {"new_connections": opened, "requests": sent}
+
+
+class PooledTransport:
+    """Keep-alive sessions for the mesh API and ComfyUI with retry and stats."""
+
+    def __init__(
+        self,
+        mesh_headers: Optional[Dict[str, str]] = None,
+        mesh_pool_connections: int = MESH_POOL_CONNECTIONS,
+        mesh_pool_maxsize: int = MESH_POOL_MAXSIZE,
+        comfyui_pool_connections: int = COMFYUI_POOL_CONNECTIONS,
+        comfyui_pool_maxsize: int = COMFYUI_POOL_MAXSIZE,
+        max_retries: int = MAX_RETRIES,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_max: float = BACKOFF_MAX,
+        mesh_breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.mesh = self._session(mesh_pool_connections, mesh_pool_maxsize, mesh_headers)
+        self.comfyui = self._session(comfyui_pool_connections, comfyui_pool_maxsize)
+        self._lock = threading.Lock()
+        self._retries = {"mesh": 0, "comfyui": 0}
+        self.mesh_breaker = mesh_breaker or CircuitBreaker("mesh")
+
+    @staticmethod
+    def _session(pool_connections: int, pool_maxsize: int, headers: Optional[Dict[str, str]] = None) -> requests.Session:
+        session = requests.Session()
+        adapter = CountingAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Connection"] = "keep-alive"
+        if headers:
+            session.headers.update(headers)
+        return session
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, base * 2^attempt], capped
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, target: str, method: str, url: str, idempotent: Optional[bool] = None,
+                breaker: Optional[CircuitBreaker] = None, probe: bool = False, **kwargs) -> requests.Response:
+        """Send a request through the ``mesh`` or ``comfyui`` session.
+
+        Idempotent calls (by default GET/HEAD/OPTIONS/PUT/DELETE) are retried
+        on connection errors, timeouts and 502/503/504 responses. The outcome
+        is recorded on ``breaker`` (the mesh breaker for mesh calls); while it
+        is open the call raises ``CircuitOpenError`` unless it is a ``probe``.
+        """
+        session = self.mesh if target == "mesh" else self.comfyui
+        if breaker is None and target == "mesh":
+            breaker = self.mesh_breaker
+        if breaker is not None and not probe:
+            breaker.check()
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = self.max_retries + 1 if idempotent else 1
+
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                resp = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if last:
+                    if breaker is not None:
+                        breaker.record_failure()
+                    raise
+            else:
+                if last or resp.status_code not in RETRY_STATUSES:
+                    if breaker is not None:
+                        breaker.record_status(resp.status_code)
+                    return resp
+                resp.close()
+            with self._lock:
+                self._retries[target] += 1
+            time.sleep(self._backoff(attempt))
+
+    def mesh_get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("mesh", "GET", url, **kwargs)
+
+    def mesh_post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("mesh", "POST", url, **kwargs)
+
+    def comfyui_get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("comfyui", "GET", url, **kwargs)
+
+    def comfyui_post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("comfyui", "POST", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Connection reuse counters per upstream.
+
+        ``reused_connections`` is the number of requests that went out on an
+        already-open keep-alive connection.
+        """
+        result = {}
+        for target, session in (("mesh", self.mesh), ("comfyui", self.comfyui)):
+            counts = {"new_connections": 0, "requests": 0}
+            adapters = {id(a): a for a in session.adapters.values() if isinstance(a, CountingAdapter)}
+            for adapter in adapters.values():
+                for key, value in adapter.connection_counts().items():
+                    counts[key] += value
+            counts["reused_connections"] = max(0, counts["requests"] - counts["new_connections"])
+            counts["retries"] = self._retries[target]
+            result[target] = counts
+        return result
+
+    def close(self):
+        """Close both sessions and their pooled connections."""
+        self.mesh.close()
+        self.comfyui.close()
@@ -20,9 +20,14 @@ const __dirname = dirname(__filename);
 const app = express();
 const PORT = process.env.PORT || 4000;
 const API_KEY = process.env.AGENT_MESH_API_KEY || 'openclaw-mesh-default-key';
+// Largest upload body. Files arrive base64-encoded (4/3 of their size) and the
+// whole body is parsed in memory, so 128 MB caps a file near 96 MB.
+const FILE_UPLOAD_LIMIT = process.env.AGENT_MESH_UPLOAD_LIMIT || '128mb';
 
 // Middleware
 app.use(cors());
+// Uploads get their own parser so the small default limit still applies elsewhere
+app.use('/api/files/upload', express.json({ limit: FILE_UPLOAD_LIMIT }));
 app.use(express.json());
 
 // Optional: Serve the Web UI build (webui/dist)
@@ -344,6 +349,40 @@ app.post('/api/agents/:id/heartbeat', requireApiKey, async (req, res) => {
 
 // === MESSAGING ===
 
+// Long-poll inbox reads: agentId -> Set of wake callbacks
+const LONG_POLL_MAX_SECONDS = 30;
+const inboxWaiters = new Map();
+
+function notifyInbox(agentId) {
+  const waiters = inboxWaiters.get(agentId);
+  if (!waiters) return;
+  inboxWaiters.delete(agentId);
+  for (const wake of waiters) wake();
+}
+
+// Resolves when a message arrives for agentId or after ms; cancel() releases it early
+function waitForInbox(agentId, ms) {
+  let waiters = inboxWaiters.get(agentId);
+  if (!waiters) {
+    waiters = new Set();
+    inboxWaiters.set(agentId, waiters);
+  }
+  let wake;
+  const promise = new Promise(resolve => {
+    const timer = setTimeout(() => wake(), ms);
+    wake = () => {
+      clearTimeout(timer);
+      waiters.delete(wake);
+      if (waiters.size === 0 && inboxWaiters.get(agentId) === waiters) {
+        inboxWaiters.delete(agentId);
+      }
+      resolve();
+    };
+  });
+  waiters.add(wake);
+  return { promise, cancel: wake };
+}
+
 // Send message
 app.post('/api/messages', requireApiKey, async (req, res) => {
   try {
@@ -358,6 +397,7 @@ app.post('/api/messages', requireApiKey, async (req, res) => {
       'INSERT INTO messages (id, from_agent, to_agent, content, message_type) VALUES (?, ?, ?, ?, ?)',
       [id, from, to, content, messageType]
     );
+    notifyInbox(to);
     
     const message = { id, from, to, content, messageType, createdAt: new Date().toISOString() };
     
@@ -377,7 +417,7 @@ app.post('/api/messages', requireApiKey, async (req, res) => {
 // Get messages for agent
 app.get('/api/messages/:agentId', requireApiKey, async (req, res) => {
   try {
-    const { since, unreadOnly } = req.query;
+    const { since, unreadOnly, wait } = req.query;
     
     let query = 'SELECT * FROM messages WHERE to_agent = ?';
     const params = [req.params.agentId];
@@ -393,7 +433,22 @@ app.get('/api/messages/:agentId', requireApiKey, async (req, res) => {
     
     query += ' ORDER BY created_at DESC';
     
-    const messages = await db.all(query, params);
+    // wait=<seconds>: hold an empty read open until a message arrives
+    const waitSeconds = Math.min(parseFloat(wait) || 0, LONG_POLL_MAX_SECONDS);
+    if (waitSeconds <= 0) {
+      return res.json(await db.all(query, params));
+    }
+    res.set('X-Long-Poll', String(LONG_POLL_MAX_SECONDS));
+    // Registered before the first read so a message stored in between still wakes us
+    const waiter = waitForInbox(req.params.agentId, waitSeconds * 1000);
+    res.on('close', waiter.cancel);
+    let messages = await db.all(query, params);
+    if (messages.length === 0) {
+      await waiter.promise;
+      messages = await db.all(query, params);
+    } else {
+      waiter.cancel();
+    }
     res.json(messages);
   } catch (error) {
     res.status(500).json({ error: error.message });
@@ -429,6 +484,7 @@ app.post('/api/broadcast', requireApiKey, async (req, res) => {
         'INSERT INTO messages (id, from_agent, to_agent, content, message_type) VALUES (?, ?, ?, ?, ?)',
         [id, from, agent.id, content, 'broadcast']
       );
+      notifyInbox(agent.id);
       messageIds.push(id);
     }
     
@@ -511,6 +567,7 @@ app.post('/api/skills/:id/invoke', requireApiKey, async (req, res) => {
       'INSERT INTO messages (id, from_agent, to_agent, content, message_type) VALUES (?, ?, ?, ?, ?)',
       [messageId, from, skill.agent_id, content, 'skill_invocation']
     );
+    notifyInbox(skill.agent_id);
 
     broadcast({
       type: 'skill_invoked',
@@ -755,6 +812,7 @@ app.post('/api/groups/:groupId/broadcast', requireApiKey, async (req, res) => {
         'INSERT INTO messages (id, from_agent, to_agent, content, message_type, status) VALUES (?, ?, ?, ?, ?, ?)',
         [id, from, agent.agent_id, content, messageType, 'delivered']
       );
+      notifyInbox(agent.agent_id);
       messageIds.push(id);
     }
 
@@ -1075,7 +1133,7 @@ app.post('/api/files/upload', requireApiKey, async (req, res) => {
     }
 
     const id = uuidv4();
-    const fileSize = Buffer.from(fileData, 'base64').length;
+    const fileSize = Buffer.byteLength(fileData, 'base64');
 
     await db.run(
       'INSERT INTO agent_files (id, agent_id, filename, file_type, file_size, file_data, description) VALUES (?, ?, ?, ?, ?, ?, ?)',
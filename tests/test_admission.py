@@ -0,0 +1,115 @@
+"""Admission control holds work once ComfyUI's sampled queue is deep enough."""
+
+import json
+import threading
+import time
+
+import requests
+
+from integrations.admission import AdmissionController, free_vram_fraction, queue_depth
+from integrations.backends import Backend, BackendPool
+from integrations.comfyui_integration import ComfyUIMeshAgent
+from integrations.dispatcher import InferenceDispatcher
+from integrations.inbox import InboxCursor
+from integrations.journal import JobJournal
+from integrations.ledger import MessageLedger
+from integrations.result_cache import ResultCache
+from integrations.scheduler import InFlight
+from integrations.stubs import StubComfyUI
+from integrations.workflows import default_registry
+
+GIB = 1024 ** 3
+
+
+def _queue(running=0, pending=0):
+    return {"queue_running": [[i, f"r-{i}"] for i in range(running)],
+            "queue_pending": [[i, f"p-{i}"] for i in range(pending)]}
+
+
+def _stats(free_gb, total_gb=16):
+    return {"devices": [{"vram_total": total_gb * GIB, "vram_free": free_gb * GIB}]}
+
+
+def test_sample_parsing():
+    assert queue_depth(_queue(1, 2)) == 3
+    assert free_vram_fraction({"devices": [{"vram_total": 8, "vram_free": 4}, {"vram_total": 8, "vram_free": 2}]}) == 0.25
+    assert free_vram_fraction({}) is None
+
+
+def test_admits_up_to_the_target_depth():
+    admission = AdmissionController(target_depth=2)
+    in_flight = InFlight()
+    admission.update(_queue(running=1), _stats(8))
+    assert admission.admit(in_flight)
+    assert not admission.admit(in_flight, ahead=1)
+
+    # Prompts submitted since the sample count too
+    in_flight.add("p-new")
+    assert not admission.admit(in_flight)
+    assert admission.estimate_start(0, in_flight) == 2 * admission.run_seconds
+
+
+def test_low_vram_only_feeds_an_idle_gpu():
+    admission = AdmissionController(target_depth=4, min_free_vram=0.1)
+    admission.update(_queue(), _stats(1))
+    assert admission.free_slots(InFlight()) == 1
+    admission.update(_queue(running=1), _stats(1))
+    assert admission.free_slots(InFlight()) == 0
+
+
+def test_stale_samples_fall_back_to_local_counts():
+    admission = AdmissionController(target_depth=1, stale_after=0)
+    admission.update(_queue(pending=5), _stats(8), sampled_at=time.monotonic() - 1)
+    assert admission.admit(InFlight())
+    assert admission.update(None, None) is None
+    assert admission.stats()["sample_errors"] == 1
+
+
+def test_run_time_estimate_follows_completions():
+    admission = AdmissionController()
+    before = admission.run_seconds
+    admission.observe(before + 10)
+    assert before < admission.run_seconds < before + 10
+    admission.observe(0)
+    assert admission.stats()["run_seconds_estimate"] == round(admission.run_seconds, 2)
+
+
+def test_agent_samples_the_stub_comfyui(tmp_path):
+    with StubComfyUI(job_seconds=5, gpus=1) as comfyui:
+        body = default_registry().get("image_generation").request_body({}, {})
+        for _ in range(3):
+            assert requests.post(f"{comfyui.url}/api/prompt", data=body).status_code == 200
+        backend = Backend(comfyui.url, name="default")
+        agent = ComfyUIMeshAgent(
+            agent_name="admission-test", inbox=InboxCursor(str(tmp_path / "inbox.json")),
+            ledger=MessageLedger(str(tmp_path / "ledger.db")), results=ResultCache(), journal=JobJournal(),
+            backends=BackendPool([backend]), track_completions=False, use_websocket=False,
+        )
+        agent._sample_backend(backend)
+        stats = backend.admission.stats()
+        assert stats["comfyui_queue_depth"] == 3
+        assert stats["free_vram"] == 0.25
+        assert stats["gpus"][0]["vram_total_mb"] == 16 * 1024
+        assert not backend.admission.admit(backend.in_flight)
+        agent.transport.close()
+
+
+def test_held_requests_are_told_when_they_start_and_run_once_admitted():
+    admission = AdmissionController(target_depth=1)
+    admission.update(_queue(running=1), _stats(8))
+    held, handled = [], threading.Event()
+    dispatcher = InferenceDispatcher(handler=lambda message: handled.set(), reject=lambda *_: None,
+                                     admission=admission, hold=lambda message, response: held.append(response))
+    content = json.dumps({"type": "inference_request", "request_type": "image_generation"})
+    assert dispatcher.submit({"id": "m-1", "content": content})
+
+    assert held[0]["status"] == "held"
+    assert held[0]["position"] == 0
+    assert held[0]["estimated_start_seconds"] == admission.run_seconds
+    assert not handled.wait(0.2)
+
+    # ComfyUI drained: the next sample releases the job
+    admission.update(_queue(), _stats(8))
+    dispatcher.poke()
+    assert handled.wait(5)
+    dispatcher.shutdown()
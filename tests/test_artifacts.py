@@ -0,0 +1,140 @@
+"""Artifact store: byte ranges, HTTP serving, deduplication and eviction."""
+
+import hashlib
+import os
+import time
+
+import pytest
+import requests
+
+from integrations.artifacts import ArtifactServer, ArtifactStore, byte_range
+
+DATA = b"0123456789"
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=2-4", (2, 4)),
+    ("bytes=-3", (7, 9)),
+    ("bytes=7-", (7, 9)),
+    ("bytes=5-99", (5, 9)),
+    ("bytes=-99", (0, 9)),
+    # Multi-range and malformed headers get the whole file
+    ("bytes=0-1,4-5", None),
+    ("items=0-1", None),
+])
+def test_byte_range(header, expected):
+    assert byte_range(header, len(DATA)) == expected
+
+
+@pytest.mark.parametrize("header, size", [("bytes=10-", 10), ("bytes=4-2", 10), ("bytes=-0", 10), ("bytes=-3", 0)])
+def test_unsatisfiable_byte_range(header, size):
+    with pytest.raises(ValueError):
+        byte_range(header, size)
+
+
+@pytest.fixture
+def served(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    server = ArtifactServer(store)
+    server.start()
+    yield store, server
+    server.stop()
+    store.close()
+
+
+def test_server_answers_whole_files_and_ranges(served):
+    store, server = served
+    url = server.url_for(store.add_stream([DATA[:4], DATA[4:]], "video/mp4"))
+
+    resp = requests.get(url)
+    assert resp.status_code == 200
+    assert resp.content == DATA
+    assert resp.headers["Content-Type"] == "video/mp4"
+    assert resp.headers["Accept-Ranges"] == "bytes"
+
+    for header, body in (("bytes=2-4", b"234"), ("bytes=-3", b"789"), ("bytes=7-", b"789")):
+        resp = requests.get(url, headers={"Range": header})
+        assert resp.status_code == 206
+        assert resp.content == body
+        start = DATA.index(body)
+        assert resp.headers["Content-Range"] == f"bytes {start}-{start + len(body) - 1}/10"
+
+    resp = requests.get(url, headers={"Range": "bytes=10-"})
+    assert resp.status_code == 416
+    assert resp.headers["Content-Range"] == "bytes */10"
+
+    resp = requests.head(url)
+    assert resp.status_code == 200
+    assert resp.headers["Content-Length"] == "10"
+    assert resp.content == b""
+
+
+def test_server_handles_empty_files_and_unknown_digests(served):
+    store, server = served
+    url = server.url_for(store.add_stream([]))
+
+    resp = requests.get(url)
+    assert resp.status_code == 200
+    assert resp.content == b""
+    assert resp.headers["Content-Length"] == "0"
+    assert requests.get(url, headers={"Range": "bytes=0-"}).status_code == 416
+
+    assert requests.get(server.url_for("0" * 64)).status_code == 404
+    assert requests.get(f"{server.url}/artifacts/not-a-digest").status_code == 404
+
+
+def test_server_revalidates_with_etag(served):
+    store, server = served
+    digest = store.add_stream([DATA])
+    resp = requests.get(server.url_for(digest))
+    assert resp.headers["ETag"] == f'"{digest}"'
+    assert "immutable" in resp.headers["Cache-Control"]
+
+    resp = requests.get(server.url_for(digest), headers={"If-None-Match": resp.headers["ETag"]})
+    assert resp.status_code == 304
+    assert resp.content == b""
+
+
+def test_local_files_are_hard_linked_once(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    output = tmp_path / "output" / "mesh_00001_.png"
+    output.parent.mkdir()
+    output.write_bytes(DATA)
+
+    digest = store.add_file(str(output))
+    assert digest == hashlib.sha256(DATA).hexdigest()
+    assert os.path.samefile(store.path(digest), output)
+    assert store.get(digest)["content_type"] == "image/png"
+
+    # The same bytes again, by path or by stream, are not stored twice
+    copy = tmp_path / "output" / "mesh_00002_.png"
+    copy.write_bytes(DATA)
+    assert store.add_file(str(copy)) == digest
+    assert store.add_stream([DATA]) == digest
+    stats = store.stats()
+    assert (stats["artifacts"], stats["added"], stats["linked"], stats["deduplicated"]) == (1, 1, 1, 2)
+
+    named = tmp_path / "named" / "bison.png"
+    assert store.link(digest, str(named))
+    assert os.path.samefile(named, output)
+    store.close()
+
+
+def test_least_recently_used_objects_are_evicted(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"), max_bytes=25)
+    first = store.add_stream([b"a" * 10])
+    time.sleep(0.01)
+    second = store.add_stream([b"b" * 10])
+    time.sleep(0.01)
+    # Using the first object makes the second the oldest
+    assert store.get(first) is not None
+    time.sleep(0.01)
+
+    third = store.add_stream([b"c" * 10])
+    assert first in store and third in store
+    assert second not in store
+    assert not os.path.exists(store.path(second))
+    assert store.stats()["evictions"] == 1
+    assert store.stats()["bytes"] == 20
+    store.close()
@@ -0,0 +1,17 @@
+"""Prompts the pool forgets give their backend slot back."""
+
+from integrations import backends as backends_module
+from integrations.backends import Backend, BackendPool
+
+
+def test_evicted_prompt_releases_its_slot(monkeypatch):
+    monkeypatch.setattr(backends_module, "PROMPTS_LIMIT", 2)
+    backend = Backend("http://127.0.0.1:8188", name="gpu")
+    pool = BackendPool([backend])
+    for prompt_id in ("p-1", "p-2", "p-3"):
+        pool.assign(prompt_id, pool.choose({}))
+
+    assert pool.backend_for("p-1") is None
+    assert len(backend.in_flight) == 2
+    assert pool.finish("p-3") is backend
+    assert len(backend.in_flight) == 1
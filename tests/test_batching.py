@@ -0,0 +1,57 @@
+"""Latent batches: sized to the image_generation type limit, reused by duplicates."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from integrations.backends import Backend, BackendPool
+from integrations.batching import batch_limit
+from integrations.comfyui_integration import ComfyUIMeshAgent
+from integrations.inbox import InboxCursor
+from integrations.journal import JobJournal
+from integrations.ledger import MessageLedger
+from integrations.result_cache import ResultCache
+from integrations.stubs import StubComfyUI
+
+PROMPT = {"positive": "american bison in mountain meadow"}
+
+
+def test_batch_limit_follows_the_type_limit():
+    assert batch_limit(None, 4) == 4
+    assert batch_limit(8, 4) == 4
+    assert batch_limit(2, 4) == 2
+
+
+def test_agent_batches_up_to_its_image_limit(tmp_path):
+    agent = ComfyUIMeshAgent(agent_name="batch-test", inbox=InboxCursor(str(tmp_path / "inbox.json")),
+                             ledger=MessageLedger(str(tmp_path / "ledger.db")), results=ResultCache(),
+                             journal=JobJournal(), type_limits={"image_generation": 6}, use_websocket=False)
+    assert agent.batcher.max_batch == 6
+    agent.transport.close()
+
+
+def test_duplicates_reuse_a_batch_instead_of_starting_one(tmp_path):
+    with StubComfyUI() as comfyui:
+        backend = Backend(comfyui.url, name="default")
+        agent = ComfyUIMeshAgent(
+            agent_name="batch-test", inbox=InboxCursor(str(tmp_path / "inbox.json")),
+            ledger=MessageLedger(str(tmp_path / "ledger.db")), results=ResultCache(), journal=JobJournal(),
+            backends=BackendPool([backend]), batch_window=0.5, track_completions=False, use_websocket=False,
+        )
+        with ThreadPoolExecutor(2) as pool:
+            first, second = pool.map(lambda _: agent.generate_image(PROMPT, {}), range(2))
+        prompt_id = first["prompt_id"]
+        assert second["prompt_id"] == prompt_id
+        assert {first["batch"]["index"], second["batch"]["index"]} == {0, 1}
+
+        # While the batch runs, the same request joins its first image
+        late = agent.generate_image(PROMPT, {})
+        assert late["prompt_id"] == prompt_id and late["coalesced"]
+        assert late["batch"] == {"size": 2, "index": 0}
+
+        # Once it finished, the first image is served from the result cache
+        outputs = [{"filename": f"{prompt_id}_{i:05}_.png", "subfolder": "", "type": "output"} for i in (1, 2)]
+        agent.coalescer.complete(prompt_id)
+        agent._cache_result({"status": "completed", "prompt_id": prompt_id, "outputs": outputs}, backend)
+        cached = agent.generate_image(PROMPT, {})
+        assert cached["cached"] and cached["outputs"] == outputs[:1]
+        assert agent.batcher.stats()["batch_sizes"] == {2: 1}
+        agent.transport.close()
@@ -0,0 +1,20 @@
+"""Only a half-open probe closes a breaker."""
+
+from integrations.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def test_success_while_open_is_ignored():
+    breaker = CircuitBreaker("comfyui", failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    # A slow call that left before the trip
+    breaker.record_success()
+    assert breaker.state == OPEN
+    assert breaker.stats()["consecutive_failures"] == 2
+
+    assert breaker.probe_due()
+    assert breaker.state == HALF_OPEN
+    breaker.record_status(200)
+    assert breaker.state == CLOSED
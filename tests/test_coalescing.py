@@ -0,0 +1,83 @@
+"""Identical requests share one flight and one ComfyUI prompt."""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from integrations.backends import Backend, BackendPool
+from integrations.coalescing import AsyncSingleFlight, SingleFlight, workflow_key
+from integrations.comfyui_integration import ComfyUIMeshAgent
+from integrations.inbox import InboxCursor
+from integrations.journal import JobJournal
+from integrations.ledger import MessageLedger
+from integrations.result_cache import ResultCache
+from integrations.stubs import StubComfyUI
+
+
+def test_workflow_key_is_canonical():
+    assert workflow_key({"b": 1, "a": [1, 2]}) == workflow_key('{"a":[1,2],"b":1}')
+    assert workflow_key({"a": 1}) != workflow_key({"a": 2})
+
+
+def test_followers_get_the_leaders_prompt():
+    flights = SingleFlight()
+    flight, leader = flights.begin("k")
+    assert leader
+    joined = []
+    follower = threading.Thread(target=lambda: joined.append(flights.wait(flights.begin("k")[0], timeout=5)))
+    follower.start()
+    flights.resolve(flight, {"status": "queued", "prompt_id": "p-1"})
+    follower.join()
+
+    assert joined == [{"status": "queued", "prompt_id": "p-1", "coalesced": True}]
+    assert flights.in_flight("k")
+    flights.complete("p-1", run_seconds=3.0)
+    assert not flights.in_flight("k")
+    assert flights.stats() == {"hits": 1, "misses": 1, "in_flight": 0, "gpu_seconds_saved": 3.0}
+
+
+def test_failed_submission_lets_followers_submit_themselves():
+    flights = SingleFlight()
+    flight, _ = flights.begin("k")
+    follower, leader = flights.begin("k")
+    assert not leader
+    flights.resolve(flight, {"error": "ComfyUI error: 500"})
+    assert flights.wait(follower, timeout=1) is None
+    # The next request leads a new flight
+    assert flights.begin("k")[1]
+
+
+def test_expired_flights_are_not_joined():
+    flights = SingleFlight(ttl=0)
+    flight, _ = flights.begin("k")
+    flights.resolve(flight, {"status": "queued", "prompt_id": "p-1"})
+    assert flights.begin("k")[1]
+
+
+def test_async_followers_wait_on_the_loop():
+    async def main():
+        flights = AsyncSingleFlight()
+        flight, _ = flights.begin("k")
+        follower = asyncio.ensure_future(flights.wait(flights.begin("k")[0], timeout=5))
+        await asyncio.sleep(0)
+        flights.resolve(flight, {"status": "queued", "prompt_id": "p-1"})
+        return await follower
+
+    assert asyncio.run(main())["prompt_id"] == "p-1"
+
+
+def test_agent_submits_identical_requests_once(tmp_path):
+    with StubComfyUI(job_seconds=5) as comfyui:
+        agent = ComfyUIMeshAgent(
+            agent_name="coalesce-test", inbox=InboxCursor(str(tmp_path / "inbox.json")),
+            ledger=MessageLedger(str(tmp_path / "ledger.db")), results=ResultCache(), journal=JobJournal(),
+            backends=BackendPool([Backend(comfyui.url, name="default")]),
+            track_completions=False, use_websocket=False,
+        )
+        with ThreadPoolExecutor(3) as pool:
+            responses = list(pool.map(lambda _: agent.generate_video({"positive": "bison"}, {"seed": 7}), range(3)))
+        assert len({r["prompt_id"] for r in responses}) == 1
+        assert sum(bool(r.get("coalesced")) for r in responses) == 2
+        assert comfyui.submitted == 1
+        assert agent.coalescer.stats()["hits"] == 2
+        agent.transport.close()
@@ -0,0 +1,95 @@
+"""Completion tracking: silent sockets are dropped, and /history goes through the breaker."""
+
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from integrations.backends import Backend, BackendPool
+from integrations.breaker import CircuitOpenError
+from integrations.inbox import InboxCursor
+from integrations.journal import JobJournal
+from integrations.ledger import MessageLedger
+from integrations.result_cache import ResultCache
+from integrations.stubs import StubComfyUI, WebSocket
+
+pytest.importorskip("websocket")
+from integrations.completion import CompletionTracker  # noqa: E402
+
+
+class SilentComfyUI:
+    """Accepts the WebSocket upgrade, then never sends or answers a frame."""
+
+    def __init__(self):
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}"
+        self.dropped = threading.Event()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        conn, _ = self.sock.accept()
+        with conn:
+            request = b""
+            while b"\r\n\r\n" not in request:
+                request += conn.recv(4096)
+            key = next(line.split(b":", 1)[1].strip().decode() for line in request.split(b"\r\n")
+                       if line.lower().startswith(b"sec-websocket-key"))
+            conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         b"Sec-WebSocket-Accept: " + WebSocket.accept_key(key).encode() + b"\r\n\r\n")
+            # Read (and ignore) pings until the client gives up on us
+            while conn.recv(4096):
+                pass
+        self.dropped.set()
+
+
+def test_silent_socket_is_reconciled_and_reopened():
+    comfyui = SilentComfyUI()
+    checked = []
+    completed = []
+
+    def fetch_history(prompt_id):
+        checked.append(prompt_id)
+        return {"status": {"completed": True}, "outputs": {}} if len(checked) > 1 else None
+
+    tracker = CompletionTracker(comfyui.url, lambda context, result: completed.append(result),
+                                fetch_history=fetch_history, recv_timeout=0.2)
+    tracker.watch("p-1", "ctx")
+    tracker.start()
+    try:
+        # Dropped after a ping goes unanswered, instead of waiting forever
+        assert comfyui.dropped.wait(5)
+    finally:
+        tracker.stop()
+    # Checked on connect, and again when the socket went quiet
+    assert checked == ["p-1", "p-1"]
+    assert [r["status"] for r in completed] == ["completed"]
+
+
+def test_async_tracker_checks_history_through_the_breaker(tmp_path):
+    pytest.importorskip("httpx")
+    from integrations.comfyui_async import AsyncComfyUIMeshAgent
+
+    with StubComfyUI() as comfyui:
+        backend = Backend(comfyui.url, name="default")
+        agent = AsyncComfyUIMeshAgent(
+            agent_name="tracker-test", inbox=InboxCursor(str(tmp_path / "inbox.json")),
+            ledger=MessageLedger(str(tmp_path / "ledger.db")), results=ResultCache(), journal=JobJournal(),
+            backends=BackendPool([backend]),
+        )
+
+        async def main():
+            await agent.open()
+            agent._loop = asyncio.get_running_loop()
+            try:
+                # The tracker thread asks through the agent's client...
+                assert await asyncio.to_thread(backend.tracker.fetch_history, "unknown") is None
+                for _ in range(backend.breaker.failure_threshold):
+                    backend.breaker.record_failure()
+                # ...and fails fast once the backend's breaker is open
+                with pytest.raises(CircuitOpenError):
+                    await asyncio.to_thread(backend.tracker.fetch_history, "unknown")
+            finally:
+                await agent.close()
+
+        asyncio.run(main())
@@ -0,0 +1,63 @@
+"""Publishing outputs: size cap, reuse and one upload per output."""
+
+import asyncio
+
+from integrations.delivery import MAX_BYTES, MESH_UPLOAD_LIMIT, OutputPublisher, upload_body, upload_fields
+
+RESULT = {"status": "completed", "prompt_id": "p-1", "outputs": [{"filename": "clip.mp4", "type": "output"}]}
+
+
+def test_largest_output_fits_the_mesh_upload_limit():
+    fields = upload_fields("agent-id", "p-1", {"filename": "clip.mp4"})
+    body_size = sum(len(part) for part in upload_body(fields, []))
+    # base64 turns every 3 bytes into 4
+    assert MAX_BYTES % 3 == 0
+    assert body_size + MAX_BYTES // 3 * 4 <= MESH_UPLOAD_LIMIT
+
+
+def test_oversized_output_is_skipped():
+    publisher = OutputPublisher()
+
+    def upload(output):
+        publisher.check_size(MAX_BYTES + 1)
+
+    output = publisher.publish(RESULT, upload)["outputs"][0]
+    # The requester is told the cap, and the output keeps its ComfyUI reference
+    assert str(MAX_BYTES) in output["publish_error"]
+    assert output["publish_limit"] == MAX_BYTES
+    assert output["filename"] == "clip.mp4"
+    assert publisher.stats()["skipped"] == 1
+    assert publisher.stats()["failed"] == 0
+
+
+def test_reused_outputs_leave_no_locks_behind():
+    publisher = OutputPublisher()
+    uploads = []
+
+    def upload(output):
+        uploads.append(output["filename"])
+        return {"file_id": "f-1", "url": "/api/files/f-1", "size": 3}
+
+    for _ in range(3):
+        assert publisher.publish(RESULT, upload)["outputs"][0]["file_id"] == "f-1"
+    assert uploads == ["clip.mp4"]
+    assert publisher.stats()["reused"] == 2
+    assert publisher._locks == {}
+
+
+def test_concurrent_async_requesters_share_one_upload():
+    publisher = OutputPublisher()
+    uploads = []
+
+    async def upload(output):
+        uploads.append(output["filename"])
+        await asyncio.sleep(0.01)
+        return {"file_id": "f-1", "url": "/api/files/f-1", "size": 3}
+
+    async def main():
+        return await asyncio.gather(*(publisher.publish_async(RESULT, upload) for _ in range(4)))
+
+    results = asyncio.run(main())
+    assert [r["outputs"][0]["file_id"] for r in results] == ["f-1"] * 4
+    assert uploads == ["clip.mp4"]
+    assert publisher._async_locks == {}
@@ -0,0 +1,170 @@
+"""Messages the ledger already finished are acknowledged and leave the journal."""
+
+import asyncio
+import json
+
+import pytest
+
+from integrations.comfyui_integration import ComfyUIMeshAgent
+from integrations.inbox import InboxCursor
+from integrations.journal import JobJournal
+from integrations.ledger import REPLIED, MessageLedger
+from integrations.result_cache import ResultCache
+from integrations.stubs import StubMesh
+
+REQUEST = json.dumps({"type": "inference_request", "request_type": "image_generation", "prompt": {}})
+
+
+def _agent(cls, tmp_path, ledger, **options):
+    return cls(
+        agent_name="ledger-test",
+        inbox=InboxCursor(str(tmp_path / "inbox.json")),
+        ledger=ledger,
+        results=ResultCache(),
+        journal=JobJournal(),
+        track_completions=False,
+        **options
+    )
+
+
+def test_finished_message_is_acked_and_not_fetched_again(tmp_path):
+    ledger = MessageLedger(str(tmp_path / "ledger.db"))
+    with StubMesh() as mesh:
+        agent = _agent(ComfyUIMeshAgent, tmp_path, ledger, use_websocket=False)
+        agent.mesh_url = mesh.url
+        assert agent.register_with_mesh()
+        message_id = mesh.deliver(agent.mesh_agent_id, REQUEST, sender="requester")
+        # Replied to by an earlier run whose read ack never reached the mesh
+        ledger.begin(message_id)
+        ledger.finish(message_id, REPLIED)
+
+        assert agent.poll_once() == 1
+        assert agent.flush_acks() == 1
+        assert message_id not in agent.inbox.query_params().get("since", "")
+        assert agent.inbox._inflight == {}
+
+        # The mesh no longer lists it, and nothing is waiting to be acked
+        assert agent.poll_once() == 0
+        assert agent.inbox.take_acks() == []
+        agent.transport.close()
+
+
+def test_async_claim_acks_finished_message(tmp_path):
+    comfyui_async = pytest.importorskip("integrations.comfyui_async")
+    ledger = MessageLedger(str(tmp_path / "ledger.db"))
+    agent = _agent(comfyui_async.AsyncComfyUIMeshAgent, tmp_path, ledger)
+    message = {"id": "m-1", "created_at": "2026-01-01 00:00:00", "content": REQUEST}
+    ledger.begin("m-1")
+    ledger.finish("m-1", REPLIED)
+
+    # Polled twice before the ack is flushed: claimed (and acked) once
+    for _ in range(2):
+        for msg in agent.inbox.accept([message]):
+            assert not agent._claim_message(msg)
+    assert agent.inbox.take_acks() == ["m-1"]
+    agent.inbox.acked(["m-1"])
+    assert agent.inbox._inflight == {}
+    asyncio.run(agent.close())
+
+
+def _finished_journal_entry(tmp_path):
+    ledger = MessageLedger(str(tmp_path / "ledger.db"))
+    journal = JobJournal(str(tmp_path / "journal.log"))
+    # Replied to, but the run died before the journal recorded it
+    journal.wait(journal.received({"id": "m-1", "sender": "requester", "content": REQUEST}))
+    journal.close()
+    ledger.begin("m-1")
+    ledger.finish("m-1", REPLIED)
+    return ledger
+
+
+def test_recovery_drops_journal_entries_the_ledger_finished(tmp_path):
+    ledger = _finished_journal_entry(tmp_path)
+    agent = _agent(ComfyUIMeshAgent, tmp_path, ledger, use_websocket=False)
+    agent.journal = JobJournal(str(tmp_path / "journal.log"))
+
+    assert agent.recover_jobs() == 1
+    agent.journal.close()
+    assert JobJournal(str(tmp_path / "journal.log")).open_jobs() == []
+    agent.transport.close()
+
+
+def test_async_recovery_drops_journal_entries_the_ledger_finished(tmp_path):
+    comfyui_async = pytest.importorskip("integrations.comfyui_async")
+    ledger = _finished_journal_entry(tmp_path)
+    agent = _agent(comfyui_async.AsyncComfyUIMeshAgent, tmp_path, ledger)
+    agent.journal = JobJournal(str(tmp_path / "journal.log"))
+
+    assert asyncio.run(agent.recover_jobs()) == 1
+    agent.journal.close()
+    assert JobJournal(str(tmp_path / "journal.log")).open_jobs() == []
+    asyncio.run(agent.close())
+
+
+def _failing_once(replies):
+    def send_response(message, response):
+        replies.append(response)
+        return len(replies) > 1
+    return send_response
+
+
+def test_unsent_reply_is_retried_not_acked(tmp_path):
+    ledger = MessageLedger(str(tmp_path / "ledger.db"))
+    with StubMesh() as mesh:
+        agent = _agent(ComfyUIMeshAgent, tmp_path, ledger, use_websocket=False, concurrent=False)
+        agent.mesh_url = mesh.url
+        assert agent.register_with_mesh()
+        message_id = mesh.deliver(agent.mesh_agent_id, REQUEST, sender="requester")
+        submitted, replies = [], []
+        agent.process_inference_request = lambda message: submitted.append(message) or {"status": "queued"}
+        agent.send_response = _failing_once(replies)
+
+        # The mesh refused the reply: handed back for the next fetch, not acked
+        assert agent.poll_once() == 1
+        assert agent.inbox.take_acks() == []
+        assert agent.inbox.retry_pending()
+
+        # Fetched again and answered from the ledger, without resubmitting
+        assert agent.poll_once() == 1
+        assert len(submitted) == 1 and len(replies) == 2
+        assert agent.inbox.take_acks() == [message_id]
+        assert ledger.finished(message_id)
+        agent.transport.close()
+
+
+def test_async_unsent_reply_is_retried_not_acked(tmp_path):
+    comfyui_async = pytest.importorskip("integrations.comfyui_async")
+    ledger = MessageLedger(str(tmp_path / "ledger.db"))
+    agent = _agent(comfyui_async.AsyncComfyUIMeshAgent, tmp_path, ledger)
+    message = {"id": "m-1", "created_at": "2026-01-01 00:00:00", "content": REQUEST}
+    replies = []
+    send_response = _failing_once(replies)
+
+    async def fake_send(msg, response):
+        return send_response(msg, response)
+
+    agent.send_response = fake_send
+
+    async def reply(msg):
+        await agent._replies.put((msg, {"status": "queued"}, True, None))
+        await agent._replies.join()
+
+    async def main():
+        agent._replies = asyncio.Queue()
+        worker = asyncio.create_task(agent._reply_worker())
+        [msg] = agent.inbox.accept([message])
+        assert agent._claim_message(msg)
+        await reply(msg)
+        assert agent.inbox.take_acks() == []
+        assert not ledger.finished("m-1")
+
+        # The next fetch returns it; this time the reply goes out
+        [msg] = agent.inbox.accept([message])
+        assert agent._claim_message(msg)
+        await reply(msg)
+        assert agent.inbox.take_acks() == ["m-1"]
+        assert ledger.finished("m-1")
+        worker.cancel()
+        await agent.close()
+
+    asyncio.run(main())
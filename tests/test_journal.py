@@ -0,0 +1,41 @@
+"""Journal commits: durable waits, failures and replay."""
+
+import pytest
+
+from integrations.journal import JobJournal, JournalWriteError
+
+MESSAGE = {"id": "m-1", "sender": "requester", "content": "{}"}
+
+
+def test_records_survive_a_restart(tmp_path):
+    path = str(tmp_path / "journal.log")
+    journal = JobJournal(path)
+    journal.received(MESSAGE)
+    assert journal.wait(journal.submitted("m-1", {"prompt_id": "p-1", "backend": "gpu"}))
+    journal.received({**MESSAGE, "id": "m-2"})
+    journal.replied("m-2")
+    journal.close()
+
+    jobs = JobJournal(path).open_jobs()
+    assert [(job["id"], job["state"], job["prompt_id"]) for job in jobs] == [("m-1", "submitted", "p-1")]
+
+
+def test_failed_commit_is_reported_to_waiters_and_healed(tmp_path, monkeypatch):
+    path = str(tmp_path / "journal.log")
+    journal = JobJournal(path)
+    real_write = JobJournal._write
+
+    def disk_full(self, lines):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(JobJournal, "_write", disk_full)
+    seq = journal.received(MESSAGE)
+    with pytest.raises(JournalWriteError):
+        journal.wait(seq)
+    assert journal.stats()["write_errors"] == 1
+
+    monkeypatch.setattr(JobJournal, "_write", real_write)
+    assert journal.wait(journal.submitted("m-1", {"prompt_id": "p-1"}))
+    journal.close()
+    # The lost received record came back with the rewrite
+    assert [job["id"] for job in JobJournal(path).open_jobs()] == ["m-1"]
@@ -0,0 +1,22 @@
+"""Batch sizes, queue waits and model switches reach the registry."""
+
+from integrations.metrics import IntegrationMetrics
+from integrations.scheduler import JobScheduler
+
+
+def test_scheduler_and_batch_metrics():
+    metrics = IntegrationMetrics()
+    scheduler = JobScheduler()
+    scheduler.on_release = metrics.record_release
+    scheduler.put({"id": "1"}, "image_generation", "sdxl", "high")
+    scheduler.put({"id": "2"}, "video_generation", "wan", "normal")
+    scheduler.pick()
+    scheduler.pick()
+    metrics.batch_size.observe(3)
+
+    text = metrics.registry.render()
+    assert 'comfyui_mesh_queue_wait_seconds_count{priority="high"} 1' in text
+    assert 'comfyui_mesh_queue_wait_seconds_count{priority="normal"} 1' in text
+    assert "comfyui_mesh_model_switches_total 1" in text
+    assert 'comfyui_mesh_batch_size_bucket{le="3"} 1' in text
+    assert 'comfyui_mesh_batch_size_bucket{le="2"} 0' in text
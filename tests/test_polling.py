@@ -0,0 +1,107 @@
+"""Adaptive inbox polling: backoff, jitter, long-poll and poll metrics."""
+
+import json
+import random
+import threading
+import time
+
+from integrations.comfyui_integration import ComfyUIMeshAgent
+from integrations.inbox import InboxCursor
+from integrations.journal import JobJournal
+from integrations.ledger import MessageLedger
+from integrations.polling import LONG_POLL_HEADER, AdaptivePoller
+from integrations.result_cache import ResultCache
+from integrations.stubs import StubMesh
+
+
+def _delays(poller, n):
+    return [poller.next_delay() for _ in range(n)]
+
+
+def test_empty_polls_back_off_to_the_ceiling_and_traffic_resets():
+    poller = AdaptivePoller(min_interval=0.5, max_interval=4, backoff=2, jitter=0, long_poll=0)
+    assert poller.next_delay() == 0.5
+    delays = []
+    for _ in range(5):
+        poller.record(0)
+        delays.append(poller.next_delay())
+    assert delays == [1, 2, 4, 4, 4]
+
+    poller.record(3)
+    assert poller.next_delay() == 0.5
+
+
+def test_errors_back_off_separately():
+    poller = AdaptivePoller(min_interval=0.5, jitter=0, error_interval=1, max_error_interval=3, long_poll=0)
+    delays = []
+    for _ in range(4):
+        poller.record_error()
+        delays.append(poller.next_delay())
+    assert delays == [1, 2, 3, 3]
+
+    # A successful fetch ends the error streak without touching the poll interval
+    poller.record(0)
+    assert poller.next_delay() == 1
+    assert poller.stats()["errors"] == 4
+
+
+def test_jitter_stays_within_bounds_and_spreads_agents():
+    poller = AdaptivePoller(min_interval=1, jitter=0.2, long_poll=0, rng=random.Random(1))
+    delays = _delays(poller, 200)
+    assert all(0.8 <= delay <= 1.2 for delay in delays)
+    assert len(set(delays)) > 100
+
+    other = AdaptivePoller(min_interval=1, jitter=0.2, long_poll=0, rng=random.Random(2))
+    assert _delays(other, 5) != delays[:5]
+
+
+def test_long_poll_is_detected_from_the_first_response():
+    poller = AdaptivePoller(jitter=0, long_poll=20)
+    assert poller.query_params() == {"wait": "20"}
+    poller.record(0, {LONG_POLL_HEADER: "30"}, long_polled=True)
+    assert poller.long_poll_supported
+    # The mesh already held the read open
+    assert poller.next_delay() == 0
+
+    ignored = AdaptivePoller(jitter=0, long_poll=20)
+    ignored.record(0, {}, long_polled=True)
+    assert ignored.long_poll_supported is False
+    assert ignored.query_params() == {}
+    assert ignored.next_delay() == ignored.interval
+
+    assert AdaptivePoller(long_poll=0).wait_seconds() == 0
+
+
+def test_stats_report_wasted_polls():
+    poller = AdaptivePoller(jitter=0, long_poll=0)
+    for count in (2, 0, 0, 1):
+        poller.record(count)
+    stats = poller.stats()
+    assert (stats["polls"], stats["empty_polls"], stats["messages"]) == (4, 2, 3)
+    assert stats["wasted_fraction"] == 0.5
+    assert stats["polls_per_minute"] > 0
+    assert stats["long_poll"] is False
+
+
+def test_agent_long_polls_the_stub_mesh(tmp_path):
+    with StubMesh() as mesh:
+        agent = ComfyUIMeshAgent(
+            agent_name="poll-test", inbox=InboxCursor(str(tmp_path / "inbox.json")),
+            ledger=MessageLedger(str(tmp_path / "ledger.db")), results=ResultCache(), journal=JobJournal(),
+            poller=AdaptivePoller(long_poll=5), track_completions=False, use_websocket=False,
+        )
+        agent.mesh_url = mesh.url
+        assert agent.register_with_mesh()
+
+        content = json.dumps({"type": "inference_request"})
+        threading.Timer(0.3, mesh.deliver, (agent.mesh_agent_id, content, "requester")).start()
+        started = time.monotonic()
+        messages = agent.check_mesh_messages(long_poll=True)
+        assert 0.2 < time.monotonic() - started < 5
+        assert [message["content"] for message in messages] == [content]
+
+        stats = agent.poller.stats()
+        assert stats["long_poll"] is True
+        assert (stats["polls"], stats["long_polls"], stats["empty_polls"]) == (1, 1, 0)
+        assert agent.poller.next_delay() == 0
+        agent.transport.close()
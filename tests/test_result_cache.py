@@ -0,0 +1,32 @@
+"""Cached outputs are copied to disk piece by piece."""
+
+import os
+
+import pytest
+
+from integrations.result_cache import ResultCache
+
+RESULT = {"status": "completed", "prompt_id": "p-1", "outputs": [{"filename": "clip.mp4", "type": "output"}]}
+
+
+def test_streamed_copy_is_cached(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.db"), files_dir=str(tmp_path / "files"))
+    path = cache.save_file("k-1", "clip.mp4", (b"ab", b"cd", b"e"))
+    assert cache.store("k-1", RESULT, {"clip.mp4": path})
+
+    cached = cache.lookup("k-1")
+    with open(cached["outputs"][0]["local_path"], "rb") as f:
+        assert f.read() == b"abcde"
+    assert cache.stats()["bytes"] > 5
+
+
+def test_interrupted_copy_leaves_nothing_behind(tmp_path):
+    cache = ResultCache(files_dir=str(tmp_path / "files"))
+
+    def chunks():
+        yield b"ab"
+        raise ConnectionError("view dropped")
+
+    with pytest.raises(ConnectionError):
+        cache.save_file("k-1", "clip.mp4", chunks())
+    assert os.listdir(os.path.dirname(cache.file_path("k-1", "clip.mp4"))) == []
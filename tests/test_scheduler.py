@@ -0,0 +1,93 @@
+"""Scheduling: held jobs, priority classes, aging and preemption."""
+
+import json
+import threading
+
+from integrations.dispatcher import InferenceDispatcher
+from integrations.scheduler import InFlight, JobScheduler, message_priority
+
+
+def _request(message_id, request_type="image_generation", priority=None):
+    message = {"id": message_id, "content": json.dumps({"type": "inference_request", "request_type": request_type})}
+    if priority:
+        message["priority"] = priority
+    return message
+
+
+def test_held_count_drops_when_jobs_leave():
+    scheduler = JobScheduler()
+    jobs = [scheduler.put({"id": str(i)}, "image_generation") for i in range(3)]
+    for job in jobs:
+        scheduler.hold(job)
+    scheduler.hold(jobs[0])
+    assert scheduler.held == 3
+
+    assert scheduler.pick() is jobs[0]
+    assert scheduler.remove(lambda item: item["id"] == "1") == [jobs[1]]
+    assert scheduler.held == 1
+    assert scheduler.stats()["held"] == 1
+
+    scheduler.pick()
+    assert scheduler.held == 0
+
+
+def test_message_priority_reads_the_field_then_the_content():
+    assert message_priority({"priority": "URGENT"}) == "urgent"
+    assert message_priority({"content": json.dumps({"priority": "low"})}) == "low"
+    assert message_priority({"priority": "whenever"}) == "normal"
+    assert message_priority({"content": "not json"}) == "normal"
+
+
+def test_urgent_images_overtake_queued_videos():
+    scheduler = JobScheduler()
+    scheduler.put("video", "video_generation", group="wan")
+    scheduler.pick()
+    queued = [scheduler.put(f"video-{i}", "video_generation", group="wan") for i in range(2)]
+    urgent = scheduler.put("image", "image_generation", group="sdxl", priority="urgent")
+    # Model affinity would keep running "wan"; the urgent class goes first
+    assert scheduler.pick() is urgent
+    assert [scheduler.pick() for _ in queued] == queued
+
+    waits = scheduler.wait_times()
+    assert waits["urgent"]["released"] == 1
+    assert waits["normal"]["released"] == 3
+
+
+def test_waiting_lifts_low_priority_jobs():
+    scheduler = JobScheduler(priority_aging=0.01)
+    low = scheduler.put("low", "image_generation", priority="low")
+    low.enqueued_at -= 0.05
+    scheduler.put("high", "image_generation", priority="high")
+    assert scheduler.pick() is low
+
+
+def test_preemption_victim_is_the_newest_lowest_priority_prompt():
+    in_flight = InFlight()
+    in_flight.add("p-normal", "normal")
+    in_flight.add("p-low-1", "low")
+    in_flight.add("p-low-2", "low")
+    assert in_flight.victim("urgent") == "p-low-2"
+    assert in_flight.victim("urgent", exclude={"p-low-2"}) == "p-low-1"
+    assert in_flight.victim("low") is None
+
+
+def test_urgent_arrival_preempts_a_queued_low_priority_prompt():
+    handled = []
+    done = threading.Event()
+    low = _request("m-low", priority="low")
+
+    def handler(message):
+        handled.append(message["id"])
+        if len(handled) == 2:
+            done.set()
+
+    dispatcher = InferenceDispatcher(handler=handler, reject=lambda *_: None, max_in_flight=1,
+                                     preempt=lambda prompt_id: low if prompt_id == "p-low" else None)
+    dispatcher.prompt_submitted("p-low", "low")
+    assert dispatcher.submit(_request("m-urgent", priority="urgent"))
+    assert done.wait(5)
+    dispatcher.shutdown()
+
+    # The low prompt came back into the local queue, behind the urgent job
+    assert handled == ["m-urgent", "m-low"]
+    assert dispatcher.stats()["preempted"] == 1
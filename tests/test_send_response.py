@@ -0,0 +1,42 @@
+"""Replies go to POST /api/messages and report the mesh's answer."""
+
+import json
+
+from integrations.comfyui_integration import ComfyUIMeshAgent
+from integrations.inbox import InboxCursor
+from integrations.journal import JobJournal
+from integrations.ledger import MessageLedger
+from integrations.result_cache import ResultCache
+from integrations.stubs import StubMesh
+
+REQUEST = {"id": "m-1", "sender": "requester", "content": json.dumps({"type": "inference_request"})}
+
+
+def _agent(mesh_url, tmp_path):
+    agent = ComfyUIMeshAgent(agent_name="reply-test", inbox=InboxCursor(str(tmp_path / "inbox.json")),
+                             ledger=MessageLedger(str(tmp_path / "ledger.db")), results=ResultCache(),
+                             journal=JobJournal(), track_completions=False, use_websocket=False)
+    agent.mesh_url = mesh_url
+    return agent
+
+
+def test_reply_is_delivered_to_the_requester(tmp_path):
+    replies = []
+    with StubMesh(on_message=replies.append) as mesh:
+        agent = _agent(mesh.url, tmp_path)
+        assert agent.register_with_mesh()
+        assert agent.send_response(REQUEST, {"status": "completed"})
+        agent.transport.close()
+
+    assert len(replies) == 1
+    assert replies[0]["to_agent"] == "requester"
+    assert replies[0]["from_agent"] == agent.mesh_agent_id
+    assert json.loads(replies[0]["content"])["response"] == {"status": "completed"}
+
+
+def test_rejected_reply_is_reported_as_failed(tmp_path):
+    with StubMesh() as mesh:
+        agent = _agent(f"{mesh.url}/missing", tmp_path)
+        assert not agent.send_response(REQUEST, {"status": "completed"})
+        assert agent.metrics.errors["response_send"].value == 1
+        agent.transport.close()
@@ -0,0 +1,163 @@
+"""Request traces: context propagation, stage spans and span export."""
+
+import json
+import time
+
+import pytest
+
+from integrations.comfyui_integration import ComfyUIMeshAgent
+from integrations.inbox import InboxCursor
+from integrations.journal import JobJournal
+from integrations.ledger import MessageLedger
+from integrations.result_cache import ResultCache
+from integrations.stubs import StubMesh
+from integrations.tracing import (
+    JsonlSpanExporter, Tracer, incoming_context, mesh_timestamp, otlp_payload, reply_is_final,
+)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+def _request(message_id="m-1", **content):
+    return {"id": message_id, "sender": "requester", "created_at": "2026-01-01 12:00:00",
+            "content": json.dumps({"type": "inference_request", **content})}
+
+
+def _spans(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize("content, expected", [
+    ({"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"}, (TRACE_ID, PARENT_ID)),
+    ({"traceparent": f"00-{TRACE_ID.upper()}-{PARENT_ID}-01"}, (TRACE_ID, PARENT_ID)),
+    ({"trace_id": TRACE_ID}, (TRACE_ID, None)),
+    # All-zero and malformed ids are ignored
+    ({"traceparent": f"00-{'0' * 32}-{PARENT_ID}-01"}, (None, None)),
+    ({"trace_id": "not-hex"}, (None, None)),
+    ({}, (None, None)),
+])
+def test_incoming_context(content, expected):
+    assert incoming_context(content) == expected
+
+
+def test_mesh_timestamp_is_utc():
+    assert mesh_timestamp({"created_at": "1970-01-01 00:01:40"}) == 100
+    assert mesh_timestamp({"created_at": "1970-01-01T00:01:40Z"}) == 100
+    assert mesh_timestamp({"created_at": "yesterday"}) is None
+    assert mesh_timestamp({}) is None
+
+
+def test_reply_is_final():
+    assert reply_is_final({"error": "boom"}, tracked=True)
+    assert reply_is_final({"status": "completed"}, tracked=True)
+    assert not reply_is_final({"status": "held"}, tracked=False)
+    assert not reply_is_final({"status": "queued"}, tracked=True)
+    assert reply_is_final({"status": "queued"}, tracked=False)
+
+
+def test_spans_are_recorded_and_exported_as_json_lines(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer(JsonlSpanExporter(str(path)))
+    message = _request(traceparent=f"00-{TRACE_ID}-{PARENT_ID}-01")
+    trace = tracer.begin(message)
+    assert tracer.begin(message) is trace
+    assert tracer.begin({"id": "m-2", "content": json.dumps({"type": "chat"})}) is None
+
+    with tracer.span("outside"):
+        pass
+    with tracer.activate(trace):
+        with tracer.span("workflow_build", workflow="image_generation") as attributes:
+            attributes["nodes"] = 7
+    tracer.record_completion(message, {"prompt_id": "p-1", "status": "completed",
+                                       "timings": {"queued_seconds": 1.0, "run_seconds": 2.0}})
+    tracer.finish(message, status="completed")
+    tracer.finish(message, status="completed")
+    tracer.flush()
+
+    spans = _spans(path)
+    root = spans[0]
+    assert root["name"] == "inference_request"
+    assert (root["trace_id"], root["parent_span_id"]) == (TRACE_ID, PARENT_ID)
+    assert root["attributes"] == {"message.id": "m-1", "message.sender": "requester", "status": "completed"}
+    names = [span["name"] for span in spans[1:]]
+    assert sorted(names) == ["comfyui_execute", "comfyui_queue", "mesh_delivery", "workflow_build"]
+    assert all(span["parent_span_id"] == root["span_id"] for span in spans[1:])
+    build = next(span for span in spans if span["name"] == "workflow_build")
+    assert build["attributes"] == {"workflow": "image_generation", "nodes": 7}
+    execute = next(span for span in spans if span["name"] == "comfyui_execute")
+    assert execute["end"] - execute["start"] == pytest.approx(2.0)
+    assert tracer.stats() == {"active": 0, "started": 1, "finished": 1, "exported": 1,
+                              "export_errors": 0, "dropped": 0}
+    tracer.close()
+
+
+def test_oldest_trace_is_exported_unfinished_past_the_limit(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer(JsonlSpanExporter(str(path)), max_active=1)
+    tracer.begin(_request("m-1"))
+    tracer.begin(_request("m-2"))
+    tracer.close()
+
+    root, delivery = _spans(path)
+    assert root["attributes"]["message.id"] == "m-1"
+    assert delivery["name"] == "mesh_delivery"
+    assert root["attributes"]["incomplete"] is True
+    assert tracer.get(_request("m-2")) is not None
+
+
+def test_failed_exports_are_counted():
+    class Broken:
+        def export(self, spans):
+            raise OSError("collector down")
+
+        def close(self):
+            pass
+
+    tracer = Tracer(Broken())
+    message = _request()
+    tracer.begin(message)
+    tracer.finish(message)
+    tracer.flush()
+    assert tracer.stats()["export_errors"] == 1
+    tracer.close()
+
+
+def test_otlp_payload():
+    start = time.time()
+    spans = [{"trace_id": TRACE_ID, "span_id": PARENT_ID, "parent_span_id": None, "name": "inference_request",
+              "start": start, "end": start + 1, "attributes": {"ok": True, "n": 3, "s": 0.5, "skipped": None}}]
+    (otlp,) = otlp_payload(spans, "agent")["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert "parentSpanId" not in otlp
+    assert int(otlp["endTimeUnixNano"]) - int(otlp["startTimeUnixNano"]) == pytest.approx(1e9, rel=1e-6)
+    assert otlp["attributes"] == [
+        {"key": "ok", "value": {"boolValue": True}},
+        {"key": "n", "value": {"intValue": "3"}},
+        {"key": "s", "value": {"doubleValue": 0.5}},
+    ]
+
+
+def test_replies_carry_the_trace_id_and_the_final_one_closes_the_trace(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    replies = []
+    with StubMesh(on_message=replies.append) as mesh:
+        agent = ComfyUIMeshAgent(
+            agent_name="trace-test", inbox=InboxCursor(str(tmp_path / "inbox.json")),
+            ledger=MessageLedger(str(tmp_path / "ledger.db")), results=ResultCache(), journal=JobJournal(),
+            tracer=Tracer(JsonlSpanExporter(str(path))), track_completions=False, use_websocket=False,
+        )
+        agent.mesh_url = mesh.url
+        message = _request(trace_id=TRACE_ID)
+        agent.tracer.begin(message)
+        assert agent.send_response(message, {"status": "held", "position": 0})
+        assert agent.tracer.get(message) is not None
+        assert agent.send_response(message, {"status": "completed"})
+        assert agent.tracer.get(message) is None
+        agent.tracer.close()
+        agent.transport.close()
+
+    assert [json.loads(reply["content"])["response"]["trace_id"] for reply in replies] == [TRACE_ID, TRACE_ID]
+    spans = _spans(path)
+    assert spans[0]["attributes"]["status"] == "completed"
+    assert [span["attributes"]["status"] for span in spans if span["name"] == "response_send"] == ["held", "completed"]
@@ -0,0 +1,68 @@
+"""Workflow templates: compiled once, filled per request, validated up front."""
+
+import json
+
+import pytest
+
+from integrations.workflows import WorkflowError, WorkflowRegistry, WorkflowTemplate, default_registry
+
+SPEC = {
+    "name": "tiny",
+    "slots": {
+        "text": {"source": "prompt", "key": "positive", "type": "str", "default": ""},
+        "seed": {"source": "options", "type": "int", "default": 42},
+        "cfg": {"source": "options", "type": "number", "default": 7},
+    },
+    "workflow": {
+        "1": {"class_type": "CLIPTextEncode", "inputs": {"text": "{{text}}"}},
+        "2": {"class_type": "KSampler", "inputs": {"seed": "{{seed}}", "cfg": "{{cfg}}", "positive": ["1", 0]}},
+    },
+}
+
+
+def _template(**changes):
+    spec = {**SPEC, **changes}
+    return WorkflowTemplate(spec["name"], spec["workflow"], spec["slots"])
+
+
+def test_render_fills_slots_with_typed_values():
+    workflow = json.loads(_template().render({"positive": 'a "quoted" bison'}, {"seed": "7", "cfg": 4.5}))
+    assert workflow["1"]["inputs"]["text"] == 'a "quoted" bison'
+    assert workflow["2"]["inputs"]["seed"] == 7
+    assert workflow["2"]["inputs"]["cfg"] == 4.5
+    assert workflow["2"]["inputs"]["positive"] == ["1", 0]
+
+
+def test_defaults_apply_and_bodies_wrap_the_rendered_workflow():
+    template = _template()
+    assert template.instantiate(None, None)["2"]["inputs"]["seed"] == 42
+    body = json.loads(template.request_body({}, {"seed": 1}, client_id="agent-1"))
+    assert body == {"prompt": template.instantiate({}, {"seed": 1}), "client_id": "agent-1"}
+
+
+def test_invalid_values_and_templates_are_rejected():
+    with pytest.raises(WorkflowError):
+        _template().render({}, {"seed": "many"})
+    with pytest.raises(WorkflowError, match="missing node"):
+        _template(workflow={**SPEC["workflow"], "2": {"class_type": "KSampler", "inputs": {"positive": ["9", 0]}}})
+    with pytest.raises(WorkflowError, match="without slots"):
+        _template(slots={})
+    with pytest.raises(WorkflowError, match="never used"):
+        _template(slots={**SPEC["slots"], "steps": {"source": "options", "type": "int"}})
+
+
+def test_registry_loads_directories_and_later_files_override(tmp_path):
+    (tmp_path / "tiny.json").write_text(json.dumps({**SPEC, "description": "override"}))
+    registry = WorkflowRegistry([str(tmp_path)])
+    assert registry.names() == ["tiny"]
+    assert registry.get("tiny").description == "override"
+    with pytest.raises(WorkflowError, match="Unknown workflow"):
+        registry.get("missing")
+
+
+def test_builtin_templates_render():
+    registry = default_registry()
+    assert {"image_generation", "video_generation"} <= set(registry.names())
+    image = registry.get("image_generation").instantiate({"positive": "bison"}, {"width": 768, "batch_size": 2})
+    latent = next(node for node in image.values() if node["class_type"] == "EmptyLatentImage")
+    assert latent["inputs"]["width"] == 768 and latent["inputs"]["batch_size"] == 2